@@ -0,0 +1,27 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Shared code for the ansible-diag callback plugins.
+
+Ansible loads callback plugins by path rather than importing them as part of a package, and it blindly loads every
+.py file found in a callback directory.  Anything the plugins share therefore lives here, outside of plugins/, and
+each plugin puts the repository root on sys.path before importing from it.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
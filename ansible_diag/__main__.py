@@ -0,0 +1,51 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Command line entry point for the offline tools:
+
+    python -m ansible_diag <command> --help
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import sys
+
+from ansible_diag import (binlog, concurrency, history, overhead, payloads, regress, segments, simulate, stragglers,
+                          trace)
+
+# each module adds its own subcommand (register(subparsers)) and sets func
+COMMANDS = (history, regress, trace, concurrency, stragglers, simulate, overhead, binlog, segments, payloads)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ansible_diag')
+    subparsers = parser.add_subparsers(dest='command')
+    for module in COMMANDS:
+        module.register(subparsers)
+
+    args = parser.parse_args(argv)
+    if not getattr(args, 'func', None):
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Async job tracking: each ansible_job_id from launch, through its polls, to the result that says it finished.
+
+For every job this keeps the poll count, the gaps between polls and the time between the job actually finishing
+(the module's `end`, moved onto the controller's clock) and the poll that noticed.  Per task that gives:
+
+ - poll cost: how much longer than `poll` seconds a poll cycle really takes (an async_status round trip each time)
+ - wasted: finished -> noticed, on average about half a poll interval plus one poll cost
+ - a suggested `poll`: polling every p seconds over a job of D seconds costs (D / p) * c in polls and wastes about
+   p / 2 at the end, which is smallest at p = sqrt(2 * c * D)
+
+Ansible versions that poll inside the worker don't send a callback per poll.  There the count is inferred from the
+job's run time and the task's poll interval, and the row is marked as estimated.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import math
+from collections import OrderedDict
+
+from ansible_diag.stats import RunningStats
+
+# completed job ids remembered to drop a second report of the same completion
+RECENT_DONE = 4096
+
+# poll cost assumed when no job of a task had two observed polls to measure it from (one async_status round trip)
+DEFAULT_POLL_COST = 0.5
+
+
+def task_async_settings(task):
+    """
+    (async timeout, poll interval) for an ansible Task, None for whichever isn't set.
+    """
+    # 'async' became 'async_val' once async turned into a python keyword
+    timeout = getattr(task, 'async_val', None) or getattr(task, 'async', None)
+    poll = getattr(task, 'poll', None)
+    return (timeout or None), (poll if poll is not None else None)
+
+
+class AsyncJob(object):
+    __slots__ = ('jid', 'host', 'task', 'launched', 'timeout', 'poll_interval', 'polls', 'last_poll', 'gaps',
+                 'finished', 'noticed', 'status')
+
+    def __init__(self, jid, host, task, launched, timeout=None, poll_interval=None):
+        self.jid = jid
+        self.host = host
+        self.task = task
+        self.launched = launched
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.polls = 0
+        self.last_poll = None
+        self.gaps = RunningStats()
+        self.finished = None
+        self.noticed = None
+        self.status = None
+
+    def remaining(self, now):
+        """
+        Seconds left before the async timeout, as the v1 runner_on_async_poll `clock` argument had it.
+        """
+        if self.timeout is None:
+            return None
+        return max(0, int(round(self.timeout - (now - self.launched))))
+
+
+class AsyncTracker(object):
+    """
+    All times passed in are controller seconds on one clock (callers use ansible_diag.compat.monotonic or
+    time.time consistently).  Jobs are dropped from the active table once complete, so memory is bounded by the jobs
+    in flight, the last RECENT_DONE job ids and one summary row per task.
+    """
+
+    def __init__(self):
+        self.active = {}
+        self._done = OrderedDict()
+        # key: task, value: summary dict
+        self.tasks = OrderedDict()
+
+    def launch(self, jid, host, task, now, timeout=None, poll_interval=None):
+        job = self.active.get(jid)
+        if job is None:
+            job = self.active[jid] = AsyncJob(jid, host, task, now, timeout, poll_interval)
+        return job
+
+    def poll(self, jid, host, task, now, launched=None, timeout=None, poll_interval=None):
+        """
+        A poll result for jid.  Jobs seen first at a poll were launched at `launched` (the task start) if given.
+        """
+        job = self.active.get(jid)
+        if job is None:
+            job = self.launch(jid, host, task, now if launched is None else launched, timeout, poll_interval)
+        if job.last_poll is not None:
+            job.gaps.add(now - job.last_poll)
+        job.polls += 1
+        job.last_poll = now
+        return job
+
+    def complete(self, jid, host, task, now, status, finished=None, launched=None, timeout=None,
+                 poll_interval=None):
+        """
+        The result that reports jid done.  finished is when the job ended on the controller's clock, if known.
+        Returns the job, or None if jid was already completed (some versions report completion twice).
+        """
+        if jid in self._done:
+            return None
+        self._done[jid] = True
+        if len(self._done) > RECENT_DONE:
+            self._done.popitem(last=False)
+
+        job = self.active.pop(jid, None)
+        if job is None:
+            if launched is None:
+                return None
+            job = AsyncJob(jid, host, task, launched, timeout, poll_interval)
+        job.noticed = now
+        job.status = status
+        if finished is not None:
+            # the finish estimate can't be before launch or after the poll that saw it
+            job.finished = min(max(finished, job.launched), now)
+        self._summarize(job)
+        return job
+
+    def _summarize(self, job):
+        s = self.tasks.get(job.task)
+        if s is None:
+            s = self.tasks[job.task] = {
+                'jobs': 0, 'failed': 0, 'polls': 0, 'estimated': False, 'poll_interval': job.poll_interval,
+                'duration': RunningStats(), 'wasted': RunningStats(), 'gap_sum': 0.0, 'gaps': 0}
+        s['jobs'] += 1
+        if job.status != 'ok':
+            s['failed'] += 1
+
+        polls = job.polls
+        p = job.poll_interval
+        if not polls and p:
+            polls = max(1, int(math.ceil((job.noticed - job.launched) / p)))
+            s['estimated'] = True
+        s['polls'] += polls
+
+        end = job.finished if job.finished is not None else job.noticed
+        s['duration'].add(end - job.launched)
+        if job.finished is not None:
+            s['wasted'].add(job.noticed - job.finished)
+        s['gap_sum'] += job.gaps.mean * job.gaps.n
+        s['gaps'] += job.gaps.n
+
+    def advice(self, task):
+        """
+        (poll cost, suggested poll) for a completed task.
+        """
+        s = self.tasks[task]
+        p = s['poll_interval']
+        if s['gaps'] and p:
+            cost = max(0.0, s['gap_sum'] / s['gaps'] - p)
+        else:
+            cost = DEFAULT_POLL_COST
+        duration = s['duration'].mean
+        suggested = math.sqrt(2.0 * max(cost, 0.01) * duration) if duration > 0 else None
+        return cost, suggested
+
+    def report_lines(self):
+        lines = ['async jobs: {0} tasks, {1} jobs still running'.format(len(self.tasks), len(self.active))]
+        if not self.tasks:
+            return lines
+        lines.append('  {0:>5}  {1:>8}  {2:>7}  {3:>9}  {4:>9}  {5:>5}  {6:>9}  {7}'.format(
+            'jobs', 'mean run', 'polls', 'poll cost', 'wasted', 'poll', 'suggested', 'task'))
+        for task, s in self.tasks.items():
+            cost, suggested = self.advice(task)
+            wasted = s['wasted'].mean * s['wasted'].n
+            lines.append('  {0:>5}  {1:>7.1f}s  {2:>6}{3}  {4:>8.2f}s  {5:>8.1f}s  {6:>5}  {7:>9}  {8}'.format(
+                s['jobs'], s['duration'].mean, s['polls'], '~' if s['estimated'] else ' ', cost, wasted,
+                s['poll_interval'] if s['poll_interval'] is not None else '-',
+                '{0:.0f}s'.format(suggested) if suggested is not None else '-', task))
+        lines.append('  (~ poll count inferred from run time; suggested poll = sqrt(2 * poll cost * mean run))')
+        return lines
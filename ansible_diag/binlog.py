@@ -0,0 +1,362 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Compact binary format for task records (debug_log_json with DEBUG_LOG_JSON_STREAM_FORMAT=binlog).
+
+NDJSON repeats the host, role path and task name on every line and needs a JSON parse per record to read back.
+Here every record is a fixed 96 byte row: the seven times as float64 (NaN for none), the result payload's offset
+(int64) and length, and the seven strings as int32 ids into a per-file string table (0 is None).  Result payloads
+(compact JSON) live in blob blocks beside the rows and are only touched when asked for.
+
+The file is a header (magic, version, row size) followed by blocks, each an 8 byte tag/length header and a payload
+padded to 8 bytes:
+
+    STRS  strings new in this batch: (uint32 length, utf-8 bytes) ..., ids continue from the previous STRS block
+    BLOB  result payloads; a row's payload offset is its absolute position in the file
+    RECS  rows
+
+The writer appends one STRS/BLOB/RECS group per batch, so a run that dies mid-write leaves a readable file up to the
+last complete block.  BinlogReader mmaps the file: rows() unpacks straight from the map, and column() exposes a
+field of a RECS block as a strided memoryview over the mapped bytes, with no copy and no per-record objects.
+All values are little-endian.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from ansible_diag.writer import BackgroundWriter
+
+MAGIC = b'ADBL'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHH')
+_BLOCK = struct.Struct('<4sI')
+_STRLEN = struct.Struct('<I')
+
+FLOAT_FIELDS = ('start', 'end', 'duration', 'ctl_start', 'ctl_end', 'ctl_mono', 'overhead')
+STRING_FIELDS = ('runnercode', 'rolename', 'rolepath', 'taskname', 'host', 'play', 'taskid')
+
+# 7 float64, payload offset int64, payload length + 7 string ids int32
+ROW = struct.Struct('<7dq8i')
+ROW_SIZE = ROW.size
+
+_NAN = float('nan')
+
+# column views need the file's byte order to match ours
+_NATIVE = sys.byteorder == 'little' and hasattr(memoryview, 'cast')
+
+# python 2's mmap has no buffer interface, so memoryviews of it need a copy
+_MMAP_VIEWS = sys.version_info[0] >= 3
+
+# python 2's array has no 'q': int64 columns (payload offsets) come back as lists there
+try:
+    array('q')
+    _ARRAY_Q = True
+except ValueError:
+    _ARRAY_Q = False
+
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=str)
+
+
+def _pad(n):
+    return (8 - n % 8) % 8
+
+
+def is_binlog(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BinlogWriter(BackgroundWriter):
+    """
+    Streams TaskRecords to path in the binary format.  Interning, payload encoding and packing happen on the writer
+    thread.
+    """
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self._strings = {None: 0}
+        self._pos = 0
+        kwargs.setdefault('name', 'diag-binlog-writer')
+        super(BinlogWriter, self).__init__(open(path, 'wb'), **kwargs)
+
+    def _open(self):
+        self._stream.write(_HEADER.pack(MAGIC, VERSION, ROW_SIZE))
+        self._pos = _HEADER.size
+
+    def _block(self, tag, payload):
+        pad = _pad(len(payload))
+        return [_BLOCK.pack(tag, len(payload)), payload, b'\0' * pad], _BLOCK.size + len(payload) + pad
+
+    def _write_batch(self, batch):
+        strings = self._strings
+        new_strings = []
+        blobs = []
+        blob_len = 0
+        rows = []
+        for rec in batch:
+            try:
+                ids = []
+                for name in STRING_FIELDS:
+                    value = getattr(rec, name)
+                    sid = strings.get(value)
+                    if sid is None:
+                        sid = strings[value] = len(strings)
+                        new_strings.append(value)
+                    ids.append(sid)
+                if rec.result is None:
+                    payload = b''
+                else:
+                    payload = _encoder.encode(rec.result).encode('utf-8')
+                times = [_NAN if getattr(rec, name) is None else float(getattr(rec, name)) for name in FLOAT_FIELDS]
+            except Exception:
+                self.errors += 1
+                continue
+            rows.append((times, blob_len if payload else -1, len(payload), ids))
+            if payload:
+                blobs.append(payload)
+                blob_len += len(payload)
+
+        # strings interned by records that then failed still go out: their ids are taken, later rows may use them
+        if not rows and not new_strings:
+            return
+
+        chunks = []
+        pos = self._pos
+        if new_strings:
+            data = []
+            for s in new_strings:
+                if not isinstance(s, bytes):
+                    s = u'{0}'.format(s).encode('utf-8')
+                data.append(_STRLEN.pack(len(s)))
+                data.append(s)
+            block, size = self._block(b'STRS', b''.join(data))
+            chunks.extend(block)
+            pos += size
+
+        blob_base = pos + _BLOCK.size
+        if blobs:
+            block, size = self._block(b'BLOB', b''.join(blobs))
+            chunks.extend(block)
+            pos += size
+
+        if rows:
+            packed = []
+            pack = ROW.pack
+            for times, offset, length, ids in rows:
+                packed.append(pack(*(times + [blob_base + offset if offset >= 0 else 0, length] + ids)))
+            block, size = self._block(b'RECS', b''.join(packed))
+            chunks.extend(block)
+            pos += size
+
+        self._stream.write(b''.join(chunks))
+        self._pos = pos
+        self.written += len(rows)
+
+
+class BinlogReader(object):
+    """
+    Read side of the format, over an mmap of the file.  Iterating gives dicts shaped like TaskRecord.as_dict()
+    (without the result unless payloads=True is passed to records()).
+
+    Views returned by column_views() and raw_payload() point into the map (on python 3); drop them before close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = [None]
+        # (offset, rows) per RECS block
+        self.blocks = []
+        self._f = open(path, 'rb')
+        self._mm = None
+
+        size = os.fstat(self._f.fileno()).st_size
+        if size < _HEADER.size:
+            raise ValueError('{0}: not a binlog file'.format(path))
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, row_size = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError('{0}: not a binlog file'.format(path))
+        if version != VERSION or row_size != ROW_SIZE:
+            raise ValueError('{0}: unsupported binlog version {1} (row size {2})'.format(path, version, row_size))
+        self._scan(size)
+
+    def _scan(self, size):
+        mm = self._mm
+        pos = _HEADER.size
+        while pos + _BLOCK.size <= size:
+            tag, length = _BLOCK.unpack_from(mm, pos)
+            start = pos + _BLOCK.size
+            end = start + length + _pad(length)
+            if start + length > size:
+                # a block cut short by a killed run
+                break
+            if tag == b'STRS':
+                self._read_strings(start, start + length)
+            elif tag == b'RECS':
+                self.blocks.append((start, length // ROW_SIZE))
+            pos = end
+
+    def _read_strings(self, pos, end):
+        mm = self._mm
+        strings = self.strings
+        while pos < end:
+            n, = _STRLEN.unpack_from(mm, pos)
+            pos += _STRLEN.size
+            strings.append(mm[pos:pos + n].decode('utf-8'))
+            pos += n
+
+    def __len__(self):
+        return sum(n for _, n in self.blocks)
+
+    def rows(self):
+        """
+        Raw row tuples: 7 floats, payload offset, payload length, 7 string ids (ROW layout).
+        """
+        mm = self._mm
+        unpack_from = ROW.unpack_from
+        for offset, n in self.blocks:
+            for i in range(n):
+                yield unpack_from(mm, offset + i * ROW_SIZE)
+
+    def records(self, payloads=False):
+        strings = self.strings
+        nan_free = lambda v: None if v != v else v
+        for row in self.rows():
+            rec = {'entrytype': 'TASK_RECORD'}
+            for i, name in enumerate(FLOAT_FIELDS):
+                rec[name] = nan_free(row[i])
+            for i, name in enumerate(STRING_FIELDS):
+                rec[name] = strings[row[9 + i]]
+            if payloads:
+                rec['result'] = self.payload(row[7], row[8])
+            yield rec
+
+    __iter__ = records
+
+    def raw_payload(self, offset, length):
+        if length <= 0:
+            return None
+        if not _MMAP_VIEWS:
+            return memoryview(self._mm[offset:offset + length])
+        return memoryview(self._mm)[offset:offset + length]
+
+    def payload(self, offset, length):
+        if length <= 0:
+            return None
+        return json.loads(self._mm[offset:offset + length].decode('utf-8'))
+
+    def column_views(self, name):
+        """
+        One view per RECS block of a field: floats as 'd', string ids as 'i' (look them up in self.strings),
+        payload offsets as 'q'.  Zero-copy, strided over the rows.
+        """
+        if name in FLOAT_FIELDS:
+            fmt, index, per_row = 'd', FLOAT_FIELDS.index(name), ROW_SIZE // 8
+        elif name in STRING_FIELDS:
+            fmt, index, per_row = 'i', 17 + STRING_FIELDS.index(name), ROW_SIZE // 4
+        elif name == 'payload_offset':
+            fmt, index, per_row = 'q', 7, ROW_SIZE // 8
+        elif name == 'payload_length':
+            fmt, index, per_row = 'i', 16, ROW_SIZE // 4
+        else:
+            raise KeyError(name)
+
+        if not _NATIVE:
+            # python 2 or a big-endian host: unpack into arrays (lists for 'q' without it) instead
+            single = struct.Struct('<' + fmt)
+            skip = index * single.size
+            for offset, n in self.blocks:
+                values = [single.unpack_from(self._mm, offset + i * ROW_SIZE + skip)[0] for i in range(n)]
+                yield array(fmt, values) if fmt != 'q' or _ARRAY_Q else values
+            return
+
+        mv = memoryview(self._mm)
+        for offset, n in self.blocks:
+            yield mv[offset:offset + n * ROW_SIZE].cast(fmt)[index::per_row]
+
+    def column(self, name):
+        """
+        A whole field as one array (a copy, but no per-record objects; a list for payload_offset on python 2).
+        """
+        out = None
+        for view in self.column_views(name):
+            if isinstance(view, list):
+                part = view
+            else:
+                part = array(view.format if hasattr(view, 'format') else view.typecode, view.tolist())
+            if out is None:
+                out = part
+            else:
+                out.extend(part)
+        return out if out is not None else array('d')
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def cmd_binlog(args):
+    if args.action == 'convert':
+        # local import: ansible_diag.loaders reads binlog files through this module
+        from ansible_diag.loaders import iter_records
+        from ansible_diag.records import TaskRecord
+
+        writer = BinlogWriter(args.output, maxsize=0)
+        for rec in iter_records(args.input):
+            writer.put(TaskRecord(*[rec.get(name) for name in TaskRecord.__slots__]))
+        writer.close()
+        print('{0}: {1} records ({2} errors), {3} bytes'.format(args.output, writer.written, writer.errors,
+                                                                os.path.getsize(args.output)))
+        return 1 if writer.errors else 0
+
+    with BinlogReader(args.input) as reader:
+        size = os.path.getsize(args.input)
+        rows = len(reader)
+        print('{0}: {1} records in {2} blocks, {3} strings, {4} bytes ({5:.0f} per record)'.format(
+            args.input, rows, len(reader.blocks), len(reader.strings) - 1, size, size / rows if rows else 0))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('binlog', help='convert to / inspect the binary record format',
+                              description='Convert a debug_log_json stream to the binary format, or summarize a '
+                                          'binary file.')
+    sub = p.add_subparsers(dest='action')
+    sub.required = True
+    c = sub.add_parser('convert', help='NDJSON (or binlog) stream -> binlog')
+    c.add_argument('input')
+    c.add_argument('output')
+    i = sub.add_parser('info', help='record/string/block counts of a binlog file')
+    i.add_argument('input')
+    p.set_defaults(func=cmd_binlog)
@@ -0,0 +1,250 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+One capture core shared by every diag callback plugin.
+
+ansible calls each enabled callback plugin in turn for every event, so with execution_diag, debug_log_json and
+profile_timeline all on, each event used to be unpacked three times: three result._host.get_name() calls, three
+clock reads, three copies of the current task.  Instead, plugins mix in CaptureMixin and register themselves as
+sinks with the module level `core`.  One plugin leads: the first one ansible calls.  Its calls are normalized into an
+Event (host and task names looked up once, one monotonic clock read) and that same object goes to every sink.  The
+other plugins' routed hooks return at once, so each extra plugin costs a type check per event.  Leading by plugin
+rather than spotting a repeated call keeps working when ansible hands each plugin its own copy of a result
+(TaskResult.clean_copy() in 2.4+), where nothing about the arguments is shared between the calls.
+
+A sink is any object with on_<kind>(event) methods for the kinds it cares about (KINDS below), and optionally
+on_event(event), which gets every event first.  The plugins are the sinks: profile_timeline (timeline),
+debug_log_json (records, JSON tree, history) and execution_diag (raw hook log).  Hooks the mixin doesn't route
+(vars prompts, setup, ...) still reach each plugin's own v2_* methods the usual way.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import time
+
+from ansible_diag.compat import monotonic
+
+KINDS = ('playbook_start', 'play_start', 'task_start', 'handler_start', 'cleanup_start', 'result', 'item',
+         'async_poll', 'async_result', 'notify', 'include', 'stats')
+
+
+class Event(object):
+    """
+    One normalized ansible event.  mono is the monotonic clock when it was captured; wall is the same instant in
+    epoch seconds (derived from mono, so the two always agree).  status is ok/failed/skipped/unreachable for
+    results, items and async results.  obj is the hook's main object when it isn't a task result (playbook, play,
+    stats, handler, included file).
+
+    task is the event's own task (a handler for handler results), not whichever task started last: under the free
+    strategy, and once handlers run, results of different tasks interleave.  started/started_mono are when that
+    task (or handler) last started on the controller, None if its start wasn't seen.
+    """
+    __slots__ = ('hook', 'kind', 'status', 'mono', 'wall', 'host', 'task', 'task_uuid', 'task_name', 'result',
+                 'obj', 'ignore_errors', 'started', 'started_mono')
+
+    def __init__(self, hook, kind, status, mono, wall):
+        self.hook = hook
+        self.kind = kind
+        self.status = status
+        self.mono = mono
+        self.wall = wall
+        self.host = None
+        self.task = None
+        self.task_uuid = None
+        self.task_name = None
+        self.result = None
+        self.obj = None
+        self.ignore_errors = False
+        self.started = None
+        self.started_mono = None
+
+
+def _host_name(host):
+    get_name = getattr(host, 'get_name', None)
+    return get_name() if get_name else str(host)
+
+
+class CaptureCore(object):
+
+    def __init__(self):
+        # wall clock = _wall0 + (monotonic - _mono0)
+        self._mono0 = monotonic()
+        self._wall0 = time.time()
+
+        # key: sink name, value: sink.  A plugin instantiated again replaces its old sink instead of doubling up.
+        self._sinks = {}
+        # key: kind, value: [bound on_<kind> methods]; rebuilt when sinks change
+        self._handlers = {}
+
+        # class of the plugin whose calls feed the core; claimed by the first plugin to call, per class so a plugin
+        # instantiated again (a new TaskQueueManager) carries on leading
+        self._leader = None
+
+        # the last task seen, so its name and uuid are looked up once, not per result
+        self._task = None
+        self._task_name = None
+        self._task_uuid = None
+
+        # key: task uuid, value: (wall, mono) of its last start.  Tasks and handlers alike; cleared each play.
+        self._starts = {}
+
+        self.events = 0
+
+    def add_sink(self, name, sink):
+        self._sinks[name] = sink
+        self._rebuild()
+
+    def remove_sink(self, name):
+        sink = self._sinks.pop(name, None)
+        if sink is not None:
+            if type(sink) is self._leader:
+                # whichever plugin calls next takes over
+                self._leader = None
+            self._rebuild()
+
+    def _rebuild(self):
+        handlers = dict((kind, []) for kind in KINDS)
+        for name in sorted(self._sinks):
+            sink = self._sinks[name]
+            every = getattr(sink, 'on_event', None)
+            for kind in KINDS:
+                if every is not None:
+                    handlers[kind].append(every)
+                method = getattr(sink, 'on_' + kind, None)
+                if method is not None:
+                    handlers[kind].append(method)
+        self._handlers = handlers
+
+    def _task_names(self, task):
+        if task is not self._task:
+            self._task = task
+            self._task_name = task.get_name() if task is not None else None
+            uuid = getattr(task, '_uuid', None)
+            self._task_uuid = uuid if uuid else id(task)
+        return self._task_name, self._task_uuid
+
+    def capture(self, plugin, hook, kind, status, args):
+        """
+        Called by every plugin for every routed hook.  Only the leader's calls are built into events and dispatched;
+        the same hook reaching the other plugins is dropped.
+        """
+        leader = self._leader
+        if leader is None:
+            leader = self._leader = type(plugin)
+        if type(plugin) is not leader:
+            return
+
+        mono = monotonic()
+        event = Event(hook, kind, status, mono, self._wall0 + (mono - self._mono0))
+        self._normalize(event, args)
+        self._task_started(event)
+        self.events += 1
+        for handler in self._handlers.get(kind, ()):
+            handler(event)
+
+    def _task_started(self, event):
+        kind = event.kind
+        if kind in ('task_start', 'handler_start', 'cleanup_start'):
+            self._starts[event.task_uuid] = (event.wall, event.mono)
+            event.started, event.started_mono = event.wall, event.mono
+        elif kind == 'play_start':
+            self._starts.clear()
+        elif event.task_uuid is not None:
+            started = self._starts.get(event.task_uuid)
+            if started is not None:
+                event.started, event.started_mono = started
+
+    def _normalize(self, event, args):
+        kind = event.kind
+        first = args[0] if args else None
+        if kind in ('result', 'item', 'async_poll', 'async_result'):
+            event.host = _host_name(first._host)
+            event.task = first._task
+            event.task_name, event.task_uuid = self._task_names(first._task)
+            event.result = first._result
+            if len(args) > 1:
+                event.ignore_errors = args[1]
+        elif kind in ('task_start', 'handler_start', 'cleanup_start'):
+            event.task = first
+            event.task_name, event.task_uuid = self._task_names(first)
+        elif kind == 'notify':
+            # 2.0 passes (result, handler), later versions (handler, host)
+            if hasattr(first, '_host'):
+                event.host = _host_name(first._host)
+                event.task = first._task
+                event.result = first._result
+                event.obj = args[1]
+            else:
+                event.obj = first
+                event.host = _host_name(args[1])
+                event.task = self._task
+            event.task_name, event.task_uuid = self._task_names(event.task)
+        elif kind == 'playbook_start':
+            event.obj = first
+            event.task_name = os.path.basename(getattr(first, '_file_name', '') or '')
+        elif kind == 'play_start':
+            event.obj = first
+            event.task_name = getattr(first, 'name', None)
+        else:
+            event.obj = first
+
+
+# shared by all plugins loaded in this process
+core = CaptureCore()
+
+
+def _route(hook, kind, status=None):
+    def method(self, *args):
+        core.capture(self, hook, kind, status, args)
+    method.__name__ = hook
+    return method
+
+
+class CaptureMixin(object):
+    """
+    v2 hooks that feed the capture core.  List it before CallbackBase, and register the plugin (or another sink) with
+    core.add_sink() in __init__.
+    """
+    v2_playbook_on_start = _route('v2_playbook_on_start', 'playbook_start')
+    v2_playbook_on_play_start = _route('v2_playbook_on_play_start', 'play_start')
+    v2_playbook_on_task_start = _route('v2_playbook_on_task_start', 'task_start')
+    v2_playbook_on_handler_task_start = _route('v2_playbook_on_handler_task_start', 'handler_start')
+    v2_playbook_on_cleanup_task_start = _route('v2_playbook_on_cleanup_task_start', 'cleanup_start')
+
+    v2_runner_on_ok = _route('v2_runner_on_ok', 'result', 'ok')
+    v2_runner_on_failed = _route('v2_runner_on_failed', 'result', 'failed')
+    v2_runner_on_skipped = _route('v2_runner_on_skipped', 'result', 'skipped')
+    v2_runner_on_unreachable = _route('v2_runner_on_unreachable', 'result', 'unreachable')
+
+    v2_playbook_item_on_ok = _route('v2_playbook_item_on_ok', 'item', 'ok')
+    v2_playbook_item_on_failed = _route('v2_playbook_item_on_failed', 'item', 'failed')
+    v2_playbook_item_on_skipped = _route('v2_playbook_item_on_skipped', 'item', 'skipped')
+    # later ansible names for the same
+    v2_runner_item_on_ok = _route('v2_runner_item_on_ok', 'item', 'ok')
+    v2_runner_item_on_failed = _route('v2_runner_item_on_failed', 'item', 'failed')
+    v2_runner_item_on_skipped = _route('v2_runner_item_on_skipped', 'item', 'skipped')
+
+    v2_runner_on_async_poll = _route('v2_runner_on_async_poll', 'async_poll')
+    v2_runner_on_async_ok = _route('v2_runner_on_async_ok', 'async_result', 'ok')
+    v2_runner_on_async_failed = _route('v2_runner_on_async_failed', 'async_result', 'failed')
+
+    v2_playbook_on_notify = _route('v2_playbook_on_notify', 'notify')
+    v2_playbook_on_include = _route('v2_playbook_on_include', 'include')
+    v2_playbook_on_stats = _route('v2_playbook_on_stats', 'stats')
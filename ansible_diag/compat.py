@@ -0,0 +1,45 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+#
+# Ansible 2.0 still runs the controller on python 2, so everything in ansible_diag sticks to the 2/3 common subset.
+#
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    string_types = (basestring,)
+except NameError:
+    string_types = (str, bytes)
+
+# python 2 has no monotonic clock in the stdlib
+try:
+    from time import monotonic
+except ImportError:
+    from time import time as monotonic
+
+# nor a high resolution timer for benchmarks
+try:
+    from time import perf_counter
+except ImportError:
+    from time import time as perf_counter
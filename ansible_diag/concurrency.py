@@ -0,0 +1,197 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Fork utilization: how many hosts were actually executing at each instant, against the configured forks.
+
+The sweep only keeps two float arrays (span starts and span ends), sorts each once and merges them, so it is
+O(n log n) time and 16 bytes per span.  Linear strategy barriers are rolled up per task as the records stream past.
+A task can use min(forks, hosts) slots from its first host starting to its last host finishing; whatever of that
+isn't spent running hosts is idle, waiting on the slowest ones.  Per task that needs only count, SUM(duration),
+MIN(start) and MAX(end).
+
+    python -m ansible_diag concurrency run.ndjson --forks 25
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from array import array
+
+from ansible_diag.loaders import iter_records
+from ansible_diag.spans import SpanClock, task_key
+
+
+class ConcurrencyReport(object):
+
+    def __init__(self, forks):
+        self.forks = forks
+        self._span_times = SpanClock()
+        self._starts = array('d')
+        self._ends = array('d')
+        # key: task key, value: [name, hosts, SUM(duration), MAX(end), MIN(start)]
+        self._tasks = {}
+
+        # filled in by compute()
+        self.first = None
+        self.last = None
+        self.peak = 0
+        self.busy_slot_seconds = 0.0
+        # key: concurrency level (capped at forks), value: seconds spent at that level
+        self.time_at_level = {}
+        self.barrier_idle = 0.0
+
+    def add(self, rec):
+        times = self._span_times(rec)
+        if times is None:
+            return
+        start, end = times
+        self._starts.append(start)
+        self._ends.append(end)
+
+        key = task_key(rec)
+        t = self._tasks.get(key)
+        if t is None:
+            self._tasks[key] = [rec.get('taskname'), 1, end - start, end, start]
+        else:
+            t[1] += 1
+            t[2] += end - start
+            if end > t[3]:
+                t[3] = end
+            if start < t[4]:
+                t[4] = start
+
+    def compute(self):
+        starts = sorted(self._starts)
+        ends = sorted(self._ends)
+        n = len(starts)
+        if not n:
+            return self
+
+        self.first = starts[0]
+        self.last = ends[-1]
+
+        i = j = 0
+        level = 0
+        prev = starts[0]
+        time_at_level = {}
+        busy = 0.0
+        peak = 0
+        while j < n:
+            # ends before starts at the same instant, so back to back tasks don't look concurrent
+            if i < n and starts[i] < ends[j]:
+                t = starts[i]
+                step = 1
+                i += 1
+            else:
+                t = ends[j]
+                step = -1
+                j += 1
+
+            dt = t - prev
+            if dt > 0:
+                busy += level * dt
+                capped = min(level, self.forks)
+                time_at_level[capped] = time_at_level.get(capped, 0.0) + dt
+            prev = t
+            level += step
+            if level > peak:
+                peak = level
+
+        self.peak = peak
+        self.busy_slot_seconds = busy
+        self.time_at_level = time_at_level
+        self.barrier_idle = sum(row[0] for row in self._barriers())
+        return self
+
+    def _barriers(self):
+        forks = self.forks
+        for name, hosts, busy, max_end, min_start in self._tasks.values():
+            wall = max_end - min_start
+            yield max(0.0, min(forks, hosts) * wall - busy), hosts, wall, name
+
+    @property
+    def wall(self):
+        return (self.last - self.first) if self.first is not None else 0.0
+
+    @property
+    def average(self):
+        return self.busy_slot_seconds / self.wall if self.wall > 0 else 0.0
+
+    def worst_barriers(self, n=10):
+        """
+        [(idle slot-seconds, hosts, task wall, name), ...] for the n tasks that wasted the most waiting on stragglers
+        """
+        rows = list(self._barriers())
+        rows.sort(key=lambda r: r[0], reverse=True)
+        return rows[:n]
+
+
+def _pct(part, whole):
+    return 100.0 * part / whole if whole > 0 else 0.0
+
+
+def cmd_concurrency(args):
+    report = ConcurrencyReport(args.forks)
+    for rec in iter_records(args.input):
+        report.add(rec)
+    report.compute()
+
+    if report.first is None:
+        print('no task records with times')
+        return 1
+
+    wall = report.wall
+    forks = report.forks
+    print('spans: {0}  wall: {1:.1f}s  forks: {2}'.format(len(report._starts), wall, forks))
+    print('concurrency: average {0:.2f}  peak {1}'.format(report.average, report.peak))
+    print('utilization: average {0:.1f}% of forks  (slot-seconds busy {1:.1f} of {2:.1f})'.format(
+        _pct(report.average, forks), report.busy_slot_seconds, wall * forks))
+    print('')
+    print('time at each concurrency level:')
+    for level in sorted(report.time_at_level):
+        label = '>={0}'.format(level) if level == forks else str(level)
+        seconds = report.time_at_level[level]
+        print('  {0:>5}  {1:>9.1f}s  {2:>5.1f}%'.format(label, seconds, _pct(seconds, wall)))
+
+    print('')
+    print('linear strategy barriers: {0:.1f} slot-seconds idle waiting on the slowest host ({1:.1f}% of capacity)'
+          .format(report.barrier_idle, _pct(report.barrier_idle, wall * forks)))
+    for idle, hosts, task_wall, name in report.worst_barriers(args.top):
+        print('  {0:>9.1f}  {1:>6} hosts  {2:>8.1f}s wall  {3}'.format(idle, hosts, task_wall, name))
+
+    saturated = report.time_at_level.get(forks, 0.0)
+    print('')
+    if report.peak < forks:
+        print('verdict: never more than {0} hosts at once; more forks would not help.'.format(report.peak))
+    elif _pct(saturated, wall) >= 50:
+        print('verdict: all forks busy {0:.0f}% of the time; more forks would likely help.'.format(
+            _pct(saturated, wall)))
+    else:
+        print('verdict: all forks busy only {0:.0f}% of the time; time goes to barriers and stragglers more than '
+              'fork limits.'.format(_pct(saturated, wall)))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('concurrency', help='fork utilization and concurrency report',
+                              description='How many hosts were executing at each instant, against the configured '
+                                          'forks, and the idle time spent in linear strategy barriers.')
+    p.add_argument('input', help='debug_log_json NDJSON stream')
+    p.add_argument('--forks', type=int, default=5, help='configured forks (default 5, ansible\'s default)')
+    p.add_argument('--top', type=int, default=10, help='tasks with the most barrier idle time to list')
+    p.set_defaults(func=cmd_concurrency)
@@ -0,0 +1,167 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Handler spans and where their notifications came from.
+
+A handler run is a span per host, from the handler task starting to that host's result arriving, like any other
+task (ansible_diag.timeline), plus the notifications that queued it: which tasks notified it, on how many hosts, and
+how many of those notifications came from results that only claimed a change.  Those are results of modules that
+report changed on every run unless the task sets changed_when (command, shell, ...), or results whose diff shows
+nothing different.  A service restart that every run triggers from a shell task is the usual culprit.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from collections import OrderedDict
+
+from ansible_diag.sketch import QuantileSketch, TopN
+
+# modules that say changed whenever they run, unless the task overrides it with changed_when
+ALWAYS_CHANGED = frozenset(('command', 'shell', 'raw', 'script', 'win_command', 'win_shell'))
+
+
+def handler_name(handler):
+    get_name = getattr(handler, 'get_name', None)
+    return get_name() if get_name else str(handler)
+
+
+def _diff_empty(diff):
+    if isinstance(diff, list):
+        return bool(diff) and all(_diff_empty(d) for d in diff)
+    if isinstance(diff, dict):
+        return 'before' in diff and 'after' in diff and diff['before'] == diff['after']
+    return False
+
+
+def spurious_change(task, result):
+    """
+    True if a changed result probably didn't change anything: an always-changed module with no changed_when, or a
+    diff with identical before and after.
+    """
+    if 'diff' in result and _diff_empty(result['diff']):
+        return True
+    action = getattr(task, 'action', None)
+    return action in ALWAYS_CHANGED and not getattr(task, 'changed_when', None)
+
+
+class HandlerStats(object):
+    __slots__ = ('name', 'notifications', 'spurious', 'notifiers', 'runs', 'durations', 'statuses', 'start', 'end')
+
+    def __init__(self, name):
+        self.name = name
+        # host level notifications (one task result notifying this handler)
+        self.notifications = 0
+        self.spurious = 0
+        # key: notifying task name, value: notifications
+        self.notifiers = OrderedDict()
+        # times the handler task ran (once per flush that had it pending)
+        self.runs = 0
+        self.durations = QuantileSketch()
+        self.statuses = {}
+        self.start = None
+        self.end = None
+
+
+class HandlerTracker(object):
+    """
+    Notifications and handler spans for a run.  Memory is one HandlerStats per handler (with a counter per notifying
+    task), one fan-out counter per notifying task and one running total per host.
+    """
+
+    def __init__(self):
+        self.handlers = OrderedDict()
+        # key: notifying task name, value: [notifications, set of handler names]
+        self.fanout = OrderedDict()
+        # key: host, value: seconds spent in handlers
+        self.host_time = {}
+        self._current = None
+
+    def _handler(self, name):
+        h = self.handlers.get(name)
+        if h is None:
+            h = self.handlers[name] = HandlerStats(name)
+        return h
+
+    def notify(self, handler, host, task_name, spurious=False):
+        h = self._handler(handler)
+        h.notifications += 1
+        if spurious:
+            h.spurious += 1
+        h.notifiers[task_name] = h.notifiers.get(task_name, 0) + 1
+
+        f = self.fanout.get(task_name)
+        if f is None:
+            f = self.fanout[task_name] = [0, set()]
+        f[0] += 1
+        f[1].add(handler)
+
+    def handler_start(self, name, now):
+        h = self._current = self._handler(name)
+        h.runs += 1
+        h.start = now
+        h.end = None
+
+    def task_start(self):
+        # a regular task starting means no handler is running any more
+        self._current = None
+
+    def host_done(self, host, now, status):
+        """
+        A result for the running handler, if there is one.  Returns True if it was a handler result.
+        """
+        h = self._current
+        if h is None:
+            return False
+        seconds = now - h.start
+        h.durations.add(seconds)
+        h.statuses[status] = h.statuses.get(status, 0) + 1
+        h.end = now
+        self.host_time[host] = self.host_time.get(host, 0.0) + seconds
+        return True
+
+    def report_lines(self, top_n=10):
+        lines = []
+        if not self.handlers:
+            return lines
+        lines.append('handlers: notifications (spurious), runs, host runs, p50/p90/max per host, total host time')
+        for h in sorted(self.handlers.values(), key=lambda h: h.durations.sum, reverse=True):
+            d = h.durations
+            lines.append('  {0:>6} ({1:>5}) {2:>4} {3:>6}  {4}  {5:>8.1f}s  {6}'.format(
+                h.notifications, h.spurious, h.runs, d.count,
+                '{0:.1f}/{1:.1f}/{2:.1f}'.format(d.quantile(0.5), d.quantile(0.9), d.max) if d.count else '-',
+                d.sum, h.name))
+            notifiers = sorted(h.notifiers.items(), key=lambda kv: kv[1], reverse=True)
+            lines.append('         notified by: ' + ', '.join('{0} ({1})'.format(t, n) for t, n in notifiers[:5]) +
+                         (', ...' if len(notifiers) > 5 else ''))
+
+        lines.append('notify fan-out by task: notifications, handlers')
+        top = TopN(top_n)
+        for task, (count, handlers) in self.fanout.items():
+            top.push(count, (task, len(handlers)))
+        for count, (task, handlers) in top.items():
+            lines.append('  {0:>6} {1:>4}  {2}'.format(count, handlers, task))
+
+        if self.host_time:
+            lines.append('hosts by handler time:')
+            top = TopN(top_n)
+            for host, seconds in self.host_time.items():
+                top.push(seconds, host)
+            for seconds, host in top.items():
+                lines.append('  {0:>8.1f}s  {1}'.format(seconds, host))
+        return lines
@@ -0,0 +1,308 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Local, multi-run history of task timings, in SQLite.
+
+Callbacks feed it through HistoryRecorder, which batches inserts on a background thread.  The database runs in WAL
+mode so the query CLI (python -m ansible_diag history ...) can read while a run is being recorded.
+
+    runs        one row per ansible-playbook run
+    records     one row per task result: (run, playbook, role, task, host, status, start, end, duration, changed)
+    task_runs   one row per (run, role, task): hosts, min/p50/p90/p99/max/total duration.  Written when a run is
+                closed, so trends over hundreds of runs read a few hundred rows instead of every host's records.
+
+records is indexed on (playbook, role, task, host, run), which covers the per-task and per-host lookups.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import sqlite3
+import time
+
+from ansible_diag.writer import BackgroundWriter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    playbook    TEXT,
+    started     REAL,
+    finished    REAL
+);
+CREATE TABLE IF NOT EXISTS records (
+    run         INTEGER NOT NULL,
+    playbook    TEXT,
+    role        TEXT,
+    task        TEXT,
+    host        TEXT,
+    status      TEXT,
+    start       REAL,
+    end         REAL,
+    duration    REAL,
+    changed     INTEGER
+);
+CREATE INDEX IF NOT EXISTS records_identity ON records (playbook, role, task, host, run);
+CREATE INDEX IF NOT EXISTS records_run ON records (run);
+CREATE TABLE IF NOT EXISTS task_runs (
+    run         INTEGER NOT NULL,
+    playbook    TEXT,
+    role        TEXT,
+    task        TEXT,
+    started     REAL,
+    hosts       INTEGER,
+    total       REAL,
+    min         REAL,
+    p50         REAL,
+    p90         REAL,
+    p99         REAL,
+    max         REAL
+);
+CREATE INDEX IF NOT EXISTS task_runs_identity ON task_runs (playbook, role, task, started);
+"""
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest-rank percentile of an already sorted list (q in 0..1).
+    """
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class HistoryRecorder(BackgroundWriter):
+    """
+    Records one run into the history database.  start_run(), record() and close() only queue work; the
+    connection is opened, written and committed on the writer thread, one transaction per batch.
+    """
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        self._conn = None
+        self._run_id = None
+        kwargs.setdefault('name', 'diag-history-writer')
+        super(HistoryRecorder, self).__init__(**kwargs)
+
+    def start_run(self, playbook, started=None):
+        self.put(('run', playbook, started or time.time()))
+
+    def record(self, playbook, role, task, host, status, start, end, duration, changed):
+        # '' rather than NULL for tasks outside a role, so role = ? lookups use the index
+        self.put(('rec', playbook, role or '', task, host, status, start, end, duration, 1 if changed else 0))
+
+    def _open(self):
+        self._conn = connect(self.path)
+
+    def _write_batch(self, batch):
+        conn = self._conn
+        rows = []
+        for item in batch:
+            if item[0] == 'rec':
+                if self._run_id is None:
+                    # records before start_run() (shouldn't happen) still get a run to hang off
+                    self._new_run(item[1], time.time())
+                rows.append((self._run_id,) + item[1:])
+            elif item[0] == 'run':
+                if rows:
+                    self._insert(rows)
+                    rows = []
+                if self._run_id is not None:
+                    self._finish_run()
+                self._new_run(item[1], item[2])
+        if rows:
+            self._insert(rows)
+        conn.commit()
+
+    def _new_run(self, playbook, started):
+        cur = self._conn.execute('INSERT INTO runs (playbook, started) VALUES (?, ?)', (playbook, started))
+        self._run_id = cur.lastrowid
+
+    def _insert(self, rows):
+        self._conn.executemany('INSERT INTO records (run, playbook, role, task, host, status, start, end, '
+                               'duration, changed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.written += len(rows)
+
+    def _finish_run(self):
+        conn = self._conn
+        run_id = self._run_id
+        conn.execute('UPDATE runs SET finished = ? WHERE id = ?', (time.time(), run_id))
+
+        started = conn.execute('SELECT started FROM runs WHERE id = ?', (run_id,)).fetchone()[0]
+
+        # per (role, task) rollup for this run.  One task's durations at a time, so memory is bounded by hosts.
+        rollups = []
+        identity = None
+        values = []
+        for playbook, role, task, duration in conn.execute(
+                'SELECT playbook, role, task, duration FROM records WHERE run = ? AND duration IS NOT NULL '
+                'ORDER BY playbook, role, task, duration', (run_id,)):
+            if (playbook, role, task) != identity:
+                if values:
+                    rollups.append(self._rollup(run_id, identity, started, values))
+                identity = (playbook, role, task)
+                values = []
+            values.append(duration)
+        if values:
+            rollups.append(self._rollup(run_id, identity, started, values))
+
+        conn.executemany('INSERT INTO task_runs (run, playbook, role, task, started, hosts, total, min, p50, p90, '
+                         'p99, max) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rollups)
+
+    def _rollup(self, run_id, identity, started, values):
+        return ((run_id,) + identity +
+                (started, len(values), sum(values), values[0], percentile(values, 0.5), percentile(values, 0.9),
+                 percentile(values, 0.99), values[-1]))
+
+    def _flush(self):
+        pass
+
+    def _close(self):
+        if self._run_id is not None:
+            self._finish_run()
+        self._conn.commit()
+        self._conn.close()
+
+
+#
+# queries
+#
+
+def parse_since(s):
+    """
+    '7d', '12h', '30m' (ago) or epoch seconds -> epoch seconds
+    """
+    units = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    if s[-1:] in units:
+        return time.time() - float(s[:-1]) * units[s[-1]]
+    return float(s)
+
+
+def list_tasks(conn, playbook=None):
+    """
+    [(playbook, role, task, runs), ...] for everything in task_runs
+    """
+    sql = 'SELECT playbook, role, task, COUNT(*) FROM task_runs'
+    args = ()
+    if playbook:
+        sql += ' WHERE playbook = ?'
+        args = (playbook,)
+    sql += ' GROUP BY playbook, role, task ORDER BY playbook, role, task'
+    return conn.execute(sql, args).fetchall()
+
+
+def task_trend(conn, playbook, role, task, since=None):
+    """
+    Per run rollups for one task, oldest first: [(run, started, hosts, min, p50, p90, p99, max), ...]
+    """
+    return conn.execute(
+        'SELECT run, started, hosts, min, p50, p90, p99, max FROM task_runs '
+        'WHERE playbook = ? AND role = ? AND task = ? AND started >= ? ORDER BY started',
+        (playbook, role or '', task, since or 0)).fetchall()
+
+
+def host_trend(conn, playbook, role, task, host, since=None):
+    """
+    One host's results for one task, oldest run first: [(run, started, status, duration, changed), ...]
+    """
+    return conn.execute(
+        'SELECT r.run, runs.started, r.status, r.duration, r.changed FROM records r JOIN runs ON runs.id = r.run '
+        'WHERE r.playbook = ? AND r.role = ? AND r.task = ? AND r.host = ? AND runs.started >= ? '
+        'ORDER BY runs.started, r.run',
+        (playbook, role or '', task, host, since or 0)).fetchall()
+
+
+def task_durations(conn, playbook, role, task, host=None, since=None):
+    """
+    Sorted per host durations for one task (optionally one host) across runs started since `since`.
+    """
+    sql = ('SELECT r.duration FROM records r JOIN runs ON runs.id = r.run '
+           'WHERE r.playbook = ? AND r.role = ? AND r.task = ? AND r.duration IS NOT NULL')
+    args = [playbook, role or '', task]
+    if host:
+        sql += ' AND r.host = ?'
+        args.append(host)
+    if since:
+        sql += ' AND runs.started >= ?'
+        args.append(since)
+    return sorted(row[0] for row in conn.execute(sql, args))
+
+
+def _fmt(v):
+    return '-' if v is None else '{0:.3f}'.format(v)
+
+
+def cmd_history(args):
+    conn = connect(args.db)
+    since = parse_since(args.since) if args.since else None
+
+    if args.action == 'tasks':
+        for playbook, role, task, runs in list_tasks(conn, args.playbook):
+            print('{0}\t{1}\t{2}\t{3} runs'.format(playbook, role, task, runs))
+        return 0
+
+    if not (args.playbook and args.task):
+        print('--playbook and --task are required for ' + args.action)
+        return 2
+
+    if args.action == 'trend' and args.host:
+        print('run\tstarted\t\t\tstatus\tduration\tchanged')
+        for run, started, status, duration, changed in host_trend(conn, args.playbook, args.role, args.task,
+                                                                  args.host, since):
+            print('{0}\t{1}\t{2}\t{3}\t\t{4}'.format(
+                run, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)), status, _fmt(duration),
+                'yes' if changed else 'no'))
+        return 0
+
+    if args.action == 'trend':
+        print('run\tstarted\t\t\thosts\tmin\tp50\tp90\tp99\tmax')
+        for run, started, hosts, mn, p50, p90, p99, mx in task_trend(conn, args.playbook, args.role, args.task, since):
+            print('{0}\t{1}\t{2}\t{3}'.format(
+                run, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started)), hosts,
+                '\t'.join(_fmt(v) for v in (mn, p50, p90, p99, mx))))
+        return 0
+
+    values = task_durations(conn, args.playbook, args.role, args.task, args.host, since)
+    print('samples: {0}'.format(len(values)))
+    for q in (0.5, 0.9, 0.99):
+        print('p{0:<3} {1}'.format(int(q * 100), _fmt(percentile(values, q))))
+    print('max  {0}'.format(_fmt(values[-1] if values else None)))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('history', help='query the multi-run history database',
+                              description='Per task duration history and percentiles from the history database '
+                                          '(ANSIBLE_DIAG_HISTORY).')
+    p.add_argument('db', help='history database (sqlite)')
+    p.add_argument('action', choices=('tasks', 'trend', 'percentiles'),
+                   help='tasks: list recorded tasks; trend: per run rollups for a task (one host\'s result per run '
+                        'with --host); percentiles: duration percentiles across runs (one host\'s with --host)')
+    p.add_argument('--playbook')
+    p.add_argument('--role', default='', help="role name ('' for tasks outside a role)")
+    p.add_argument('--task')
+    p.add_argument('--host')
+    p.add_argument('--since', help="only runs started since: 7d, 12h, 30m or epoch seconds")
+    p.set_defaults(func=cmd_history)
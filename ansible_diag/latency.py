@@ -0,0 +1,143 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Result delivery lag: how long after a module finished did the callback see its result.
+
+Modules report `end` on the host's clock, and the callback only has the controller's clock, so the raw difference
+(received - end) includes the host's clock offset (skew, and timezone too, since `end` carries none).  A result
+can't arrive before its module ended, which bounds each host's offset from below; the tightest bound is the fastest
+delivery seen from that host, the same minimum-delay filter NTP uses.  Lag is measured against that bound, so it
+reads as delay beyond the best transport time the host has managed: near zero when the controller keeps up, growing
+when results sit in the queue waiting for the controller.
+
+The lag of the last `window` results is kept as a histogram with fixed log-spaced buckets, and a warning goes out
+when the rolling median passes the threshold, which points at the controller (not the hosts) as the bottleneck.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import bisect
+from collections import deque
+
+from ansible_diag.compat import monotonic
+
+# upper bucket edges, seconds; the last bucket takes everything above
+BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+
+def _bucket_label(i):
+    if i == 0:
+        return '<= {0:g}s'.format(BUCKETS[0])
+    if i == len(BUCKETS):
+        return '>  {0:g}s'.format(BUCKETS[-1])
+    return '<= {0:g}s'.format(BUCKETS[i])
+
+
+class LagMonitor(object):
+    """
+    observe() every result that carries an `end`; warn(msg) is called (at most once per warn_interval seconds) while
+    the rolling median lag is above threshold.
+    """
+
+    def __init__(self, threshold=5.0, window=500, min_samples=20, warn=None, warn_interval=30.0):
+        self.threshold = threshold
+        self.window = window
+        self.min_samples = min_samples
+        self.warn = warn
+        self.warn_interval = warn_interval
+
+        # key: host, value: lower bound of (host clock - controller clock)
+        self.offsets = {}
+
+        self._recent = deque()
+        self.rolling = [0] * (len(BUCKETS) + 1)
+        self.total = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.max_lag = 0.0
+        self.warnings = 0
+        self._last_warning = None
+
+    def observe(self, host, end, received):
+        """
+        end: the module's end (host clock, epoch seconds), received: when the callback got it (controller clock).
+        Returns the lag in seconds.
+        """
+        offset = end - received
+        known = self.offsets.get(host)
+        if known is None or offset > known:
+            self.offsets[host] = known = offset
+        lag = received - (end - known)
+
+        i = bisect.bisect_left(BUCKETS, lag)
+        self._recent.append(i)
+        self.rolling[i] += 1
+        if len(self._recent) > self.window:
+            self.rolling[self._recent.popleft()] -= 1
+        self.total[i] += 1
+        self.count += 1
+        if lag > self.max_lag:
+            self.max_lag = lag
+
+        if self.warn is not None and len(self._recent) >= self.min_samples:
+            self._check()
+        return lag
+
+    def rolling_quantile(self, q):
+        """
+        Upper edge of the bucket holding the q quantile of the recent window (inf for the overflow bucket).
+        """
+        n = len(self._recent)
+        if not n:
+            return 0.0
+        rank = q * n
+        seen = 0
+        for i, c in enumerate(self.rolling):
+            seen += c
+            if seen >= rank and c:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return float('inf')
+
+    def _check(self):
+        median = self.rolling_quantile(0.5)
+        if median <= self.threshold:
+            return
+        now = monotonic()
+        if self._last_warning is not None and now - self._last_warning < self.warn_interval:
+            return
+        self._last_warning = now
+        self.warnings += 1
+        self.warn('results are reaching the callbacks late: median lag of the last {0} results is over {1:g}s '
+                  '(p90 {2:g}s).  The controller is not keeping up; consider fewer forks or lighter callbacks.'.format(
+                      len(self._recent), median if median != float('inf') else BUCKETS[-1],
+                      self.rolling_quantile(0.9)))
+
+    def report_lines(self):
+        lines = ['result delivery lag: {0} results, max {1:.2f}s, {2} backlog warnings'.format(
+            self.count, self.max_lag, self.warnings)]
+        if self.count:
+            width = 40
+            top = max(self.total)
+            for i, c in enumerate(self.total):
+                if c:
+                    lines.append('  {0:>10}  {1:>7}  {2}'.format(_bucket_label(i), c, '#' * max(1, width * c // top)))
+        if self.offsets:
+            skewed = sorted(self.offsets.items(), key=lambda kv: abs(kv[1]), reverse=True)[:5]
+            lines.append('  largest host clock offsets (lower bound): ' +
+                         ', '.join('{0} {1:+.2f}s'.format(h, o) for h, o in skewed))
+        return lines
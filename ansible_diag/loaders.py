@@ -0,0 +1,73 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Reading recorded runs back for the offline tools.  Everything comes out as plain dicts shaped like
+TaskRecord.as_dict(), whatever it was stored in.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+
+from ansible_diag.binlog import BinlogReader, is_binlog
+from ansible_diag.ndjson import iter_ndjson
+from ansible_diag.payloads import PayloadResolver
+from ansible_diag.segments import iter_lines
+
+
+def iter_records(path):
+    """
+    Task records from a debug_log_json stream (DEBUG_LOG_JSON_STREAM, NDJSON or binlog) or segment directory
+    (DEBUG_LOG_JSON_SEGMENTS, or its .manifest), in the order they were written.  Binlog records come without their
+    result payloads; none of the reports use them.  Deduplicated NDJSON (DEBUG_LOG_JSON_DEDUP) comes back with its
+    results whole.
+    """
+    if os.path.isdir(path) or path.endswith('.manifest'):
+        for line in iter_lines(path):
+            line = line.strip()
+            if line:
+                rec = json.loads(line)
+                if rec.get('entrytype', 'TASK_RECORD') == 'TASK_RECORD':
+                    yield rec
+        return
+
+    if is_binlog(path):
+        with BinlogReader(path) as reader:
+            for rec in reader:
+                yield rec
+        return
+
+    resolver = PayloadResolver()
+    for rec in iter_ndjson(path):
+        rec = resolver.feed(rec)
+        if rec is not None and rec.get('entrytype', 'TASK_RECORD') == 'TASK_RECORD':
+            yield rec
+
+
+def iter_history_run(conn, run_id):
+    """
+    Task records for one run in the history database.
+    """
+    cur = conn.execute('SELECT playbook, role, task, host, status, start, end, duration, changed FROM records '
+                       'WHERE run = ?', (run_id,))
+    for playbook, role, task, host, status, start, end, duration, changed in cur:
+        yield {'entrytype': 'TASK_RECORD', 'playbook': playbook, 'rolename': role or None, 'taskname': task,
+               'host': host, 'runnercode': status, 'start': start, 'end': end, 'duration': duration,
+               'changed': bool(changed)}
@@ -0,0 +1,260 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Per-item timing for loops (with_items, loop, ...).
+
+An item's time is its own module time when the item result reports one (delta, or end - start).  Otherwise, when
+ansible delivers item results live (one callback per item as it finishes), it's the time since the host's previous
+item (or the task start): that includes the per-item connection and module transfer, which is exactly what batching
+saves.  Ansible versions that only hand over the items with the final task result give no time for those items, and
+they're counted as untimed.
+
+Gap times are held per host until the host's final task result: when every gap after the first is under MIN_GAP,
+the items were delivered together at the end, the first gap is the whole loop's time and no item can be told apart.
+Those items are counted as untimed (and batched) rather than charging the first item with everything.
+
+A loop whose items are individually short pays the fixed per-call cost once per item.  The fastest items bound that
+fixed cost from above, so (items per host - 1) * p5 item time estimates what one module call with the whole list
+(apt/yum/package/pip name: [...]) would save per host.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from collections import OrderedDict
+
+from ansible_diag.compat import string_types
+from ansible_diag.sketch import QuantileSketch, TopN
+from ansible_diag.timeparse import parse_delta, parse_timestamp
+
+# modules that take a list in one call, so a loop over them can usually be replaced with a single task
+BATCHABLE = frozenset(('apt', 'yum', 'dnf', 'package', 'pip', 'zypper', 'apk', 'pacman', 'homebrew', 'gem',
+                       'npm', 'win_chocolatey'))
+
+# live item results closer together than this are a batched delivery, not an item's run time
+MIN_GAP = 0.001
+
+MAX_LABEL = 80
+
+
+def item_label(result):
+    """
+    Short display label for an item result: loop_control's label if set, else the item itself.
+    """
+    label = result.get('_ansible_item_label', result.get('item'))
+    if not isinstance(label, string_types):
+        label = repr(label)
+    if len(label) > MAX_LABEL:
+        label = label[:MAX_LABEL - 3] + '...'
+    return label
+
+
+def item_status(result):
+    if result.get('failed'):
+        return 'failed'
+    if result.get('skipped'):
+        return 'skipped'
+    if result.get('unreachable'):
+        return 'unreachable'
+    return 'ok'
+
+
+def item_remote(result):
+    """
+    The item module's own duration in seconds, or None.
+    """
+    delta = result.get('delta')
+    if delta:
+        return parse_delta(delta)
+    if 'start' in result and 'end' in result:
+        return parse_timestamp(result['end']) - parse_timestamp(result['start'])
+    return None
+
+
+class LoopSpan(object):
+    """
+    The items of one looping task instance, across hosts.  Item times are folded into a QuantileSketch and only the
+    slowest are kept, so a loop costs a few KB plus one entry per host while the loop is running.
+    """
+    __slots__ = ('uuid', 'name', 'action', 'start', 'durations', 'statuses', 'changed', 'untimed', 'batched',
+                 'slowest', 'hosts', '_seen', '_last', '_live', '_gaps')
+
+    def __init__(self, uuid, name, action, start, top_n=10):
+        self.uuid = uuid
+        self.name = name
+        self.action = action
+        self.start = start
+        self.durations = QuantileSketch()
+        self.statuses = {}
+        self.changed = 0
+        self.untimed = 0
+        # items delivered together, so untimed (included in untimed)
+        self.batched = 0
+        self.slowest = TopN(top_n)
+        # host count; the set is only kept while the loop is running
+        self.hosts = 0
+        self._seen = set()
+        # per host: arrival of the previous live item
+        self._last = {}
+        # hosts that delivered items live, so the final task result doesn't count them again
+        self._live = set()
+        # per host: [(gap, label), ...] of live items timed only by their gap, until the host is done
+        self._gaps = {}
+
+    def item_done(self, host, label, now, status, remote=None, changed=False, live=True):
+        if host not in self._seen:
+            self._seen.add(host)
+            self.hosts += 1
+        if live:
+            self._live.add(host)
+            gap = now - self._last.get(host, self.start)
+            self._last[host] = now
+        else:
+            gap = None
+
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if changed:
+            self.changed += 1
+
+        if remote is not None:
+            self._timed(remote, label, host)
+        elif gap is not None:
+            # decided when the host is done: a batched delivery only shows once all its items are in
+            self._gaps.setdefault(host, []).append((gap, label))
+        else:
+            self.untimed += 1
+
+    def _timed(self, duration, label, host):
+        self.durations.add(duration)
+        self.slowest.push(duration, (label, host))
+
+    def host_done(self, host):
+        """
+        Settles the gap timed items of a host whose task result is in.
+        """
+        gaps = self._gaps.pop(host, None)
+        if not gaps:
+            return
+        if len(gaps) > 1 and all(gap < MIN_GAP for gap, _ in gaps[1:]):
+            self.untimed += len(gaps)
+            self.batched += len(gaps)
+            return
+        for gap, label in gaps:
+            if gap >= MIN_GAP:
+                self._timed(gap, label, host)
+            else:
+                self.untimed += 1
+
+    def items_done(self, host, results, now):
+        """
+        The final result of a looping task: its 'results' list, one entry per item.  Skipped for hosts whose items
+        already came in live.
+        """
+        if host in self._live:
+            self.host_done(host)
+            return
+        for r in results:
+            if isinstance(r, dict):
+                self.item_done(host, item_label(r), now, item_status(r), item_remote(r), r.get('changed', False),
+                               live=False)
+
+    def close(self):
+        for host in list(self._gaps):
+            self.host_done(host)
+        self._seen = set()
+        self._last = {}
+        self._live = set()
+
+    @property
+    def items(self):
+        return sum(self.statuses.values())
+
+    def batch_saving(self):
+        """
+        (items per host, estimated seconds saved per host by one module call for all items), or None if there isn't
+        enough timing to say.
+        """
+        if self.hosts <= 0 or self.durations.count < 2:
+            return None
+        per_host = self.items / self.hosts
+        if per_host < 2:
+            return None
+        return per_host, (per_host - 1) * self.durations.quantile(0.05)
+
+    def should_batch(self):
+        saving = self.batch_saving()
+        if saving is None:
+            return False
+        per_host, seconds = saving
+        loop_time = self.durations.sum / self.hosts
+        # worth it when most of the loop is per-item fixed cost, or the module takes a list anyway
+        return per_host >= 5 and (seconds >= 0.5 * loop_time or self.action in BATCHABLE)
+
+
+class Loops(object):
+    """
+    LoopSpans keyed by task uuid, created on the first item a task reports.  Tasks that never loop cost nothing.
+    """
+
+    def __init__(self, top_n=10):
+        self.top_n = top_n
+        self.loops = OrderedDict()
+        self._task = None
+
+    def task_start(self, uuid, name, action, now):
+        if self._task is not None:
+            loop = self.loops.get(self._task[0])
+            if loop is not None:
+                loop.close()
+        self._task = (uuid, name, action, now)
+
+    def _loop(self, uuid):
+        loop = self.loops.get(uuid)
+        if loop is None:
+            if self._task is not None and self._task[0] == uuid:
+                _, name, action, start = self._task
+            else:
+                name, action, start = str(uuid), None, None
+            loop = self.loops[uuid] = LoopSpan(uuid, name, action, start, self.top_n)
+        return loop
+
+    def item_done(self, uuid, host, result, now):
+        loop = self._loop(uuid)
+        if loop.start is None:
+            loop.start = now
+        loop.item_done(host, item_label(result), now, item_status(result), item_remote(result),
+                       result.get('changed', False))
+
+    def task_done(self, uuid, host, result, now):
+        results = result.get('results')
+        if not isinstance(results, list) or not results:
+            loop = self.loops.get(uuid)
+            if loop is not None:
+                loop.host_done(host)
+            return
+        loop = self._loop(uuid)
+        if loop.start is None:
+            loop.start = now
+        loop.items_done(host, results, now)
+
+    def finish(self):
+        for loop in self.loops.values():
+            loop.close()
+
+    def __iter__(self):
+        return iter(self.loops.values())
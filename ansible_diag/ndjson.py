@@ -0,0 +1,55 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+from ansible_diag.writer import BackgroundWriter
+
+
+# one encoder for every line.  default=str covers datetimes and anything else ansible leaves in a result.
+_encoder = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=str)
+
+
+def dumps_line(obj):
+    return _encoder.encode(obj) + '\n'
+
+
+def iter_ndjson(path):
+    """
+    Yields each record (dict) from an NDJSON file, skipping blank lines.
+    """
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class NdjsonWriter(BackgroundWriter):
+    """
+    Streams dicts to path, one JSON document per line.  Serialization happens on the writer thread; pass
+    format_item to turn queued items into lines some other way (it should end them with dumps_line).
+    """
+
+    def __init__(self, path, **kwargs):
+        self.path = path
+        kwargs.setdefault('name', 'diag-ndjson-writer')
+        kwargs.setdefault('format_item', dumps_line)
+        super(NdjsonWriter, self).__init__(open(path, 'w'), **kwargs)
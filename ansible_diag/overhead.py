@@ -0,0 +1,127 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Controller overhead per task and per host.
+
+A result's wall time on the controller (task start to result arrival, on the monotonic clock) splits into the
+module's own execution time (its delta) and everything else: templating, connection setup, module transfer, waiting
+for a free fork, the result queue.  Callbacks can't see those pieces separately, so they're reported together as
+overhead.  Results without a delta (most non-command modules) have no split and are only counted.  A delta longer
+than the controller saw (the host's clock running fast against the controller's) would make overhead negative; it's
+counted as zero and the number of such results is reported as clock skew.
+
+    python -m ansible_diag overhead run.ndjson
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_diag.loaders import iter_records
+from ansible_diag.stats import RunningStats
+
+
+class OverheadStats(object):
+    """
+    Running overhead/remote stats keyed by task (role, task name) and by host.  Memory is bounded by the number of
+    distinct tasks and hosts.
+    """
+
+    def __init__(self):
+        # key: (role, task) or host, value: [RunningStats overhead, total remote seconds, results without a split]
+        self.tasks = {}
+        self.hosts = {}
+        self.total_overhead = 0.0
+        self.total_remote = 0.0
+        # results whose delta was longer than the controller's elapsed time, clamped to zero overhead
+        self.clock_skew = 0
+
+    @staticmethod
+    def _entry(table, key):
+        e = table.get(key)
+        if e is None:
+            e = table[key] = [RunningStats(), 0.0, 0]
+        return e
+
+    def add(self, rolename, taskname, host, remote, overhead):
+        if overhead is not None and overhead < 0:
+            self.clock_skew += 1
+            overhead = 0.0
+        for e in (self._entry(self.tasks, (rolename, taskname)), self._entry(self.hosts, host)):
+            if overhead is None:
+                e[2] += 1
+            else:
+                e[0].add(overhead)
+                e[1] += remote
+        if overhead is not None:
+            self.total_overhead += overhead
+            self.total_remote += remote
+
+    def _top(self, table, n):
+        rows = [(e[0].mean * e[0].n, e[0].mean, e[0].max, e[1], e[0].n, key) for key, e in table.items() if e[0].n]
+        rows.sort(key=lambda r: r[0], reverse=True)
+        return rows[:n]
+
+    def top_tasks(self, n=10):
+        """
+        [(total overhead, mean, max, total remote, results, (role, task)), ...], most total overhead first
+        """
+        return self._top(self.tasks, n)
+
+    def top_hosts(self, n=10):
+        return self._top(self.hosts, n)
+
+    def report_lines(self, n=10):
+        total = self.total_overhead + self.total_remote
+        share = 100.0 * self.total_overhead / total if total > 0 else 0.0
+        lines = ['controller overhead: {0:.1f}s of {1:.1f}s host time ({2:.1f}%), remote execution {3:.1f}s'.format(
+            self.total_overhead, total, share, self.total_remote)]
+        if self.clock_skew:
+            lines.append('clock skew: {0} results ran longer on the host than the controller saw, '
+                         'counted as 0 overhead'.format(self.clock_skew))
+
+        header = '  {0:>9}  {1:>7}  {2:>7}  {3:>9}  {4:>7}  {5}'
+        row = '  {0:>9.1f}  {1:>7.2f}  {2:>7.2f}  {3:>9.1f}  {4:>7}  {5}'
+        lines.append('tasks by total overhead:')
+        lines.append(header.format('overhead', 'mean', 'max', 'remote', 'results', 'task'))
+        for total, mean, mx, remote, count, (role, task) in self.top_tasks(n):
+            lines.append(row.format(total, mean, mx, remote, count, '{0} : {1}'.format(role, task) if role else task))
+        lines.append('hosts by total overhead:')
+        lines.append(header.format('overhead', 'mean', 'max', 'remote', 'results', 'host'))
+        for total, mean, mx, remote, count, host in self.top_hosts(n):
+            lines.append(row.format(total, mean, mx, remote, count, host))
+        return lines
+
+
+def cmd_overhead(args):
+    stats = OverheadStats()
+    for rec in iter_records(args.input):
+        if rec.get('ctl_mono') is None:
+            continue
+        stats.add(rec.get('rolename'), rec.get('taskname'), rec['host'], rec.get('duration'), rec.get('overhead'))
+    for line in stats.report_lines(args.top):
+        print(line)
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('overhead', help='controller/transport overhead per task and host',
+                              description='Split each result\'s controller wall time into remote execution and '
+                                          'controller overhead, aggregated per task and per host.')
+    p.add_argument('input', help='debug_log_json NDJSON stream')
+    p.add_argument('--top', type=int, default=15, help='rows per section (default 15)')
+    p.set_defaults(func=cmd_overhead)
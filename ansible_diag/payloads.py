@@ -0,0 +1,225 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Content-addressed storage for result payloads.
+
+Across a fleet most hosts return the same stdout/msg/results for a task; only the small fields (rc, start, end, delta,
+changed) differ.  split() keeps a result's small fields inline and moves every field that serializes to min_bytes or
+more into a PayloadTable, keyed by the sha1 of its content, so N identical outputs cost one copy plus N
+references.  RecordStore does this in memory; PayloadEncoder does it for NDJSON output, writing each distinct value
+once as a PAYLOAD entry that later records point at (result_refs: {field: digest}), and PayloadResolver undoes it on
+the way back in.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+
+from ansible_diag.compat import string_types
+from ansible_diag.ndjson import dumps_line
+
+# fields that serialize to at least this many bytes are stored by reference
+MIN_BYTES = 64
+
+_canonical = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=str).encode
+
+# never worth hashing
+_SCALARS = (bool, int, float, type(None))
+
+
+def _content(value):
+    # what a value is hashed as: strings (stdout, stderr, msg: most of the bytes) as their utf-8, which is several
+    # times cheaper than JSON encoding them first; everything else as canonical JSON.  The prefix keeps a string
+    # from colliding with a structure that serializes to the same text.
+    if isinstance(value, string_types):
+        return b's' + (value.encode('utf-8', 'replace') if not isinstance(value, bytes) else value)
+    return b'j' + _canonical(value).encode('utf-8')
+
+
+class PayloadTable(object):
+    """
+    Distinct payload values by sha1 of their content (_content), as small ints (id 0 is reserved for None, like
+    StringTable).  refs/raw_bytes count every add(), stored_bytes only the distinct values.
+    """
+    __slots__ = ('_ids', 'digests', 'values', 'refs', 'raw_bytes', 'stored_bytes')
+
+    def __init__(self):
+        self._ids = {}
+        self.digests = [None]
+        self.values = [None]
+        self.refs = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+
+    def add(self, value, data=None):
+        if data is None:
+            data = _content(value)
+        digest = hashlib.sha1(data).hexdigest()
+        self.refs += 1
+        self.raw_bytes += len(data)
+        i = self._ids.get(digest)
+        if i is None:
+            i = self._ids[digest] = len(self.values)
+            self.values.append(value)
+            self.digests.append(digest)
+            self.stored_bytes += len(data)
+        return i
+
+    def lookup(self, i):
+        return self.values[i]
+
+    def __len__(self):
+        return len(self.values) - 1
+
+    @property
+    def ratio(self):
+        return self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0
+
+    def report_lines(self):
+        return ['payloads: {0} large result fields, {1} distinct; {2} bytes stored for {3} ({4:.1f}:1 dedup)'.format(
+            self.refs, len(self), self.stored_bytes, self.raw_bytes, self.ratio)]
+
+
+def split(result, table, min_bytes=MIN_BYTES):
+    """
+    (inline, refs) for a result: inline is a dict of its small fields, refs a tuple of (field, payload id) for the
+    large ones, which are added to table.  Anything that isn't a dict is kept inline as is.
+    """
+    if not isinstance(result, dict):
+        return result, ()
+    inline = {}
+    refs = []
+    for k, v in result.items():
+        if isinstance(v, _SCALARS):
+            inline[k] = v
+            continue
+        if isinstance(v, string_types) and len(v) < min_bytes:
+            inline[k] = v
+            continue
+        data = _content(v)
+        if len(data) <= min_bytes:
+            inline[k] = v
+        else:
+            refs.append((k, table.add(v, data)))
+    return inline, tuple(refs)
+
+
+def join(inline, refs, table):
+    """
+    The result split() took apart.
+    """
+    if not refs:
+        return inline
+    result = dict(inline)
+    for k, i in refs:
+        result[k] = table.lookup(i)
+    return result
+
+
+class PayloadEncoder(object):
+    """
+    format_item for NdjsonWriter: the first time a large field value is seen it goes out as a PAYLOAD entry
+    ({"entrytype": "PAYLOAD", "digest": ..., "value": ...}), then the record with result holding the small fields and
+    result_refs the digests of the large ones.  Takes TaskRecords or record dicts; other entries (summaries) are
+    written as they are.  Runs on the writer thread only, so the table needs no lock.
+    """
+
+    def __init__(self, min_bytes=MIN_BYTES):
+        self.table = PayloadTable()
+        self._min_bytes = min_bytes
+
+    def __call__(self, item):
+        d = item if isinstance(item, dict) else item.as_dict()
+        if d.get('entrytype', 'TASK_RECORD') != 'TASK_RECORD':
+            return dumps_line(d)
+        seen = len(self.table)
+        inline, refs = split(d.get('result'), self.table, self._min_bytes)
+        if not refs:
+            return dumps_line(d)
+
+        lines = []
+        digests = self.table.digests
+        for _, i in refs:
+            if i > seen:
+                # new this record; the same value twice in one result is only written once
+                seen = i
+                lines.append(dumps_line({'entrytype': 'PAYLOAD', 'digest': digests[i], 'value': self.table.lookup(i)}))
+        d['result'] = inline
+        d['result_refs'] = dict((k, digests[i]) for k, i in refs)
+        lines.append(dumps_line(d))
+        return ''.join(lines)
+
+
+class PayloadResolver(object):
+    """
+    Reading side of PayloadEncoder: feed() it every entry in file order; PAYLOAD entries are remembered (and give
+    None), records with result_refs come back with their result whole again.  Other entries pass through.
+    """
+
+    def __init__(self):
+        self.values = {}
+
+    def feed(self, entry):
+        if entry.get('entrytype') == 'PAYLOAD':
+            self.values[entry['digest']] = entry['value']
+            return None
+        refs = entry.pop('result_refs', None)
+        if refs:
+            result = dict(entry.get('result') or {})
+            for k, digest in refs.items():
+                result[k] = self.values.get(digest)
+            entry['result'] = result
+        return entry
+
+
+def cmd_payloads(args):
+    # late import: loaders reads deduplicated streams through this module
+    from ansible_diag.loaders import iter_records
+
+    encoder = PayloadEncoder(args.min_bytes)
+    out = open(args.output, 'w') if args.output else None
+    records = 0
+    try:
+        for rec in iter_records(args.input):
+            line = encoder(rec)
+            records += 1
+            if out:
+                out.write(line)
+    finally:
+        if out:
+            out.close()
+
+    print('{0} records'.format(records))
+    for line in encoder.table.report_lines():
+        print(line)
+    if args.output:
+        print('wrote payload table and references to {0}'.format(args.output))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('payloads', help='result payload dedup ratio for a recorded run',
+                              description='Hash the large result fields of a recorded run and report how much of it '
+                                          'is duplicated; with -o, rewrite it as a payload table plus references.')
+    p.add_argument('input', help='NDJSON stream or segment directory written by debug_log_json')
+    p.add_argument('-o', '--output', help='write deduplicated NDJSON (PAYLOAD entries + result_refs) here')
+    p.add_argument('--min-bytes', type=int, default=MIN_BYTES,
+                   help='store fields serializing to at least this many bytes by reference (default %(default)s)')
+    p.set_defaults(func=cmd_payloads)
@@ -0,0 +1,249 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from array import array
+from collections import OrderedDict
+
+from ansible_diag.payloads import MIN_BYTES, PayloadTable, join, split
+from ansible_diag.timeparse import parse_delta, parse_timestamp
+
+# stored in the float columns when a module didn't report a time
+_NO_TIME = float('nan')
+
+
+def _time(value):
+    # NaN (_NO_TIME) back to None
+    return None if value != value else value
+
+
+class StringTable(object):
+    """
+    Interns strings to small ints.  Role, path, task and host names repeat on every record, so the record store keeps
+    the int and each distinct string once.  id 0 is reserved for None.
+    """
+    __slots__ = ('_ids', 'strings')
+
+    def __init__(self):
+        self._ids = {}
+        self.strings = [None]
+
+    def intern(self, s):
+        if s is None:
+            return 0
+        i = self._ids.get(s)
+        if i is None:
+            i = self._ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def lookup(self, i):
+        return self.strings[i]
+
+    def __len__(self):
+        return len(self.strings) - 1
+
+
+class TaskRecord(object):
+    """
+    One task result for one host.  start/end are float epoch seconds and duration is float seconds (all None if the
+    module didn't report them).
+
+    The ctl_* fields are the controller's side: ctl_start is when the task started (epoch), ctl_end when this
+    result arrived (epoch) and ctl_mono the monotonic clock at arrival.  overhead is the controller's elapsed time
+    for the result (measured on the monotonic clock) minus the module's duration: templating, connection setup,
+    module transfer, waiting for a fork and the result queue, all together.
+    """
+    __slots__ = ('runnercode', 'rolename', 'rolepath', 'taskname', 'host', 'start', 'end', 'duration', 'result',
+                 'play', 'taskid', 'ctl_start', 'ctl_end', 'ctl_mono', 'overhead')
+
+    entrytype = 'TASK_RECORD'
+
+    def __init__(self, runnercode, rolename, rolepath, taskname, host, start, end, duration, result, play=None,
+                 taskid=None, ctl_start=None, ctl_end=None, ctl_mono=None, overhead=None):
+        self.runnercode = runnercode
+        self.rolename = rolename
+        self.rolepath = rolepath
+        self.taskname = taskname
+        self.host = host
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.result = result
+        self.play = play
+        self.taskid = taskid
+        self.ctl_start = ctl_start
+        self.ctl_end = ctl_end
+        self.ctl_mono = ctl_mono
+        self.overhead = overhead
+
+    def as_dict(self):
+        d = dict((k, getattr(self, k)) for k in self.__slots__)
+        d['entrytype'] = self.entrytype
+        return d
+
+
+def task_identity(task):
+    """
+    (rolename, rolepath, taskname, taskid) of an ansible task or handler.  Tasks outside of a role (plain playbook
+    tasks) have no _role.
+    """
+    role = getattr(task, '_role', None)
+    uuid = getattr(task, '_uuid', None)
+    return (role._role_name if role else None,
+            role._role_path if role else None,
+            task.name if task is not None else None,
+            str(uuid) if uuid else None)
+
+
+def task_label(rolename, taskname):
+    return '{0} : {1}'.format(rolename, taskname) if rolename else str(taskname)
+
+
+def record_from_event(event, play=None):
+    """
+    TaskRecord for a result Event (ansible_diag.capture), named after the event's own task.  Module times are parsed
+    from the result (ansible_diag.timeparse, not strptime); ctl_start is when that task started on the controller,
+    and overhead its elapsed time to this result (monotonic clock, so a clock step mid-run doesn't skew it) minus
+    the module's duration.
+    """
+    result = event.result
+    # only some modules (command, shell, ...) report start/end.  unreachable results never do.
+    start = parse_timestamp(result['start']) if 'start' in result else None
+    end = parse_timestamp(result['end']) if 'end' in result else None
+
+    # 0:00:00.501769
+    if 'delta' in result:
+        duration = parse_delta(result['delta'])
+    elif start is not None and end is not None:
+        duration = end - start
+    else:
+        duration = None
+
+    if event.started_mono is not None and duration is not None:
+        overhead = (event.mono - event.started_mono) - duration
+    else:
+        overhead = None
+
+    rolename, rolepath, taskname, taskid = task_identity(event.task)
+    return TaskRecord(event.status, rolename, rolepath, taskname, event.host, start, end, duration, result, play,
+                      taskid, event.started, event.wall, event.mono, overhead)
+
+
+class RecordStore(object):
+    """
+    Column store for TaskRecords.
+
+    Strings live in a shared StringTable, names and runnercodes are kept as array('i') columns of ids and times as
+    array('d') columns, so a record costs a few dozen bytes plus its result.  Results are split (ansible_diag.payloads):
+    the small fields stay with the row and each distinct large field value (stdout, msg, results, ...) is kept once
+    in a PayloadTable, however many hosts returned it.  Iterating hands back TaskRecord objects built on the fly;
+    that's the API playbook_on_stats and exporters use, whatever the storage looks like.
+    """
+
+    def __init__(self, min_payload_bytes=MIN_BYTES):
+        self.strings = StringTable()
+        self.payloads = PayloadTable()
+        self._min_payload_bytes = min_payload_bytes
+        self._runnercode = array('i')
+        self._rolename = array('i')
+        self._rolepath = array('i')
+        self._taskname = array('i')
+        self._host = array('i')
+        self._start = array('d')
+        self._end = array('d')
+        self._duration = array('d')
+        self._play = array('i')
+        self._taskid = array('i')
+        self._ctl_start = array('d')
+        self._ctl_end = array('d')
+        self._ctl_mono = array('d')
+        self._overhead = array('d')
+        # per row: the result's small fields, and ((field, payload id), ...) for the large ones
+        self._result = []
+        self._result_refs = []
+
+        # key: host string id, value: array of row numbers for that host (in arrival order)
+        self._host_rows = OrderedDict()
+
+    def append(self, record):
+        intern = self.strings.intern
+        row = len(self._result)
+        host_id = intern(record.host)
+
+        self._runnercode.append(intern(record.runnercode))
+        self._rolename.append(intern(record.rolename))
+        self._rolepath.append(intern(record.rolepath))
+        self._taskname.append(intern(record.taskname))
+        self._host.append(host_id)
+        self._start.append(_NO_TIME if record.start is None else record.start)
+        self._end.append(_NO_TIME if record.end is None else record.end)
+        self._duration.append(_NO_TIME if record.duration is None else record.duration)
+        self._play.append(intern(record.play))
+        self._taskid.append(intern(record.taskid))
+        self._ctl_start.append(_NO_TIME if record.ctl_start is None else record.ctl_start)
+        self._ctl_end.append(_NO_TIME if record.ctl_end is None else record.ctl_end)
+        self._ctl_mono.append(_NO_TIME if record.ctl_mono is None else record.ctl_mono)
+        self._overhead.append(_NO_TIME if record.overhead is None else record.overhead)
+        inline, refs = split(record.result, self.payloads, self._min_payload_bytes)
+        self._result.append(inline)
+        self._result_refs.append(refs)
+
+        rows = self._host_rows.get(host_id)
+        if rows is None:
+            rows = self._host_rows[host_id] = array('i')
+        rows.append(row)
+
+    def __len__(self):
+        return len(self._result)
+
+    def _record(self, row):
+        lookup = self.strings.lookup
+        return TaskRecord(lookup(self._runnercode[row]),
+                          lookup(self._rolename[row]),
+                          lookup(self._rolepath[row]),
+                          lookup(self._taskname[row]),
+                          lookup(self._host[row]),
+                          _time(self._start[row]),
+                          _time(self._end[row]),
+                          _time(self._duration[row]),
+                          join(self._result[row], self._result_refs[row], self.payloads),
+                          lookup(self._play[row]),
+                          lookup(self._taskid[row]),
+                          _time(self._ctl_start[row]),
+                          _time(self._ctl_end[row]),
+                          _time(self._ctl_mono[row]),
+                          _time(self._overhead[row]))
+
+    def __iter__(self):
+        for row in range(len(self._result)):
+            yield self._record(row)
+
+    def hosts(self):
+        """
+        Host names, in the order they first reported.
+        """
+        return [self.strings.lookup(i) for i in self._host_rows]
+
+    def by_host(self):
+        """
+        Yields (host, iterator of that host's TaskRecords) in the order hosts first reported.
+        """
+        for host_id, rows in self._host_rows.items():
+            yield self.strings.lookup(host_id), (self._record(row) for row in rows)
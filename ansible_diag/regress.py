@@ -0,0 +1,228 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Run-to-run duration regressions.
+
+Tasks are matched across runs by (role, task) identity, hosts by name, all through dicts: loading a run is one pass
+over its records and comparing is one lookup per key, so hundreds of thousands of records diff in seconds.
+
+    python -m ansible_diag regress candidate.ndjson baseline.ndjson [baseline2.ndjson ...]
+    python -m ansible_diag regress --db history.db 1234 --baseline-last 5
+
+Significance:
+ - per task: with two or more baseline runs that have the task, Welch's t-test of the candidate's per host durations
+   against all those runs' per host durations
+ - per host: with two or more baseline runs, a t prediction test of the candidate's duration against that host's
+   baseline durations
+
+A single baseline run says nothing about how much a task varies from run to run, so with fewer than two there's no
+significance test: the result is marked "insufficient runs" and goes by the thresholds alone.  A task (or host)
+regresses when it got slower by at least --threshold (relative) and --min-delta (seconds) and, where a p-value could
+be computed, p < --alpha.  The exit status is 1 if anything regressed, so it can gate a
+pipeline.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_diag import history
+from ansible_diag.loaders import iter_history_run, iter_records
+from ansible_diag.stats import mean_var, prediction_t, welch_t
+
+
+class RunDurations(object):
+    """
+    One run's durations.  tasks: key: (role, task), value: dict of host -> [durations] (a task can show up more
+    than once per host, e.g. a role applied twice).
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self.tasks = {}
+
+    def add(self, role, task, host, duration):
+        hosts = self.tasks.get((role, task))
+        if hosts is None:
+            hosts = self.tasks[(role, task)] = {}
+        values = hosts.get(host)
+        if values is None:
+            hosts[host] = [duration]
+        else:
+            values.append(duration)
+
+    @classmethod
+    def from_records(cls, label, records):
+        run = cls(label)
+        for rec in records:
+            duration = rec.get('duration')
+            if duration is not None:
+                run.add(rec.get('rolename'), rec.get('taskname'), rec['host'], duration)
+        return run
+
+
+def _host_values(hosts):
+    # per host: mean of that host's durations for the task
+    return dict((host, sum(v) / len(v)) for host, v in hosts.items())
+
+
+class Regression(object):
+    __slots__ = ('role', 'task', 'host', 'baseline', 'candidate', 'ratio', 'delta', 'p', 'insufficient', 'regressed')
+
+    def __init__(self, role, task, host, baseline, candidate, p, threshold, min_delta, alpha, insufficient=False):
+        self.role = role
+        self.task = task
+        self.host = host
+        self.baseline = baseline
+        self.candidate = candidate
+        self.delta = candidate - baseline
+        self.ratio = candidate / baseline if baseline > 0 else float('inf')
+        # fewer than two baseline runs: no p-value, whatever the sample sizes
+        self.insufficient = insufficient
+        self.p = None if insufficient else p
+        self.regressed = (self.ratio >= 1.0 + threshold and self.delta >= min_delta and
+                          (self.p is None or self.p < alpha))
+
+
+def compare(candidate, baselines, threshold=0.2, min_delta=0.5, alpha=0.05, per_host=True):
+    """
+    Compares a candidate RunDurations against one or more baseline RunDurations.
+
+    Returns (task_results, host_results, missing) where the results are lists of Regression (every matched
+    task/host, regressed or not) and missing lists (role, task) keys that are in the candidate but not in any
+    baseline.
+    """
+    task_results = []
+    host_results = []
+    missing = []
+
+    for key, cand_hosts in candidate.tasks.items():
+        cand_values = _host_values(cand_hosts)
+
+        # baseline hosts for this task, across runs: host -> [per run value]
+        base_hosts = {}
+        runs = 0
+        for run in baselines:
+            hosts = run.tasks.get(key)
+            if hosts:
+                runs += 1
+                for host, value in _host_values(hosts).items():
+                    base_hosts.setdefault(host, []).append(value)
+        if not base_hosts:
+            missing.append(key)
+            continue
+
+        n1, mean1, var1 = mean_var(cand_values.values())
+        n2, mean2, var2 = mean_var(v for values in base_hosts.values() for v in values)
+        _, p = welch_t(n1, mean1, var1, n2, mean2, var2) if runs >= 2 else (None, None)
+        task_results.append(Regression(key[0], key[1], None, mean2, mean1, p, threshold, min_delta, alpha,
+                                       insufficient=runs < 2))
+
+        if not per_host:
+            continue
+        for host, value in cand_values.items():
+            base = base_hosts.get(host)
+            if not base:
+                continue
+            n, mean, var = mean_var(base)
+            _, p = prediction_t(value, n, mean, var)
+            host_results.append(Regression(key[0], key[1], host, mean, value, p, threshold, min_delta, alpha,
+                                           insufficient=n < 2))
+
+    return task_results, host_results, missing
+
+
+def _load(args, source):
+    if args.db:
+        conn = history.connect(args.db)
+        return RunDurations.from_records('run {0}'.format(source), iter_history_run(conn, int(source)))
+    return RunDurations.from_records(source, iter_records(source))
+
+
+def _baseline_runs(args):
+    if not args.db or not args.baseline_last:
+        return args.baselines
+    conn = history.connect(args.db)
+    row = conn.execute('SELECT playbook, started FROM runs WHERE id = ?', (int(args.candidate),)).fetchone()
+    if row is None:
+        return []
+    return [str(r[0]) for r in conn.execute(
+        'SELECT id FROM runs WHERE playbook = ? AND started < ? ORDER BY started DESC LIMIT ?',
+        (row[0], row[1], args.baseline_last))]
+
+
+def _fmt_p(r):
+    if r.insufficient:
+        return 'insufficient runs'
+    return '-' if r.p is None else '{0:.4f}'.format(r.p)
+
+
+def _print(results, with_host):
+    for r in results:
+        name = '{0} : {1}'.format(r.role, r.task) if r.role else str(r.task)
+        if with_host:
+            name = '{0} @ {1}'.format(name, r.host)
+        print('{0:>9.3f} -> {1:>9.3f}  {2:>+9.3f}s  {3:>6.2f}x  p={4:<7}  {5}'.format(
+            r.baseline, r.candidate, r.delta, r.ratio, _fmt_p(r), name))
+
+
+def cmd_regress(args):
+    baseline_sources = _baseline_runs(args)
+    if not baseline_sources:
+        print('no baseline runs')
+        return 2
+
+    candidate = _load(args, args.candidate)
+    baselines = [_load(args, b) for b in baseline_sources]
+
+    task_results, host_results, missing = compare(candidate, baselines, args.threshold, args.min_delta, args.alpha,
+                                                  per_host=not args.no_hosts)
+    # worst first
+    task_regressions = sorted((r for r in task_results if r.regressed), key=lambda r: r.delta, reverse=True)
+    host_regressions = sorted((r for r in host_results if r.regressed), key=lambda r: r.delta, reverse=True)
+
+    print('candidate: {0}'.format(candidate.label))
+    print('baselines: {0}'.format(', '.join(b.label for b in baselines)))
+    if len(baselines) < 2:
+        print('significance: insufficient runs (needs two or more baselines), thresholds only')
+    print('matched tasks: {0}, new tasks: {1}'.format(len(task_results), len(missing)))
+    print('')
+    print('task regressions ({0}):   baseline -> candidate (mean per host seconds)'.format(len(task_regressions)))
+    _print(task_regressions, False)
+    if not args.no_hosts:
+        print('')
+        print('host regressions ({0}):'.format(len(host_regressions)))
+        _print(host_regressions[:args.max_hosts] if args.max_hosts else host_regressions, True)
+
+    return 1 if task_regressions or host_regressions else 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('regress', help='report duration regressions between recorded runs',
+                              description='Compare a recorded run against one or more baselines, matching tasks '
+                                          'by role/task. Exits 1 if anything regressed.')
+    p.add_argument('candidate', help='candidate run: debug_log_json NDJSON file, or run id with --db')
+    p.add_argument('baselines', nargs='*', help='baseline runs (same form as candidate)')
+    p.add_argument('--db', help='read runs from this history database instead of files')
+    p.add_argument('--baseline-last', type=int, default=0,
+                   help='with --db: use the N previous runs of the same playbook as baselines')
+    p.add_argument('--threshold', type=float, default=0.2, help='relative slowdown to report (default 0.2 = 20%%)')
+    p.add_argument('--min-delta', type=float, default=0.5, help='absolute slowdown to report, seconds (default 0.5)')
+    p.add_argument('--alpha', type=float, default=0.05, help='significance level (default 0.05)')
+    p.add_argument('--no-hosts', action='store_true', help='task level only')
+    p.add_argument('--max-hosts', type=int, default=50, help='host regressions to list, 0 for all (default 50)')
+    p.set_defaults(func=cmd_regress)
@@ -0,0 +1,372 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Offline replay: feed an event stream straight into callback plugins' v2 hooks, without ansible running anything.
+
+The events are (hook, args) pairs over small fake objects (FakeHost, FakeTask, FakeTaskResult, ...) that carry just
+what the callbacks and CallbackBase read.  They come from synthetic() (hosts x tasks, with a payload size and a
+failed/changed mix) or from_records() (a recorded run, anything iter_records reads).  replay() builds the
+callbacks, then dispatches every event to each of them the way ansible's TaskQueueManager.send_callback does,
+timing each event; with memory=True it runs under tracemalloc for the peak.  Nothing here imports ansible, but the
+plugins do, so running them needs it installed.  bench/bench_callbacks.py is the benchmark suite built on this.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import gc
+import os
+import random
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+from ansible_diag.capture import core
+from ansible_diag.compat import perf_counter
+
+try:
+    import tracemalloc
+except ImportError:
+    # python 2: latency and throughput only
+    tracemalloc = None
+
+# runnercode -> the v2 hook ansible calls for it
+RESULT_HOOKS = {
+    'ok': 'v2_runner_on_ok',
+    'failed': 'v2_runner_on_failed',
+    'skipped': 'v2_runner_on_skipped',
+    'unreachable': 'v2_runner_on_unreachable',
+}
+
+_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class FakeHost(object):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class FakeRole(object):
+    __slots__ = ('_role_name', '_role_path')
+
+    def __init__(self, name, path=None):
+        self._role_name = name
+        self._role_path = path
+
+
+class FakeTask(object):
+    __slots__ = ('name', '_uuid', 'action', '_role', 'async_val', 'poll', 'changed_when', 'loop', 'notify')
+
+    def __init__(self, name, uuid, action='command', role=None):
+        self.name = name
+        self._uuid = uuid
+        self.action = action
+        self._role = role
+        self.async_val = 0
+        self.poll = 10
+        self.changed_when = None
+        self.loop = None
+        self.notify = None
+
+    def get_name(self):
+        return self.name
+
+
+class FakeTaskResult(object):
+    __slots__ = ('_host', '_task', '_result')
+
+    def __init__(self, host, task, result):
+        self._host = host
+        self._task = task
+        self._result = result
+
+    def is_changed(self):
+        return self._result.get('changed', False)
+
+    def is_failed(self):
+        return self._result.get('failed', False)
+
+    def is_skipped(self):
+        return self._result.get('skipped', False)
+
+    def is_unreachable(self):
+        return self._result.get('unreachable', False)
+
+
+class FakePlay(object):
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class FakePlaybook(object):
+    __slots__ = ('_file_name',)
+
+    def __init__(self, file_name):
+        self._file_name = file_name
+
+
+class FakeStats(object):
+    """
+    Just enough of AggregateStats: per host counters, summarize(host).
+    """
+
+    def __init__(self):
+        self.processed = {}
+        self.ok = {}
+        self.changed = {}
+        self.failures = {}
+        self.dark = {}
+        self.skipped = {}
+
+    def add(self, host, status, changed=False):
+        self.processed[host] = 1
+        counters = {'ok': self.ok, 'failed': self.failures, 'unreachable': self.dark,
+                    'skipped': self.skipped}.get(status, self.ok)
+        counters[host] = counters.get(host, 0) + 1
+        if changed:
+            self.changed[host] = self.changed.get(host, 0) + 1
+
+    def summarize(self, host):
+        return {'ok': self.ok.get(host, 0), 'changed': self.changed.get(host, 0),
+                'failures': self.failures.get(host, 0), 'unreachable': self.dark.get(host, 0),
+                'skipped': self.skipped.get(host, 0)}
+
+
+def _time_fields(start, duration):
+    # start/end/delta the way command/shell report them
+    begin = datetime.fromtimestamp(start)
+    delta = timedelta(seconds=duration)
+    return {'start': begin.strftime(_TIME_FORMAT), 'end': (begin + delta).strftime(_TIME_FORMAT),
+            'delta': str(delta) if delta.microseconds else str(delta) + '.000000'}
+
+
+def synthetic(hosts=100, tasks=20, payload=256, distinct=1, failed=0.01, changed=0.1, seed=0):
+    """
+    Events for one play of `tasks` tasks (in 5 roles) on `hosts` hosts.  Each result carries `payload` bytes of
+    stdout (and stdout_lines), one of `distinct` variants per task; `failed` and `changed` are the fractions of
+    results that fail or change.  Deterministic for a given seed.
+    """
+    rng = random.Random(seed)
+    t = 1459054687.0
+    inventory = [FakeHost('host%05d.example.com' % i) for i in range(hosts)]
+    roles = [FakeRole('role%d' % i, '/etc/ansible/roles/role%d' % i) for i in range(5)]
+    stats = FakeStats()
+
+    yield 'v2_playbook_on_start', (FakePlaybook('synthetic.yml'),)
+    yield 'v2_playbook_on_play_start', (FakePlay('synthetic'),)
+    for i in range(tasks):
+        task = FakeTask('task %d' % i, 'uuid-%d' % i, role=roles[i % len(roles)])
+        variants = [('%d:%d ' % (i, v) * (payload // 4 + 1))[:payload] for v in range(max(1, distinct))]
+        yield 'v2_playbook_on_task_start', (task, False)
+        for n, host in enumerate(inventory):
+            duration = rng.expovariate(2.0)
+            stdout = variants[n % len(variants)]
+            result = _time_fields(t, duration)
+            result.update({'rc': 0, 'stdout': stdout, 'stdout_lines': [stdout] if stdout else [], 'stderr': '',
+                           'changed': rng.random() < changed, 'cmd': 'true'})
+            status = 'ok'
+            if rng.random() < failed:
+                status = 'failed'
+                result.update({'rc': 1, 'failed': True, 'msg': 'non-zero return code'})
+            stats.add(host.name, status, result['changed'])
+            yield RESULT_HOOKS[status], (FakeTaskResult(host, task, result),)
+        t += 1.0
+    yield 'v2_playbook_on_stats', (stats,)
+
+
+def from_records(records, playbook='replay.yml'):
+    """
+    Events for a recorded run (record dicts as iter_records yields them): a task start whenever the task changes,
+    then its results.  Records stored without their result (binlog) get start/end/delta rebuilt from their times.
+    """
+    hosts = {}
+    roles = {}
+    stats = FakeStats()
+    task = key = None
+    play = ()
+    yield 'v2_playbook_on_start', (FakePlaybook(playbook),)
+    for rec in records:
+        hook = RESULT_HOOKS.get(rec.get('runnercode'))
+        if hook is None:
+            continue
+        if rec.get('play') != play:
+            play = rec.get('play')
+            yield 'v2_playbook_on_play_start', (FakePlay(play or 'replay'),)
+        rec_key = rec.get('taskid') or (rec.get('rolename'), rec.get('taskname'))
+        if rec_key != key:
+            key = rec_key
+            role = None
+            if rec.get('rolename'):
+                role = roles.get(rec['rolename'])
+                if role is None:
+                    role = roles[rec['rolename']] = FakeRole(rec['rolename'], rec.get('rolepath'))
+            task = FakeTask(rec.get('taskname'), rec.get('taskid') or str(key), role=role)
+            yield 'v2_playbook_on_task_start', (task, False)
+
+        host = hosts.get(rec['host'])
+        if host is None:
+            host = hosts[rec['host']] = FakeHost(rec['host'])
+        result = dict(rec.get('result') or {})
+        if 'delta' not in result and rec.get('start') is not None and rec.get('duration') is not None:
+            result.update(_time_fields(rec['start'], rec['duration']))
+        stats.add(host.name, rec['runnercode'], result.get('changed', False))
+        yield hook, (FakeTaskResult(host, task, result),)
+    yield 'v2_playbook_on_stats', (stats,)
+
+
+class _NullStream(object):
+    # stands in for stdout/stderr while replaying, so the plugins' display output costs nothing to print
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, s):
+        self.lines += s.count('\n')
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _quantile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ReplayStats(object):
+    """
+    Per event latency (seconds, all callbacks together) overall and by hook, the wall time of the dispatch loop,
+    the tracemalloc peak (bytes, None when not measured) and how many lines the callbacks printed.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = array('d')
+        self.by_hook = {}
+        self.wall = 0.0
+        self.peak = None
+        self.output_lines = 0
+
+    def add(self, hook, seconds):
+        self.latencies.append(seconds)
+        hook_latencies = self.by_hook.get(hook)
+        if hook_latencies is None:
+            hook_latencies = self.by_hook[hook] = array('d')
+        hook_latencies.append(seconds)
+
+    @property
+    def events(self):
+        return len(self.latencies)
+
+    @property
+    def total(self):
+        return sum(self.latencies)
+
+    @property
+    def throughput(self):
+        total = self.total
+        return self.events / total if total else 0.0
+
+    def quantiles(self, hook=None, qs=(0.5, 0.99)):
+        values = sorted(self.by_hook.get(hook, ()) if hook else self.latencies)
+        return [_quantile(values, q) for q in qs] + [values[-1] if values else 0.0]
+
+    def hook_lines(self):
+        lines = []
+        for hook in sorted(self.by_hook, key=lambda h: sum(self.by_hook[h]), reverse=True):
+            p50, p99, worst = self.quantiles(hook)
+            lines.append('    {0:<34} {1:>8} {2:>9.3f}s {3:>9.1f} {4:>9.1f} {5:>10.1f}'.format(
+                hook, len(self.by_hook[hook]), sum(self.by_hook[hook]), p50 * 1e6, p99 * 1e6, worst * 1e6))
+        return lines
+
+
+def load_callback(path):
+    """
+    The CallbackModule class from a plugin file, loaded by path the way ansible loads callback plugins.
+    """
+    name = 'ansible_diag_replay_' + os.path.splitext(os.path.basename(path))[0]
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        import imp
+        return imp.load_source(name, path).CallbackModule
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module.CallbackModule
+
+
+def replay(factories, events, name=None, memory=False, quiet=True):
+    """
+    Builds a callback from each factory (a CallbackModule class, say) and dispatches events to them in order, like
+    send_callback: each enabled callback's hook, then its v2_on_any.  Pass events as a list so building the fakes
+    isn't timed.  memory=True traces allocations from building the callbacks to the end for the peak; tracing slows
+    everything down, so time and measure memory in separate runs.  quiet swaps stdout/stderr for a line counter.
+    """
+    stats = ReplayStats(name or '+'.join(getattr(f, 'CALLBACK_NAME', getattr(f, '__name__', '?')) for f in factories))
+    tracing = memory and tracemalloc is not None
+    null = _NullStream()
+    # garbage from an earlier replay shouldn't be collected on this one's time
+    gc.collect()
+    saved = sys.stdout, sys.stderr
+    if quiet:
+        sys.stdout = sys.stderr = null
+    if tracing:
+        tracemalloc.start()
+    try:
+        callbacks = [factory() for factory in factories]
+        clock = perf_counter
+        add = stats.add
+        began = clock()
+        for hook, args in events:
+            t0 = clock()
+            for callback in callbacks:
+                if getattr(callback, 'disabled', False):
+                    continue
+                method = getattr(callback, hook, None)
+                if method is not None:
+                    method(*args)
+                any_method = getattr(callback, 'v2_on_any', None)
+                if any_method is not None:
+                    any_method(*args)
+            add(hook, clock() - t0)
+        stats.wall = clock() - began
+        if tracing:
+            stats.peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if tracing:
+            tracemalloc.stop()
+        sys.stdout, sys.stderr = saved
+        # the capture core is process wide; drop these plugins so the next replay starts clean
+        for factory in factories:
+            core.remove_sink(getattr(factory, 'CALLBACK_NAME', None))
+    stats.output_lines = null.lines
+    return stats
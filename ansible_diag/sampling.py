@@ -0,0 +1,147 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Host sampling for the recording path, shared by debug_log_json and execution_diag.
+
+At 10k+ hosts, keeping (and serializing) every full result costs more than the insight is worth.  A SamplingPolicy
+decides per result whether the full payload is kept:
+
+ - failed, unreachable and changed results: always
+ - everything else: only for a sample of hosts, picked by a stable hash of the host name (crc32, not hash(), so
+   every process and every run picks the same hosts; ANSIBLE_DIAG_SAMPLE_SALT changes the pick)
+
+Results that aren't kept go into a SampleSummary: per task counts by status (exact, every result is counted) and a
+duration sketch (quantiles within 1%, so reported as estimates).  Both plugins read ANSIBLE_DIAG_SAMPLE_RATE (the
+fraction of hosts whose full results are kept; default 1, keep everything) so they keep the same hosts.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import zlib
+from collections import OrderedDict
+
+from ansible_diag.sketch import QuantileSketch
+
+# statuses whose payload is always kept, whatever the rate (changed results are too, see always_kept)
+ALWAYS_KEEP = frozenset(('failed', 'unreachable'))
+
+
+def always_kept(status, changed=False):
+    """
+    True for a result kept whatever the rate: failed, unreachable or changed.
+    """
+    return status in ALWAYS_KEEP or bool(changed)
+
+
+class SamplingPolicy(object):
+
+    def __init__(self, rate=1.0, salt=''):
+        self.rate = min(1.0, max(0.0, rate))
+        self.salt = salt
+        self._threshold = int(self.rate * 0xffffffff)
+        # key: host, value: in the sample.  Bounded by the inventory.
+        self._hosts = {}
+
+    @classmethod
+    def from_env(cls):
+        return cls(float(os.getenv('ANSIBLE_DIAG_SAMPLE_RATE', 1.0)), os.getenv('ANSIBLE_DIAG_SAMPLE_SALT', ''))
+
+    @property
+    def enabled(self):
+        return self.rate < 1.0
+
+    def host_sampled(self, host):
+        sampled = self._hosts.get(host)
+        if sampled is None:
+            key = (self.salt + host).encode('utf-8')
+            sampled = self._hosts[host] = (zlib.crc32(key) & 0xffffffff) <= self._threshold
+        return sampled
+
+    def keep(self, host, status, changed=False):
+        """
+        True if this result's full payload should be kept.
+        """
+        if self.rate >= 1.0:
+            return True
+        # looked up first either way, so sampled_hosts/seen_hosts count every host
+        return self.host_sampled(host) or always_kept(status, changed)
+
+    @property
+    def sampled_hosts(self):
+        return sum(1 for v in self._hosts.values() if v)
+
+    @property
+    def seen_hosts(self):
+        return len(self._hosts)
+
+
+class SampleSummary(object):
+    """
+    What's left of results that weren't kept: per task (role, task) counts by status and a duration sketch.
+    """
+
+    def __init__(self):
+        # key: (role, task), value: [{status: count}, QuantileSketch]
+        self.tasks = OrderedDict()
+        self.kept = 0
+        self.summarized = 0
+
+    def add(self, rolename, taskname, status, duration=None):
+        entry = self.tasks.get((rolename, taskname))
+        if entry is None:
+            entry = self.tasks[(rolename, taskname)] = [{}, QuantileSketch()]
+        counts, sketch = entry
+        counts[status] = counts.get(status, 0) + 1
+        if duration is not None:
+            sketch.add(duration)
+        self.summarized += 1
+
+    def to_dict(self, policy):
+        """
+        JSON-ready summary (debug_log_json writes it to the stream as a SAMPLE_SUMMARY entry).  Counts and sums are
+        exact; quantiles come from the sketch and are flagged as estimated.
+        """
+        tasks = []
+        for (role, task), (counts, sketch) in self.tasks.items():
+            d = {'rolename': role, 'taskname': task, 'counts': counts, 'timed': sketch.count,
+                 'duration_sum': sketch.sum}
+            if sketch.count:
+                d['duration_estimated'] = {'p50': sketch.quantile(0.5), 'p90': sketch.quantile(0.9),
+                                           'p99': sketch.quantile(0.99), 'max': sketch.max}
+            tasks.append(d)
+        return {'entrytype': 'SAMPLE_SUMMARY', 'rate': policy.rate, 'hosts': policy.seen_hosts,
+                'sampled_hosts': policy.sampled_hosts, 'kept': self.kept, 'summarized': self.summarized,
+                'tasks': tasks}
+
+    def report_lines(self, policy, top_n=10):
+        lines = ['sampling: full results kept for {0} of {1} hosts (rate {2:g}) plus every failed, unreachable or '
+                 'changed result; {3} kept, {4} summarized'.format(policy.sampled_hosts, policy.seen_hosts,
+                                                                  policy.rate, self.kept, self.summarized)]
+        if not self.tasks:
+            return lines
+        lines.append('  summarized results by task (count, statuses, time, p50/p90/max; counts exact, ~ estimated):')
+        rows = sorted(self.tasks.items(), key=lambda kv: kv[1][1].sum, reverse=True)[:top_n]
+        for (role, task), (counts, sketch) in rows:
+            quantiles = '~{0:.1f}/~{1:.1f}/{2:.1f}'.format(sketch.quantile(0.5), sketch.quantile(0.9), sketch.max) \
+                if sketch.count else '-'
+            lines.append('  {0:>7}  {1:<24}  {2:>8.1f}s  {3:>17}  {4}'.format(
+                sum(counts.values()), ' '.join('{0}={1}'.format(k, v) for k, v in sorted(counts.items())),
+                sketch.sum, quantiles, '{0} : {1}'.format(role, task) if role else task))
+        return lines
@@ -0,0 +1,412 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Rotating, compressed output segments with a manifest.
+
+A long run at high verbosity shouldn't end up as one unbounded stream.  SegmentedFile writes into
+<prefix>-00000.ndjson.gz, <prefix>-00001.ndjson.gz, ... in a directory, starting a new segment once the current one
+would go over max_bytes (uncompressed; checked per record, so only a single record bigger than max_bytes makes a
+segment run over) or has been open max_seconds.  Compression (gzip, zlib or none) streams as data is written, on whichever background thread is doing
+the writing (BackgroundWriter or RingBufferWriter), never on the strategy loop.
+
+Every closed segment gets a line in <prefix>.manifest (NDJSON): its file, record count, raw and stored sizes, the
+time range of what's in it and the plays it covers.  Readers select segments from the manifest by play or time and
+only decompress those.  The segment open when a run is killed isn't in the manifest; gzip segments up to the last
+flush are still readable by hand.
+
+    python -m ansible_diag segments <dir or manifest> [--play NAME] [--since T] [--until T] [--cat]
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import glob
+import gzip
+import io
+import json
+import os
+import time
+import zlib
+
+from ansible_diag.history import parse_since
+from ansible_diag.ndjson import dumps_line
+from ansible_diag.writer import BackgroundWriter
+
+COMPRESSORS = ('gzip', 'zlib', 'none')
+_SUFFIX = {'gzip': '.gz', 'zlib': '.zz', 'none': ''}
+
+
+def options_from_env():
+    """
+    SegmentedFile/SegmentedWriter options shared by the plugins: ANSIBLE_DIAG_SEGMENT_MB (default 64),
+    ANSIBLE_DIAG_SEGMENT_SECONDS (default 600, 0 for no time cap) and ANSIBLE_DIAG_COMPRESS (gzip, zlib or none).
+    """
+    return {'max_bytes': int(float(os.getenv('ANSIBLE_DIAG_SEGMENT_MB', 64)) * 1024 * 1024),
+            'max_seconds': float(os.getenv('ANSIBLE_DIAG_SEGMENT_SECONDS', 600)),
+            'compress': os.getenv('ANSIBLE_DIAG_COMPRESS', 'gzip')}
+
+
+class _ZlibFile(object):
+    # streaming zlib into a raw file, same write/flush/close as GzipFile
+    def __init__(self, raw, level):
+        self._raw = raw
+        self._z = zlib.compressobj(level)
+
+    def write(self, data):
+        self._raw.write(self._z.compress(data))
+
+    def flush(self):
+        self._raw.write(self._z.flush(zlib.Z_SYNC_FLUSH))
+        self._raw.flush()
+
+    def close(self):
+        self._raw.write(self._z.flush())
+        self._raw.close()
+
+
+class SegmentedFile(object):
+    """
+    Stream-like (write/flush/close) file that rotates into compressed segments.  Not thread safe: one writer thread
+    owns it.  write() indexes data by the time it's written, a record per line; write_records() takes one record per
+    string; write_indexed() lets the caller say how many records a chunk holds, their time range and plays.
+    """
+
+    def __init__(self, directory, prefix='diag', max_bytes=64 * 1024 * 1024, max_seconds=600.0,
+                 compress='gzip', level=6):
+        if compress not in COMPRESSORS:
+            raise ValueError('compress must be one of {0}'.format(', '.join(COMPRESSORS)))
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.compress = compress
+        self.level = level
+        self.manifest_path = os.path.join(directory, prefix + '.manifest')
+        self.segments = 0
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # append: a second run into the same directory carries on numbering after the first, including the segment
+        # a killed run left out of the manifest
+        self._index = self._next_index()
+        self._manifest = open(self.manifest_path, 'a')
+        self._f = None
+        self._raw = None
+
+    def _next_index(self):
+        head = self.prefix + '-'
+        found = [-1]
+        for name in os.listdir(self.directory):
+            if name.startswith(head) and '.ndjson' in name:
+                index = name[len(head):].split('.', 1)[0]
+                if index.isdigit():
+                    found.append(int(index))
+        if os.path.exists(self.manifest_path):
+            found.extend(e['index'] for e in read_manifest(self.manifest_path))
+        return max(found) + 1
+
+    def room(self):
+        """
+        Bytes the open segment takes before rotating (max_bytes when none is open).
+        """
+        return self.max_bytes - self._bytes if self._f is not None else self.max_bytes
+
+    def _open_segment(self):
+        name = '{0}-{1:05d}.ndjson{2}'.format(self.prefix, self._index, _SUFFIX[self.compress])
+        self._path = os.path.join(self.directory, name)
+        self._raw = open(self._path, 'wb')
+        if self.compress == 'gzip':
+            self._f = gzip.GzipFile(filename='', mode='wb', compresslevel=self.level, fileobj=self._raw)
+        elif self.compress == 'zlib':
+            self._f = _ZlibFile(self._raw, self.level)
+        else:
+            self._f = self._raw
+        self._opened = time.time()
+        self._bytes = 0
+        self._records = 0
+        self._first = None
+        self._last = None
+        self._plays = set()
+
+    def _close_segment(self):
+        self._f.close()
+        if self._f is not self._raw:
+            self._raw.close()
+        entry = {'segment': os.path.basename(self._path), 'index': self._index, 'records': self._records,
+                 'raw_bytes': self._bytes, 'stored_bytes': os.path.getsize(self._path), 'opened': self._opened,
+                 'closed': time.time(), 'first': self._first, 'last': self._last,
+                 'plays': sorted(p for p in self._plays if p is not None)}
+        self._manifest.write(dumps_line(entry))
+        self._manifest.flush()
+        self._f = self._raw = None
+        self._index += 1
+        self.segments += 1
+
+    def _rotate_if_due(self, now, incoming=0):
+        # a segment always takes its first write, however big, so an oversized record still goes somewhere
+        if self._f is not None and ((self._bytes and self._bytes + incoming > self.max_bytes) or
+                                    (self.max_seconds and now - self._opened >= self.max_seconds)):
+            self._close_segment()
+
+    def write_indexed(self, data, records=0, first=None, last=None, plays=()):
+        if not data:
+            return
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self._rotate_if_due(time.time(), len(data))
+        if self._f is None:
+            self._open_segment()
+        self._f.write(data)
+        self._bytes += len(data)
+        self._records += records
+        if first is not None and (self._first is None or first < self._first):
+            self._first = first
+        if last is not None and (self._last is None or last > self._last):
+            self._last = last
+        self._plays.update(plays)
+
+    def write_records(self, records, first=None, last=None, plays=()):
+        """
+        Write a list of records (a string each, however many lines it takes), counted one apiece and grouped into
+        as few writes as fit the open segment, so rotation lands between records.
+        """
+        chunk = []
+        size = 0
+        room = self.room()
+        for record in records:
+            if not isinstance(record, bytes):
+                record = record.encode('utf-8')
+            if chunk and size + len(record) > room:
+                self.write_indexed(b''.join(chunk), len(chunk), first, last, plays)
+                chunk = []
+                size = 0
+                room = self.max_bytes
+            chunk.append(record)
+            size += len(record)
+        if chunk:
+            self.write_indexed(b''.join(chunk), len(chunk), first, last, plays)
+
+    def write(self, data):
+        now = time.time()
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if len(data) > self.room():
+            # split at line ends so the segment boundary falls between records
+            chunk = []
+            size = 0
+            room = self.room()
+            for line in data.splitlines(True):
+                if chunk and size + len(line) > room:
+                    self.write_indexed(b''.join(chunk), len(chunk), now, now)
+                    chunk = []
+                    size = 0
+                    room = self.max_bytes
+                chunk.append(line)
+                size += len(line)
+            data = b''.join(chunk)
+        self.write_indexed(data, data.count(b'\n'), now, now)
+
+    def flush(self):
+        if self._f is not None:
+            self._f.flush()
+            # an idle segment past its time still gets closed
+            self._rotate_if_due(time.time())
+
+    def close(self):
+        if self._f is not None:
+            self._close_segment()
+        self._manifest.close()
+
+
+def _record_index(record):
+    # (time, play) of a TaskRecord for the manifest: arrival on the controller, else the module's end.  Plain dict
+    # entries (summaries) aren't indexed.
+    if isinstance(record, dict):
+        return None, None
+    t = record.ctl_end if record.ctl_end is not None else record.end
+    return t, record.play
+
+
+class SegmentedWriter(BackgroundWriter):
+    """
+    BackgroundWriter into a SegmentedFile: items are formatted and compressed on the writer thread, and each batch
+    is indexed by index_item(item) -> (time or None, play or None).
+    """
+
+    def __init__(self, directory, format_item=dumps_line, index_item=_record_index, prefix='diag',
+                 max_bytes=64 * 1024 * 1024, max_seconds=600.0, compress='gzip', **kwargs):
+        self.path = directory
+        self._index_item = index_item
+        kwargs.setdefault('name', 'diag-segment-writer')
+        super(SegmentedWriter, self).__init__(SegmentedFile(directory, prefix, max_bytes, max_seconds, compress),
+                                              format_item, **kwargs)
+
+    def _write_batch(self, batch):
+        # items are grouped into one write each while they fit the open segment, so rotation lands between records
+        chunks = []
+        size = 0
+        first = last = None
+        plays = set()
+        room = self._stream.room()
+        for item in batch:
+            try:
+                chunk = self._format_item(item).encode('utf-8')
+                t, play = self._index_item(item)
+            except Exception:
+                self.errors += 1
+                continue
+            if chunks and size + len(chunk) > room:
+                self._write_chunks(chunks, first, last, plays)
+                chunks = []
+                size = 0
+                first = last = None
+                plays = set()
+                room = self._stream.max_bytes
+            chunks.append(chunk)
+            size += len(chunk)
+            if t is not None:
+                if first is None or t < first:
+                    first = t
+                if last is None or t > last:
+                    last = t
+            plays.add(play)
+
+        if chunks:
+            self._write_chunks(chunks, first, last, plays)
+
+    def _write_chunks(self, chunks, first, last, plays):
+        self._stream.write_indexed(b''.join(chunks), len(chunks), first, last, plays)
+        self.written += len(chunks)
+
+
+def read_manifest(path):
+    """
+    Manifest entries (dicts) for a manifest file, or for the only manifest in a directory.
+    """
+    if os.path.isdir(path):
+        found = glob.glob(os.path.join(path, '*.manifest'))
+        if len(found) != 1:
+            raise ValueError('{0}: expected one *.manifest, found {1}'.format(path, len(found)))
+        path = found[0]
+    entries = []
+    base = os.path.dirname(path)
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                entry['path'] = os.path.join(base, entry['segment'])
+                entries.append(entry)
+    return entries
+
+
+def select(entries, play=None, since=None, until=None):
+    """
+    Entries that may hold records for play and/or overlap [since, until] (epoch seconds).  Segments without a time
+    range (nothing indexed) are kept, since they can't be ruled out.
+    """
+    out = []
+    for e in entries:
+        if play is not None and e['plays'] and play not in e['plays']:
+            continue
+        if since is not None and e['last'] is not None and e['last'] < since:
+            continue
+        if until is not None and e['first'] is not None and e['first'] > until:
+            continue
+        out.append(e)
+    return out
+
+
+def open_segment(path):
+    """
+    Text lines of one segment, decompressed as they're read.
+    """
+    if path.endswith('.gz'):
+        # zlib rather than gzip.open: GzipFile has no read1() for TextIOWrapper on python 2, and zlib reads a segment
+        # left without its trailer by a killed run up to the last flush instead of raising
+        return _zlib_lines(path, 16 + zlib.MAX_WBITS)
+    if path.endswith('.zz'):
+        return _zlib_lines(path)
+    return io.open(path, encoding='utf-8')
+
+
+def _zlib_lines(path, wbits=zlib.MAX_WBITS):
+    d = zlib.decompressobj(wbits)
+    pending = b''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                break
+            pending += d.decompress(chunk)
+            while d.unused_data:
+                # concatenated gzip members (e.g. appended by hand) read as one stream, like gzip.open
+                chunk = d.unused_data
+                pending += d.flush()
+                d = zlib.decompressobj(wbits)
+                pending += d.decompress(chunk)
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line.decode('utf-8') + '\n'
+    pending += d.flush()
+    if pending:
+        yield pending.decode('utf-8')
+
+
+def iter_lines(path, play=None, since=None, until=None):
+    for entry in select(read_manifest(path), play, since, until):
+        lines = open_segment(entry['path'])
+        try:
+            for line in lines:
+                yield line
+        finally:
+            close = getattr(lines, 'close', None)
+            if close:
+                close()
+
+
+def cmd_segments(args):
+    since = parse_since(args.since) if args.since else None
+    until = parse_since(args.until) if args.until else None
+    if args.cat:
+        for line in iter_lines(args.manifest, args.play, since, until):
+            print(line, end='')
+        return 0
+
+    entries = select(read_manifest(args.manifest), args.play, since, until)
+    fmt = '{0:<28} {1:>9} {2:>12} {3:>12} {4:>8}  {5:<19} {6:<19} {7}'
+    print(fmt.format('segment', 'records', 'raw', 'stored', 'ratio', 'first', 'last', 'plays'))
+    stamp = lambda t: time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) if t is not None else '-'
+    for e in entries:
+        print(fmt.format(e['segment'], e['records'], e['raw_bytes'], e['stored_bytes'],
+                         '{0:.1f}x'.format(e['raw_bytes'] / e['stored_bytes']) if e['stored_bytes'] else '-',
+                         stamp(e['first']), stamp(e['last']), ', '.join(e['plays'])))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('segments', help='list or read rotated output segments',
+                              description='List the segments of a rotated, compressed diag output (from its '
+                                          'manifest) that match a play or time range, or print their contents.')
+    p.add_argument('manifest', help='segment directory or its .manifest file')
+    p.add_argument('--play', help='only segments holding records for this play')
+    p.add_argument('--since', help='only segments with records at or after this time (7d, 12h, 30m ago, or epoch)')
+    p.add_argument('--until', help='only segments with records at or before this time (same forms)')
+    p.add_argument('--cat', action='store_true', help='print the matching segments\' lines instead of listing them')
+    p.set_defaults(func=cmd_segments)
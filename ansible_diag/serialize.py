@@ -0,0 +1,134 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+
+from ansible_diag.compat import string_types
+
+# fields that can carry megabytes (package lists, shell dumps).  Anything over the budget is cut down.
+BULKY_FIELDS = ('stdout', 'stderr', 'stdout_lines', 'stderr_lines', 'msg')
+
+
+def _canonical(item):
+    # bytes of one element of a capped list: text as utf-8, bytes as they are, anything else as sorted JSON
+    if isinstance(item, bytes):
+        return item
+    if isinstance(item, string_types):
+        return item.encode('utf-8', 'replace')
+    return json.dumps(item, sort_keys=True, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _digest(s):
+    if not isinstance(s, bytes):
+        s = s.encode('utf-8', 'replace')
+    return hashlib.sha1(s).hexdigest()
+
+
+def _digest_lines(lines):
+    # sha1 of the elements joined by newlines, without building the joined value; bytes, text and other elements
+    # can be mixed
+    h = hashlib.sha1()
+    for i, line in enumerate(lines):
+        if i:
+            h.update(b'\n')
+        h.update(_canonical(line))
+    return h.hexdigest()
+
+
+class ResultFormatter(object):
+    """
+    Turns result dicts into (bounded) JSON text.
+
+     - fields: if given, only these keys are kept (e.g. rc, start, end, delta, changed)
+     - max_bytes: budget for each of the BULKY_FIELDS (measured in characters, which for command output is close
+       enough to bytes and doesn't need an encode to find out).  Over budget, a string keeps its first max_bytes characters and
+       a list of lines keeps as many lines as fit; either way the field is replaced by a dict carrying what was kept,
+       the original size and a sha1 of the full value, so identical output can still be spotted.  0 means no limit.
+
+    The encoder is built once, here, rather than per call.
+    """
+
+    def __init__(self, fields=None, max_bytes=4096, indent=2):
+        self.fields = tuple(fields) if fields else None
+        self.max_bytes = max_bytes
+        self._encoder = json.JSONEncoder(sort_keys=True, indent=indent,
+                                         separators=(',', ': ') if indent else (',', ':'), default=str)
+
+    def _cap(self, value):
+        budget = self.max_bytes
+        if isinstance(value, (list, tuple)) and isinstance(value[0], string_types):
+            # lines are measured as they are; an element that isn't a string (a stray number or dict among
+            # stdout_lines) by its JSON text
+            sizes = [len(line) + 1 if isinstance(line, string_types) else len(_canonical(line)) + 1
+                     for line in value]
+            size = 0
+            kept = 0
+            for n in sizes:
+                size += n
+                if size > budget:
+                    break
+                kept += 1
+            if kept == len(value):
+                return value
+            return {'truncated': True, 'head': list(value[:kept]), 'lines': len(value), 'bytes': sum(sizes),
+                    'sha1': _digest_lines(value)}
+
+        if isinstance(value, string_types) and len(value) > budget:
+            return {'truncated': True, 'head': value[:budget], 'bytes': len(value), 'sha1': _digest(value)}
+
+        return value
+
+    def project(self, result):
+        """
+        Returns a (shallow) copy of result with the field projection and size caps applied.
+        """
+        if self.fields:
+            out = dict((k, result[k]) for k in self.fields if k in result)
+        else:
+            out = dict(result)
+
+        if self.max_bytes:
+            for k in BULKY_FIELDS:
+                v = out.get(k)
+                if v:
+                    out[k] = self._cap(v)
+        return out
+
+    def dumps(self, result):
+        return self._encoder.encode(self.project(result))
+
+    def lazy(self, result):
+        return LazyResult(self, result)
+
+
+class LazyResult(object):
+    """
+    A result waiting to be formatted.  Nothing is projected, capped or encoded until str() is called, which for the
+    diag plugins means on the output thread, if the line is ever written at all.
+    """
+    __slots__ = ('_formatter', '_result')
+
+    def __init__(self, formatter, result):
+        self._formatter = formatter
+        self._result = result
+
+    def __str__(self):
+        return self._formatter.dumps(self._result)
@@ -0,0 +1,230 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+What-if scheduling simulator: replays a recorded run's per host task durations under other forks / serial /
+strategy settings and predicts the wall time of each.
+
+The model is event driven, with a heap of fork workers keyed by when each becomes free:
+
+ - linear: hosts go through a task in inventory order, each taking the first free worker; the next task starts when
+   the last host finishes (the barrier).  With forks >= hosts a task simply takes as long as its slowest host.
+ - free:   every host runs its own task list back to back; whichever host has been ready longest gets the next free
+   worker.
+ - serial: hosts are split into batches of that size, and each batch runs the whole play before the next starts.
+
+Each (host, task) can carry a fixed controller overhead (--task-overhead) on top of the recorded duration.  10k
+hosts x 500 tasks is 5M heap operations per configuration: seconds, not minutes.
+
+    python -m ansible_diag simulate run.ndjson --forks 5,25,50 --serial 0,500 --strategy linear,free
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import heapq
+import itertools
+import math
+import random
+import time
+from array import array
+from collections import OrderedDict
+
+from ansible_diag.loaders import iter_records
+from ansible_diag.spans import SpanClock, task_key
+
+
+class Workload(object):
+    """
+    durations[task][host] (seconds), tasks in the order they ran, hosts in the order they first reported.  Hosts
+    that didn't run a task (skipped, no result) get 0.
+    """
+
+    def __init__(self, hosts, tasks, durations, recorded_wall=None):
+        self.hosts = hosts
+        self.tasks = tasks
+        self.durations = durations
+        self.recorded_wall = recorded_wall
+
+    @classmethod
+    def from_records(cls, records):
+        host_index = OrderedDict()
+        task_index = OrderedDict()
+        cells = []
+        first = last = None
+        span_times = SpanClock()
+
+        for rec in records:
+            duration = rec.get('duration')
+            times = span_times(rec)
+            if times is not None:
+                first = times[0] if first is None else min(first, times[0])
+                last = times[1] if last is None else max(last, times[1])
+                if duration is None:
+                    duration = times[1] - times[0]
+            if duration is None:
+                continue
+            h = host_index.setdefault(rec['host'], len(host_index))
+            t = task_index.setdefault(task_key(rec), len(task_index))
+            cells.append((t, h, duration))
+
+        n_hosts = len(host_index)
+        durations = [array('d', [0.0]) * n_hosts for _ in task_index]
+        for t, h, duration in cells:
+            durations[t][h] += duration
+
+        return cls(list(host_index), list(task_index), durations,
+                   (last - first) if first is not None else None)
+
+    @classmethod
+    def synthetic(cls, hosts, tasks, mean=2.0, sigma=0.5, seed=0):
+        """
+        hosts x tasks of lognormal durations with the given mean, for sizing the simulator itself.
+        """
+        rnd = random.Random(seed)
+        # lognormvariate(0, sigma) has mean exp(sigma^2 / 2)
+        scale = mean / math.exp(sigma * sigma / 2)
+        durations = [array('d', (scale * rnd.lognormvariate(0.0, sigma) for _ in range(hosts))) for _ in range(tasks)]
+        return cls(['host%d' % i for i in range(hosts)], ['task%d' % i for i in range(tasks)], durations)
+
+
+def _batches(n_hosts, serial):
+    if not serial or serial >= n_hosts:
+        return [(0, n_hosts)]
+    return [(lo, min(lo + serial, n_hosts)) for lo in range(0, n_hosts, serial)]
+
+
+def simulate_linear(workload, forks, serial=0, overhead=0.0):
+    total = 0.0
+    for lo, hi in _batches(len(workload.hosts), serial):
+        width = hi - lo
+        for row in workload.durations:
+            batch = row[lo:hi]
+            if forks >= width:
+                # every host gets a worker straight away: the barrier is the slowest host
+                total += max(batch) + overhead
+                continue
+            workers = [0.0] * forks
+            replace = heapq.heapreplace
+            finish = 0.0
+            for d in batch:
+                end = workers[0] + d + overhead
+                replace(workers, end)
+                if end > finish:
+                    finish = end
+            total += finish
+    return total
+
+
+def simulate_free(workload, forks, serial=0, overhead=0.0):
+    durations = workload.durations
+    n_tasks = len(durations)
+    total = 0.0
+    if not n_tasks:
+        return total
+
+    for lo, hi in _batches(len(workload.hosts), serial):
+        # hosts: (ready time, host, next task); workers: free time
+        ready = [(0.0, h, 0) for h in range(lo, hi)]
+        workers = [0.0] * min(forks, hi - lo)
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        replace = heapq.heapreplace
+        finish = 0.0
+        while ready:
+            t, h, i = heappop(ready)
+            w = workers[0]
+            end = (w if w > t else t) + durations[i][h] + overhead
+            replace(workers, end)
+            i += 1
+            if i < n_tasks:
+                heappush(ready, (end, h, i))
+            elif end > finish:
+                finish = end
+        total += finish
+    return total
+
+
+STRATEGIES = OrderedDict([('linear', simulate_linear), ('free', simulate_free)])
+
+
+def _int_list(minimum):
+    # argparse type: comma separated ints, none below minimum
+    def parse(s):
+        try:
+            values = [int(v) for v in s.split(',') if v.strip()]
+        except ValueError:
+            raise argparse.ArgumentTypeError('expected comma separated integers, got {0!r}'.format(s))
+        if not values:
+            raise argparse.ArgumentTypeError('no values given')
+        low = [v for v in values if v < minimum]
+        if low:
+            raise argparse.ArgumentTypeError('must be at least {0}, got {1}'.format(
+                minimum, ','.join(str(v) for v in low)))
+        return values
+    return parse
+
+
+def cmd_simulate(args):
+    loaded = time.time()
+    if args.synthetic:
+        hosts, tasks = (int(v) for v in args.synthetic.lower().split('x'))
+        workload = Workload.synthetic(hosts, tasks)
+        source = 'synthetic {0} hosts x {1} tasks'.format(hosts, tasks)
+    elif args.input:
+        workload = Workload.from_records(iter_records(args.input))
+        source = args.input
+    else:
+        print('give a recorded run or --synthetic HOSTSxTASKS')
+        return 2
+    loaded = time.time() - loaded
+
+    print('workload: {0} ({1} hosts x {2} tasks, loaded in {3:.1f}s)'.format(
+        source, len(workload.hosts), len(workload.tasks), loaded))
+    if workload.recorded_wall is not None:
+        print('recorded wall time: {0:.1f}s (first start to last end)'.format(workload.recorded_wall))
+    print('')
+    print('{0:>8}  {1:>6}  {2:>6}  {3:>12}  {4:>8}'.format('strategy', 'forks', 'serial', 'predicted', 'sim time'))
+
+    rows = []
+    for strategy, forks, serial in itertools.product(args.strategy.split(','), args.forks, args.serial):
+        func = STRATEGIES[strategy]
+        started = time.time()
+        predicted = func(workload, forks, serial, args.task_overhead)
+        rows.append((predicted, strategy, forks, serial, time.time() - started))
+
+    for predicted, strategy, forks, serial, elapsed in sorted(rows):
+        print('{0:>8}  {1:>6}  {2:>6}  {3:>11.1f}s  {4:>7.2f}s'.format(
+            strategy, forks, serial or '-', predicted, elapsed))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('simulate', help='predict wall time under other forks/serial/strategy settings',
+                              description='Replay a recorded run\'s per host task durations under different forks, '
+                                          'serial batch sizes and linear/free strategy.')
+    p.add_argument('input', nargs='?', help='debug_log_json NDJSON stream')
+    p.add_argument('--synthetic', metavar='HOSTSxTASKS', help='simulate a generated workload instead, e.g. 10000x500')
+    p.add_argument('--forks', type=_int_list(1), default='5,10,25,50,100',
+                   help='comma separated forks values, 1 or more (default 5,10,25,50,100)')
+    p.add_argument('--serial', type=_int_list(0), default='0',
+                   help='comma separated serial batch sizes, 0 for none (default 0)')
+    p.add_argument('--strategy', default='linear,free', help='comma separated: linear, free (default both)')
+    p.add_argument('--task-overhead', type=float, default=0.0,
+                   help='controller overhead added to every host x task, seconds (default 0)')
+    p.set_defaults(func=cmd_simulate)
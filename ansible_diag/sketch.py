@@ -0,0 +1,153 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import heapq
+import itertools
+import math
+
+
+class TopN(object):
+    """
+    Keeps the n items with the largest keys seen so far, in a min-heap of size n: O(log n) per push, O(n) memory.
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self._heap = []
+        # tie breaker so items themselves never get compared
+        self._seq = itertools.count()
+
+    def push(self, key, item):
+        if self.n <= 0:
+            return
+        entry = (key, next(self._seq), item)
+        if len(self._heap) < self.n:
+            heapq.heappush(self._heap, entry)
+        elif key > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self):
+        """
+        [(key, item), ...], largest first
+        """
+        return [(key, item) for key, _, item in sorted(self._heap, reverse=True)]
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class QuantileSketch(object):
+    """
+    Mergeable quantile sketch (the DDSketch scheme) for non-negative values such as durations.
+
+    Values land in logarithmic buckets: bucket k covers (gamma^(k-1), gamma^k] with gamma = (1+a)/(1-a), so any
+    quantile comes back within relative error a of a real value.  Memory is bounded by the range of values, not how
+    many there are: 1ms .. 1 day at a=1% is ~900 buckets.  max_buckets caps it hard by folding the lowest buckets
+    together, which only costs accuracy at the very bottom of the distribution.
+
+    Two sketches with the same relative_accuracy merge exactly (bucket counts add up), which is how per task
+    sketches roll up to a whole run.
+    """
+
+    # anything at or below this counts as zero
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01, max_buckets=2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if value <= self.MIN_VALUE:
+            self.zero_count += 1
+            return
+
+        k = int(math.ceil(math.log(value) / self._log_gamma))
+        self.buckets[k] = self.buckets.get(k, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.buckets)
+        excess = len(keys) - self.max_buckets
+        if excess <= 0:
+            return
+        into = keys[excess]
+        for k in keys[:excess]:
+            self.buckets[into] += self.buckets.pop(k)
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("can't merge sketches with different relative accuracy")
+        if not other.count:
+            return self
+
+        for k, n in other.buckets.items():
+            self.buckets[k] = self.buckets.get(k, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._collapse()
+        return self
+
+    def quantile(self, q):
+        """
+        Value at quantile q (0..1), or None if the sketch is empty.
+        """
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return self.min if self.min > 0 else 0.0
+
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                # middle of the bucket, in relative terms
+                value = 2 * self._gamma ** k / (self._gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
@@ -0,0 +1,93 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Turning task records into time spans for the timeline style reports (trace export, concurrency, ...).
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+def _controller_times(rec):
+    # result arrival on the controller is the end; the module's own duration (a difference, so no clock offset in
+    # it) counts back from there, but not past the task's start
+    ctl_end = rec.get('ctl_end')
+    if ctl_end is None:
+        return None
+    ctl_start = rec.get('ctl_start')
+    duration = rec.get('duration')
+    if duration is None and rec.get('start') is not None and rec.get('end') is not None:
+        duration = rec['end'] - rec['start']
+    if duration is not None:
+        start = ctl_end - duration
+        return (max(start, ctl_start) if ctl_start is not None else start), ctl_end
+    if ctl_start is None:
+        return None
+    return ctl_start, ctl_end
+
+
+def _module_times(rec):
+    # the module's own start/end (host clock), falling back to start + duration
+    start = rec.get('start')
+    if start is None:
+        return None
+    end = rec.get('end')
+    if end is None:
+        duration = rec.get('duration')
+        if duration is None:
+            return None
+        end = start + duration
+    return start, end
+
+
+class SpanClock(object):
+    """
+    (start, end) epoch seconds for task records, all on one clock.  Module start/end come from each host's own clock
+    (skew, and the host's timezone, since the strings carry none), so they can't share a timeline with the
+    controller's times.  Recordings with controller times (ctl_start/ctl_end, debug_log_json since it split out
+    overhead) are put on the controller's clock: a span ends when the result arrived and starts the module's duration
+    earlier.  Older recordings, and the history store, have only module times; for those the module clock is used.
+
+    The first record with any times decides; records that can't be put on that clock give None and are counted in
+    skipped.  Use one SpanClock per pass over a recording.
+    """
+
+    def __init__(self):
+        # True: controller clock, False: module clock, None: not decided yet
+        self.controller = None
+        self.skipped = 0
+
+    def __call__(self, rec):
+        if self.controller is None:
+            if rec.get('ctl_end') is not None:
+                self.controller = True
+            elif rec.get('start') is not None:
+                self.controller = False
+            else:
+                return None
+        times = _controller_times(rec) if self.controller else _module_times(rec)
+        if times is None:
+            self.skipped += 1
+        return times
+
+
+def task_key(rec):
+    """
+    Identifies the task instance a record belongs to: its uuid when recorded, else (play, role, task).
+    """
+    return rec.get('taskid') or (rec.get('play'), rec.get('rolename'), rec.get('taskname'))
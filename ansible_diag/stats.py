@@ -0,0 +1,158 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Small statistics helpers (no scipy on the controller).
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import math
+
+
+def mean_var(values):
+    """
+    (n, mean, sample variance) in one pass (Welford).  Variance is 0.0 for fewer than two values.
+    """
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    for x in values:
+        n += 1
+        d = x - mean
+        mean += d / n
+        m2 += d * (x - mean)
+    return n, mean, (m2 / (n - 1) if n > 1 else 0.0)
+
+
+class RunningStats(object):
+    """
+    Streaming count/mean/variance/min/max (Welford), one value at a time.
+    """
+    __slots__ = ('n', 'mean', '_m2', 'min', 'max')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self._m2 += d * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        return self._m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+
+def _betacf(a, b, x):
+    # continued fraction for the incomplete beta function (Numerical Recipes, betacf)
+    qab = a + b
+    qap = a + 1.0
+    qam = a - 1.0
+    c = 1.0
+    d = 1.0 - qab * x / qap
+    if abs(d) < 1e-30:
+        d = 1e-30
+    d = 1.0 / d
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1.0 + aa * d
+        if abs(d) < 1e-30:
+            d = 1e-30
+        c = 1.0 + aa / c
+        if abs(c) < 1e-30:
+            c = 1e-30
+        d = 1.0 / d
+        h *= d * c
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1.0 + aa * d
+        if abs(d) < 1e-30:
+            d = 1e-30
+        c = 1.0 + aa / c
+        if abs(c) < 1e-30:
+            c = 1e-30
+        d = 1.0 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1.0) < 3e-12:
+            break
+    return h
+
+
+def _betai(a, b, x):
+    # regularized incomplete beta I_x(a, b)
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    lbeta = math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1.0 - x)
+    if x < (a + 1.0) / (a + b + 2.0):
+        return math.exp(lbeta) * _betacf(a, b, x) / a
+    return 1.0 - math.exp(lbeta) * _betacf(b, a, 1.0 - x) / b
+
+
+def t_sf(t, df):
+    """
+    One sided p-value P(T > t) for Student's t with df degrees of freedom.
+    """
+    if df <= 0:
+        return None
+    p = 0.5 * _betai(df / 2.0, 0.5, df / (df + t * t))
+    return p if t > 0 else 1.0 - p
+
+
+def welch_t(n1, mean1, var1, n2, mean2, var2):
+    """
+    Welch's t-test for mean1 > mean2.  Returns (t, one sided p-value), or (None, None) if it can't be computed.
+    """
+    if n1 < 2 or n2 < 2:
+        return None, None
+    se1 = var1 / n1
+    se2 = var2 / n2
+    se = se1 + se2
+    if se <= 0:
+        return None, None
+    t = (mean1 - mean2) / math.sqrt(se)
+    df = se * se / ((se1 * se1) / (n1 - 1) + (se2 * se2) / (n2 - 1)) if se1 or se2 else n1 + n2 - 2
+    return t, t_sf(t, df)
+
+
+def prediction_t(x, n, mean, var):
+    """
+    Is a single new observation x larger than a baseline sample (n, mean, var) would predict?  Returns
+    (t, one sided p-value) from the t prediction interval, or (None, None) with fewer than two baseline values.
+    """
+    if n < 2 or var <= 0:
+        return None, None
+    t = (x - mean) / math.sqrt(var * (1.0 + 1.0 / n))
+    return t, t_sf(t, n - 1)
@@ -0,0 +1,200 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Linear strategy barrier and straggler analysis.
+
+Under the linear strategy every host waits at the end of each task for the slowest one.  For each task this reports
+the barrier: how long hosts sat waiting on the slowest (SUM(slowest end - host end)), which hosts were stragglers
+(slower than --factor x the task's median and by at least --min-delta seconds), and the time lost to them: how much
+sooner the task would have finished if it had ended with its slowest non-straggler.  The losses add up to the run
+time the playbook lost to stragglers.
+
+Hosts are also ranked across the whole run: each host keeps running stats (Welford) of its slowness, its duration
+divided by the task's median, so a host that is a bit slow on every task stands out as well as one that's very
+slow once.
+
+    python -m ansible_diag stragglers run.ndjson
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from array import array
+from collections import OrderedDict
+
+from ansible_diag.loaders import iter_records
+from ansible_diag.records import StringTable
+from ansible_diag.spans import SpanClock, task_key
+from ansible_diag.stats import RunningStats
+
+
+class _TaskHosts(object):
+    """
+    One task's per host (host id, duration, end), in compact arrays.
+    """
+    __slots__ = ('name', 'hosts', 'durations', 'ends')
+
+    def __init__(self, name):
+        self.name = name
+        self.hosts = array('i')
+        self.durations = array('d')
+        self.ends = array('d')
+
+
+class TaskBarrier(object):
+    __slots__ = ('name', 'hosts', 'median', 'slowest', 'wait', 'lost', 'stragglers')
+
+    def __init__(self, name, hosts, median, slowest, wait, lost, stragglers):
+        self.name = name
+        self.hosts = hosts
+        self.median = median
+        self.slowest = slowest
+        # SUM(time each host waited at the barrier)
+        self.wait = wait
+        # how much longer the task took because of its stragglers
+        self.lost = lost
+        # [(host, duration), ...] slowest first
+        self.stragglers = stragglers
+
+
+class StragglerReport(object):
+
+    def __init__(self, factor=1.5, min_delta=1.0):
+        self.factor = factor
+        self.min_delta = min_delta
+        self.strings = StringTable()
+        self._span_times = SpanClock()
+        self._tasks = OrderedDict()
+
+        # filled in by compute()
+        self.barriers = []
+        self.lost = 0.0
+        self.wait = 0.0
+        # key: host id, value: [RunningStats of slowness, times a straggler, times the slowest]
+        self.host_stats = {}
+
+    def add(self, rec):
+        duration = rec.get('duration')
+        times = self._span_times(rec)
+        if duration is None:
+            if times is None:
+                return
+            duration = times[1] - times[0]
+
+        key = task_key(rec)
+        t = self._tasks.get(key)
+        if t is None:
+            t = self._tasks[key] = _TaskHosts(rec.get('taskname'))
+        t.hosts.append(self.strings.intern(rec['host']))
+        t.durations.append(duration)
+        # without real end times, hosts are assumed to start together (which linear mostly does)
+        t.ends.append(times[1] if times else duration)
+
+    def _host(self, host_id):
+        h = self.host_stats.get(host_id)
+        if h is None:
+            h = self.host_stats[host_id] = [RunningStats(), 0, 0]
+        return h
+
+    def compute(self):
+        lookup = self.strings.lookup
+        for t in self._tasks.values():
+            n = len(t.durations)
+            ordered = sorted(range(n), key=t.durations.__getitem__)
+            median = t.durations[ordered[n // 2]]
+            slowest_i = ordered[-1]
+            slowest = t.durations[slowest_i]
+            last_end = max(t.ends)
+            wait = sum(last_end - end for end in t.ends)
+
+            cutoff = max(median * self.factor, median + self.min_delta)
+            stragglers = [i for i in reversed(ordered) if t.durations[i] > cutoff]
+            if stragglers:
+                kept = ordered[:n - len(stragglers)]
+                lost = slowest - (t.durations[kept[-1]] if kept else median)
+            else:
+                lost = 0.0
+
+            for i in range(n):
+                h = self._host(t.hosts[i])
+                if median > 0:
+                    h[0].add(t.durations[i] / median)
+            for i in stragglers:
+                self._host(t.hosts[i])[1] += 1
+            if n > 1:
+                self._host(t.hosts[slowest_i])[2] += 1
+
+            self.barriers.append(TaskBarrier(t.name, n, median, slowest, wait, lost,
+                                             [(lookup(t.hosts[i]), t.durations[i]) for i in stragglers]))
+            self.lost += lost
+            self.wait += wait
+        return self
+
+    def ranked_hosts(self, min_tasks=3):
+        """
+        [(host, mean slowness, stddev, tasks, times a straggler, times the slowest), ...], slowest first.  Hosts
+        seen on fewer than min_tasks tasks are left out; one bad task isn't a pattern.
+        """
+        rows = [(self.strings.lookup(host_id), s.mean, s.stddev, s.n, straggler, slowest)
+                for host_id, (s, straggler, slowest) in self.host_stats.items() if s.n >= min_tasks]
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return rows
+
+
+def cmd_stragglers(args):
+    report = StragglerReport(args.factor, args.min_delta)
+    for rec in iter_records(args.input):
+        report.add(rec)
+    report.compute()
+
+    print('tasks: {0}  barrier wait: {1:.1f} host-seconds  lost to stragglers: {2:.1f}s'.format(
+        len(report.barriers), report.wait, report.lost))
+    print('')
+    print('tasks by time lost to stragglers:')
+    print('  {0:>8}  {1:>8}  {2:>8}  {3:>10}  {4:>6}  task (stragglers)'.format(
+        'lost', 'median', 'slowest', 'wait', 'hosts'))
+    for b in sorted(report.barriers, key=lambda b: b.lost, reverse=True)[:args.top]:
+        if b.lost <= 0:
+            break
+        names = ', '.join('{0} ({1:.1f}s)'.format(h, d) for h, d in b.stragglers[:args.show_hosts])
+        if len(b.stragglers) > args.show_hosts:
+            names += ', +{0} more'.format(len(b.stragglers) - args.show_hosts)
+        print('  {0:>8.1f}  {1:>8.1f}  {2:>8.1f}  {3:>10.1f}  {4:>6}  {5} ({6})'.format(
+            b.lost, b.median, b.slowest, b.wait, b.hosts, b.name, names))
+
+    print('')
+    print('chronically slow hosts (duration / task median):')
+    print('  {0:>6}  {1:>6}  {2:>6}  {3:>10}  {4:>8}  host'.format('mean', 'stddev', 'tasks', 'straggler', 'slowest'))
+    for host, mean, stddev, n, straggler, slowest in report.ranked_hosts(args.min_tasks)[:args.top]:
+        print('  {0:>6.2f}  {1:>6.2f}  {2:>6}  {3:>10}  {4:>8}  {5}'.format(mean, stddev, n, straggler, slowest, host))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('stragglers', help='linear strategy barrier and straggler analysis',
+                              description='Per task barrier wait and stragglers, run time lost to them, and hosts '
+                                          'ranked by how slow they run across the playbook.')
+    p.add_argument('input', help='debug_log_json NDJSON stream')
+    p.add_argument('--factor', type=float, default=1.5,
+                   help='a straggler is slower than factor x the task median (default 1.5)')
+    p.add_argument('--min-delta', type=float, default=1.0,
+                   help='... and slower than the median by at least this many seconds (default 1.0)')
+    p.add_argument('--top', type=int, default=20, help='rows per section (default 20)')
+    p.add_argument('--show-hosts', type=int, default=5, help='stragglers named per task (default 5)')
+    p.add_argument('--min-tasks', type=int, default=3, help='tasks a host needs to be ranked (default 3)')
+    p.set_defaults(func=cmd_stragglers)
@@ -0,0 +1,103 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible_diag.sketch import QuantileSketch
+
+
+class TaskSpan(object):
+    """
+    One task instance (one Task object, identified by its uuid) and how long it took on each host.
+
+    A host's span runs from when the controller started the task to when that host's result arrived.  Spans aren't
+    kept individually: they're folded into a QuantileSketch (count/sum/min/max and quantiles) as they close, so a
+    task costs the same few KB whether it ran on ten hosts or ten thousand.  remote is the SUM of the module's own
+    durations (delta), for the hosts that reported one.
+    """
+    __slots__ = ('uuid', 'name', 'start', 'end', 'durations', 'statuses', 'remote')
+
+    def __init__(self, uuid, name, start):
+        self.uuid = uuid
+        self.name = name
+        self.start = start
+        self.end = None
+        self.durations = QuantileSketch()
+        self.statuses = {}
+        self.remote = 0.0
+
+    def host_done(self, host, now, status, remote=None):
+        self.durations.add(now - self.start)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if remote is not None:
+            self.remote += remote
+        if self.end is None or now > self.end:
+            self.end = now
+
+    @property
+    def hosts(self):
+        return self.durations.count
+
+    @property
+    def wall(self):
+        return (self.end if self.end is not None else self.start) - self.start
+
+    def parallelism(self):
+        """
+        SUM(per host durations) / wall time: how many hosts were effectively running this task at once.
+        """
+        wall = self.wall
+        if wall <= 0:
+            return 0.0
+        return self.durations.sum / wall
+
+
+class Timeline(object):
+    """
+    Task spans in the order the tasks started, looked up by task uuid.  Keying by uuid (not name) keeps tasks that
+    share a name, e.g. the same role used twice, apart.  A uuid that starts again (a handler on its next flush) gets a
+    new span, timed from its own start; results go to the uuid's latest span.
+    """
+
+    def __init__(self):
+        self.spans = []
+        # key: task uuid, value: its latest span
+        self.tasks = {}
+        self.current = None
+
+    def task_start(self, uuid, name, now):
+        # a task with no host results (all hosts skipped silently, no hosts matched) ends when the next one starts
+        if self.current is not None and self.current.end is None:
+            self.current.end = now
+
+        span = self.tasks[uuid] = TaskSpan(uuid, name, now)
+        self.spans.append(span)
+        self.current = span
+        return span
+
+    def host_done(self, uuid, host, now, status, remote=None):
+        span = self.tasks.get(uuid, self.current)
+        if span is not None:
+            span.host_done(host, now, status, remote)
+
+    def finish(self, now):
+        if self.current is not None and self.current.end is None:
+            self.current.end = now
+
+    def __iter__(self):
+        return iter(self.spans)
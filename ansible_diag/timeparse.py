@@ -0,0 +1,108 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Fixed-format parsing for the start/end/delta strings modules put in their results.
+
+    start/end:  2016-03-27 00:58:07.323882   (host local time, str(datetime.now()))
+    delta:      0:00:00.501769               (str(timedelta), "1 day, 0:00:01.000000" past 24h)
+
+datetime.strptime is by far the most expensive thing a callback does per result.  These slice the string at fixed
+offsets instead, and memoize the epoch of each "YYYY-MM-DD HH" prefix (results come in bursts from the same hour), so
+the common case is one dict lookup, two int() and one float().  Anything not in the expected shape falls back to
+strptime, which also gives the same ValueError for garbage.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import time
+from datetime import datetime, timedelta
+
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# key: "YYYY-MM-DD HH", value: epoch seconds at the top of that (local) hour.  Keyed by the hour rather than the day
+# so DST changes land on the right side.
+_hour_cache = {}
+_HOUR_CACHE_MAX = 256
+
+
+def _parse_timestamp_slow(s):
+    fmt = _TIMESTAMP_FORMAT if '.' in s else _TIMESTAMP_FORMAT[:-3]
+    dt = datetime.strptime(s, fmt)
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1000000.0
+
+
+def parse_timestamp(s):
+    """
+    '2016-03-27 00:58:07.323882' -> float epoch seconds, reading the string as local time (as strptime + mktime would)
+    """
+    if len(s) < 19 or s[4] != '-' or s[7] != '-' or s[10] != ' ' or s[13] != ':' or s[16] != ':':
+        return _parse_timestamp_slow(s)
+
+    key = s[:13]
+    base = _hour_cache.get(key)
+    if base is None:
+        try:
+            fields = (int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]))
+            # range check: mktime would quietly roll month 13 or February 30 over
+            datetime(*fields)
+        except ValueError:
+            return _parse_timestamp_slow(s)
+        base = time.mktime(fields + (0, 0, 0, 0, -1))
+        if len(_hour_cache) >= _HOUR_CACHE_MAX:
+            _hour_cache.clear()
+        _hour_cache[key] = base
+
+    try:
+        minutes = int(s[14:16])
+        seconds = float(s[17:])
+    except ValueError:
+        return _parse_timestamp_slow(s)
+    # strptime's %S goes up to 61
+    if not (0 <= minutes < 60 and 0 <= seconds < 62):
+        return _parse_timestamp_slow(s)
+    return base + minutes * 60 + seconds
+
+
+def parse_delta(s):
+    """
+    '0:00:00.501769' -> 0.501769.  Also takes str(timedelta)'s "N day(s), H:MM:SS.ffffff" form.
+    """
+    days = 0
+    if 'day' in s:
+        d, s = s.split(',', 1)
+        days = int(d.split()[0])
+        s = s.strip()
+
+    h, m, sec = s.split(':')
+    return days * 86400 + int(h) * 3600 + int(m) * 60 + float(sec)
+
+
+def format_timestamp(t):
+    """
+    Float epoch seconds -> '2016-03-27 00:58:07.323882' in local time, the inverse of parse_timestamp.
+    """
+    return datetime.fromtimestamp(t).strftime(_TIMESTAMP_FORMAT)
+
+
+def format_delta(seconds):
+    """
+    Float seconds -> '0:00:00.501769', the inverse of parse_delta (str(timedelta), microseconds always shown).
+    """
+    s = str(timedelta(seconds=seconds))
+    return s if '.' in s else s + '.000000'
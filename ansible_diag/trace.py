@@ -0,0 +1,161 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Chrome trace-event (JSON) export, for chrome://tracing and https://ui.perfetto.dev.
+
+One track (tid) per host.  Every task record with times is a complete ("X") event; around them each host track
+gets the play and role instance spans it ran, so the viewer nests play > role > task.  Events are written as the
+records are read: the only state kept is the open play/role span per host, so memory is bounded by inventory size,
+not by how many spans the run has.
+
+    python -m ansible_diag trace run.ndjson -o run.trace.json
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+
+from ansible_diag.loaders import iter_records
+from ansible_diag.spans import SpanClock
+
+_encoder = json.JSONEncoder(separators=(',', ':'), default=str)
+
+PID = 1
+
+
+def _us(seconds):
+    return int(round(seconds * 1000000))
+
+
+class _OpenSpan(object):
+    __slots__ = ('name', 'start', 'end')
+
+    def __init__(self, name, start, end):
+        self.name = name
+        self.start = start
+        self.end = end
+
+
+class TraceWriter(object):
+    """
+    Streams trace events to a file object.  Call add(record) for each task record, then close().
+    """
+
+    def __init__(self, f, process_name='ansible-playbook'):
+        self._f = f
+        self._first = True
+        self._span_times = SpanClock()
+        self._tids = {}
+        # key: host, value: [open play span, open role span]
+        self._open = {}
+        self.events = 0
+
+        self._f.write('{"displayTimeUnit":"ms","traceEvents":[\n')
+        self._emit({'name': 'process_name', 'ph': 'M', 'pid': PID, 'args': {'name': process_name}})
+
+    def _emit(self, event):
+        if not self._first:
+            self._f.write(',\n')
+        self._first = False
+        self._f.write(_encoder.encode(event))
+        self.events += 1
+
+    def _tid(self, host):
+        tid = self._tids.get(host)
+        if tid is None:
+            tid = self._tids[host] = len(self._tids) + 1
+            self._emit({'name': 'thread_name', 'ph': 'M', 'pid': PID, 'tid': tid, 'args': {'name': host}})
+            self._emit({'name': 'thread_sort_index', 'ph': 'M', 'pid': PID, 'tid': tid, 'args': {'sort_index': tid}})
+        return tid
+
+    def _complete(self, tid, name, cat, start, end, args=None):
+        event = {'name': name, 'cat': cat, 'ph': 'X', 'pid': PID, 'tid': tid,
+                 'ts': _us(start), 'dur': max(0, _us(end) - _us(start))}
+        if args:
+            event['args'] = args
+        self._emit(event)
+
+    def _close_span(self, tid, spans, i, cat):
+        span = spans[i]
+        if span is not None:
+            self._complete(tid, span.name, cat, span.start, span.end)
+            spans[i] = None
+
+    def _extend(self, tid, spans, i, name, cat, start, end):
+        span = spans[i]
+        if span is not None and span.name == name:
+            span.start = min(span.start, start)
+            span.end = max(span.end, end)
+            return False
+        self._close_span(tid, spans, i, cat)
+        spans[i] = _OpenSpan(name, start, end)
+        return True
+
+    def add(self, rec):
+        times = self._span_times(rec)
+        if times is None:
+            return
+        start, end = times
+        host = rec['host']
+        tid = self._tid(host)
+
+        spans = self._open.get(host)
+        if spans is None:
+            spans = self._open[host] = [None, None]
+
+        # a new play closes the role too, even if the next role has the same name
+        if self._extend(tid, spans, 0, rec.get('play') or '(play)', 'play', start, end):
+            self._close_span(tid, spans, 1, 'role')
+        self._extend(tid, spans, 1, rec.get('rolename') or '(no role)', 'role', start, end)
+
+        self._complete(tid, rec.get('taskname') or '(unnamed task)', 'task', start, end,
+                       {'status': rec.get('runnercode'), 'role': rec.get('rolename'), 'duration': rec.get('duration')})
+
+    def close(self):
+        for host, spans in self._open.items():
+            tid = self._tids[host]
+            self._close_span(tid, spans, 1, 'role')
+            self._close_span(tid, spans, 0, 'play')
+        self._open = {}
+        self._f.write('\n]}\n')
+
+
+def export(records, f, process_name='ansible-playbook'):
+    writer = TraceWriter(f, process_name)
+    for rec in records:
+        writer.add(rec)
+    writer.close()
+    return writer.events
+
+
+def cmd_trace(args):
+    with open(args.output, 'w') as f:
+        events = export(iter_records(args.input), f, args.name or args.input)
+    print('wrote {0} trace events to {1}'.format(events, args.output))
+    return 0
+
+
+def register(subparsers):
+    p = subparsers.add_parser('trace', help='export a recorded run as Chrome trace-event JSON (Perfetto)',
+                              description='Write a debug_log_json NDJSON stream as trace-event JSON, one track per '
+                                          'host with play > role > task spans.')
+    p.add_argument('input', help='debug_log_json NDJSON stream')
+    p.add_argument('-o', '--output', required=True, help='trace JSON to write')
+    p.add_argument('--name', help='process name shown in the viewer (default: input file name)')
+    p.set_defaults(func=cmd_trace)
@@ -0,0 +1,111 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from collections import OrderedDict
+
+
+class RollupNode(object):
+    """
+    A tree node carrying rollups for everything below it:
+     - runtime: SUM(durations)
+     - counts: per runnercode (ok/failed/skipped/...), plus 'changed'
+     - start/end: timespan covered by all children
+
+    Rollups are updated as each result arrives (see RollupTree.add), never recomputed from the leaves.
+    """
+    __slots__ = ('name', 'children', 'runtime', 'counts', 'start', 'end')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = OrderedDict()
+        self.runtime = 0.0
+        self.counts = {}
+        self.start = None
+        self.end = None
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = RollupNode(name)
+        return node
+
+    def add(self, runnercode, changed, start, end, duration):
+        self.counts[runnercode] = self.counts.get(runnercode, 0) + 1
+        if changed:
+            self.counts['changed'] = self.counts.get('changed', 0) + 1
+        if duration is not None:
+            self.runtime += duration
+        if start is not None and (self.start is None or start < self.start):
+            self.start = start
+        if end is not None and (self.end is None or end > self.end):
+            self.end = end
+
+    def to_dict(self):
+        d = {'name': self.name,
+             'runtime': self.runtime,
+             'counts': dict(self.counts),
+             'timespan': {'start': self.start,
+                          'end': self.end,
+                          'seconds': self.end - self.start if self.start is not None and self.end is not None
+                          else None}}
+        if self.children:
+            d['children'] = OrderedDict((name, node.to_dict()) for name, node in self.children.items())
+        return d
+
+
+class RollupTree(object):
+    """
+    playbook \\ host \\ role-instance \\ task, with rollups at every level.
+
+    A role instance is a run of consecutive tasks from the same role on a host; when the role changes a new instance
+    node ("<role> [n]") is started.  Tasks outside of any role are grouped the same way under "(no role)".
+
+    add() touches one node per level, so the whole tree is always current and to_dict() can be called at any point
+    in the run.
+    """
+
+    def __init__(self, name='playbook'):
+        self.root = RollupNode(name)
+
+        # key: host, value: (rolename, role-instance node) of the host's most recent task
+        self._cur_role = {}
+
+        # key: (host, rolename), value: number of instances seen so far
+        self._role_instances = {}
+
+    def add(self, host, rolename, taskname, runnercode, changed=False, start=None, end=None, duration=None):
+        host_node = self.root.child(host)
+
+        cur = self._cur_role.get(host)
+        if cur is not None and cur[0] == rolename:
+            role_node = cur[1]
+        else:
+            key = (host, rolename)
+            n = self._role_instances[key] = self._role_instances.get(key, 0) + 1
+            role_node = host_node.child("{0} [{1}]".format(rolename or '(no role)', n))
+            self._cur_role[host] = (rolename, role_node)
+
+        task_node = role_node.child(taskname if taskname is not None else '(unnamed task)')
+
+        for node in (self.root, host_node, role_node, task_node):
+            node.add(runnercode, changed, start, end, duration)
+
+    def to_dict(self):
+        return self.root.to_dict()
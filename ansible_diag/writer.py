@@ -0,0 +1,223 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import threading
+import time
+from collections import deque
+
+from ansible_diag.compat import queue
+
+
+# sentinel telling the writer thread to drain what's left and exit
+_STOP = object()
+
+
+class BackgroundWriter(object):
+    """
+    Hands items to a daemon thread which formats them and writes them to a stream in batches.
+
+    put() never blocks.  The queue is bounded, so if the disk can't keep up the newest items are dropped (and
+    counted in self.dropped) rather than stalling the strategy loop or growing memory.  The stream is flushed every
+    flush_interval seconds so a killed run still leaves (almost) everything on disk.
+
+    stream only needs write(), flush() and close().  format_item turns a queued item into the string written.
+    Subclasses writing somewhere other than a stream override _open/_write_batch/_flush/_close, which all run on
+    the writer thread.
+    """
+
+    def __init__(self, stream=None, format_item=str, maxsize=10000, batch_size=500, flush_interval=1.0,
+                 name='diag-writer'):
+        self._stream = stream
+        self._format_item = format_item
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize)
+        self._closed = False
+
+        # counters, read once the writer is closed
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, item):
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """
+        Drain the queue, flush and close the stream.  Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        # a writer thread that died (the stream raised) leaves nothing to make room in a full queue: only wait for
+        # room while it's still there to drain
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+            except queue.Full:
+                continue
+            self._thread.join()
+            break
+
+    def _open(self):
+        pass
+
+    def _write_batch(self, batch):
+        chunks = []
+        for item in batch:
+            try:
+                chunks.append(self._format_item(item))
+            except Exception:
+                self.errors += 1
+
+        if chunks:
+            self._stream.write(''.join(chunks))
+            self.written += len(chunks)
+
+    def _flush(self):
+        self._stream.flush()
+
+    def _close(self):
+        self._stream.close()
+
+    def _run(self):
+        self._open()
+        last_flush = time.time()
+        stopping = False
+
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self._flush_interval)]
+            except queue.Empty:
+                batch = []
+
+            # grab whatever else is already waiting, up to batch_size, without blocking; whatever got in behind the
+            # stop (a put() racing close()) is written too
+            while batch and len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if any(item is _STOP for item in batch):
+                stopping = True
+                batch = [item for item in batch if item is not _STOP]
+
+            if batch:
+                self._write_batch(batch)
+
+            now = time.time()
+            if stopping or now - last_flush >= self._flush_interval:
+                self._flush()
+                last_flush = now
+
+        self._close()
+
+
+class RingBufferWriter(object):
+    """
+    Like BackgroundWriter, but backed by a ring buffer (collections.deque with maxlen) that a daemon thread drains
+    every flush_interval seconds.  The stream is flushed every sync_interval seconds (default: every drain) and on
+    close; a compressing stream wants that much less often than the drain, since each flush ends a compression block.
+    A stream with write_records(chunks, first, last) gets each item as its own record, however many lines it runs to.
+
+    put() is a single deque.append: no locks, no wakeups, nothing that can make the caller wait.  If the drain falls
+    behind, the oldest items are overwritten (counted in self.dropped).  Items are formatted on the drain thread, so
+    anything expensive about turning an item into text is kept off the caller's thread entirely.
+    """
+
+    def __init__(self, stream, format_item=str, maxlen=10000, flush_interval=0.2, sync_interval=None,
+                 name='diag-ring-writer'):
+        self._stream = stream
+        self._format_item = format_item
+        self._flush_interval = flush_interval
+        self._sync_interval = flush_interval if sync_interval is None else sync_interval
+        self._write_records = getattr(stream, 'write_records', None)
+        self._ring = deque(maxlen=maxlen)
+        self._maxlen = maxlen
+        self._stop = threading.Event()
+        self._closed = False
+
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, item):
+        if len(self._ring) == self._maxlen:
+            self.dropped += 1
+        self._ring.append(item)
+
+    def close(self):
+        """
+        Drain what's left, flush and close the stream.  Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        self._thread.join()
+
+    def _drain(self):
+        chunks = []
+        popleft = self._ring.popleft
+        while True:
+            try:
+                item = popleft()
+            except IndexError:
+                break
+            try:
+                chunks.append(self._format_item(item))
+            except Exception:
+                self.errors += 1
+
+        if chunks:
+            if self._write_records is not None:
+                now = time.time()
+                self._write_records(chunks, now, now)
+            else:
+                self._stream.write(''.join(chunks))
+            self.written += len(chunks)
+        return len(chunks)
+
+    def _run(self):
+        last_sync = time.time()
+        unsynced = 0
+        while not self._stop.wait(self._flush_interval):
+            unsynced += self._drain()
+            now = time.time()
+            if unsynced and now - last_sync >= self._sync_interval:
+                self._stream.flush()
+                last_sync = now
+                unsynced = 0
+        self._drain()
+        self._stream.close()
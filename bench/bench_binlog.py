@@ -0,0 +1,110 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Benchmark: reading task records back from NDJSON vs. the binlog format (records, rows, and column views).
+
+    python bench/bench_binlog.py [-n RECORDS] [--dir DIR]
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ansible_diag.binlog import BinlogReader, BinlogWriter
+from ansible_diag.ndjson import NdjsonWriter, dumps_line, iter_ndjson
+from ansible_diag.records import TaskRecord
+
+
+def synthetic(n, hosts=500, tasks=200):
+    rng = random.Random(0)
+    t = 1459054687.0
+    for i in range(n):
+        start = t + i * 0.01
+        duration = rng.expovariate(1.0)
+        yield TaskRecord('ok', 'role%d' % (i % 20), '/etc/ansible/roles/role%d' % (i % 20),
+                         'task number %d' % (i % tasks), 'host%04d.example.com' % (i % hosts),
+                         start, start + duration, duration,
+                         {'rc': 0, 'changed': False, 'stdout': 'x' * 80, 'start': '2016-03-27 00:58:07.323882'},
+                         'site', 'uuid-%d' % (i % tasks), start - 0.2, start + duration + 0.1, i * 0.01, 0.3)
+
+
+def timed(label, func, n):
+    t0 = time.time()
+    result = func()
+    elapsed = time.time() - t0
+    print('{0:<36} {1:>8.2f}s  {2:>8.0f} records/s'.format(label, elapsed, n / elapsed if elapsed else 0))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--records', type=int, default=200000)
+    parser.add_argument('--dir', default=None, help='where to write the test files (default: a temp dir)')
+    args = parser.parse_args()
+    n = args.records
+
+    directory = args.dir or tempfile.mkdtemp(prefix='bench-binlog-')
+    nd_path = os.path.join(directory, 'records.ndjson')
+    bin_path = os.path.join(directory, 'records.adbl')
+
+    for path, writer in ((nd_path, NdjsonWriter(nd_path, format_item=lambda r: dumps_line(r.as_dict()), maxsize=0)),
+                         (bin_path, BinlogWriter(bin_path, maxsize=0))):
+        for rec in synthetic(n):
+            writer.put(rec)
+        writer.close()
+        print('{0:<36} {1:>10} bytes  {2:>6.0f} per record'.format(
+            os.path.basename(path), os.path.getsize(path), os.path.getsize(path) / n))
+
+    def ndjson_sum():
+        return sum(rec['duration'] for rec in iter_ndjson(nd_path))
+
+    def binlog_records():
+        with BinlogReader(bin_path) as reader:
+            return sum(rec['duration'] for rec in reader)
+
+    def binlog_rows():
+        with BinlogReader(bin_path) as reader:
+            return sum(row[2] for row in reader.rows())
+
+    def binlog_columns():
+        reader = BinlogReader(bin_path)
+        total = 0.0
+        for view in reader.column_views('duration'):
+            total += sum(view.tolist())
+            view.release()
+        reader.close()
+        return total
+
+    expected = timed('ndjson: parse every line', ndjson_sum, n)
+    for label, func in (('binlog: records (dicts)', binlog_records),
+                        ('binlog: raw rows', binlog_rows),
+                        ('binlog: duration column views', binlog_columns)):
+        total = timed(label, func, n)
+        assert abs(total - expected) < 1e-6 * max(1.0, expected)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Benchmark suite for the callback plugins' own cost: replays synthetic runs (hosts x tasks x payload sizes) or a
+recorded one into each plugin's v2 hooks (ansible_diag.replay) and reports per event latency, throughput and peak
+memory.  Needs ansible installed (the plugins import CallbackBase); nothing is executed on any host.
+
+    python bench/bench_callbacks.py [--plugins debug_log_json,execution_diag,profile_timeline,all,base]
+                                    [--hosts 100,1000] [--tasks 20] [--payload 0,1024,16384] [--input RUN]
+
+'base' is a bare CallbackBase (the harness and dispatch overhead to subtract), 'all' the diag plugins enabled
+together, sharing the capture core the way they do under ansible.  Plugins read their usual environment variables
+(DEBUG_LOG_JSON_STREAM, EXECUTION_DIAG_LEVEL, ANSIBLE_DIAG_SAMPLE_RATE, ...), so set those to benchmark a mode.
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import os
+import sys
+
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, _REPO_ROOT)
+
+from ansible_diag.loaders import iter_records
+from ansible_diag.replay import from_records, load_callback, replay, synthetic, tracemalloc
+
+PLUGIN_DIR = os.path.join(_REPO_ROOT, 'plugins', 'v2_callback')
+DIAG_PLUGINS = ('debug_log_json', 'execution_diag', 'profile_timeline')
+
+
+def plugin_factories(name):
+    """
+    [CallbackModule classes] for a plugin name (a directory under plugins/v2_callback), a plugin file, 'all' or
+    'base'.
+    """
+    if name == 'base':
+        from ansible.plugins.callback import CallbackBase
+        return [CallbackBase]
+    if name == 'all':
+        return [f for n in DIAG_PLUGINS for f in plugin_factories(n)]
+    path = name if name.endswith('.py') else os.path.join(PLUGIN_DIR, name, name + '.py')
+    return [load_callback(path)]
+
+
+def _list(s, type_=str):
+    return [type_(v) for v in s.split(',') if v.strip()]
+
+
+def report(label, stats, peak, hooks):
+    p50, p99, worst = stats.quantiles()
+    print('{0:<42} {1:>8} {2:>8.3f}s {3:>10.0f} {4:>8.1f} {5:>8.1f} {6:>9.1f} {7:>9} {8:>7}'.format(
+        label, stats.events, stats.total, stats.throughput, p50 * 1e6, p99 * 1e6, worst * 1e6,
+        '{0:.1f}'.format(peak / 1048576.0) if peak is not None else '-', stats.output_lines))
+    if hooks:
+        for line in stats.hook_lines():
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--plugins', default='base,' + ','.join(DIAG_PLUGINS) + ',all',
+                        help='comma separated plugin names or files, plus base and all (default: %(default)s)')
+    parser.add_argument('--hosts', default='100,1000', help='host counts (default %(default)s)')
+    parser.add_argument('--tasks', default='20', help='task counts (default %(default)s)')
+    parser.add_argument('--payload', default='0,1024,16384', help='stdout bytes per result (default %(default)s)')
+    parser.add_argument('--distinct', type=int, default=1,
+                        help='distinct payloads per task, spread over the hosts (default %(default)s)')
+    parser.add_argument('--input', help='replay this recorded run instead (NDJSON, binlog or segments)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per line, the fastest is reported '
+                                                              '(default %(default)s)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc run (the peak column is the slow part)')
+    parser.add_argument('--hooks', action='store_true', help='per hook breakdown under each line')
+    args = parser.parse_args(argv)
+
+    plugins = [(name, plugin_factories(name)) for name in _list(args.plugins)]
+    if args.input:
+        workloads = [(os.path.basename(args.input), lambda: from_records(iter_records(args.input)))]
+    else:
+        workloads = [('{0}h x {1}t x {2}B'.format(h, t, p),
+                      lambda h=h, t=t, p=p: synthetic(h, t, p, args.distinct))
+                     for h in _list(args.hosts, int) for t in _list(args.tasks, int) for p in _list(args.payload, int)]
+
+    memory = not args.no_memory and tracemalloc is not None
+    print('{0:<42} {1:>8} {2:>9} {3:>10} {4:>8} {5:>8} {6:>9} {7:>9} {8:>7}'.format(
+        'plugin / workload', 'events', 'time', 'events/s', 'p50 us', 'p99 us', 'max us', 'peak MB', 'lines'))
+    for workload, make_events in workloads:
+        # built once per workload and outside the timed loop
+        events = list(make_events())
+        for name, factories in plugins:
+            stats = min((replay(factories, events, name) for _ in range(max(1, args.repeat))),
+                        key=lambda s: s.total)
+            peak = replay(factories, events, name, memory=True).peak if memory else None
+            report('{0} / {1}'.format(name, workload), stats, peak, args.hooks)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+"""
+Micro-benchmark: ansible_diag.timeparse vs. the strptime path debug_log_json used to take per result.
+
+    python bench/bench_timeparse.py [-n NUMBER]
+"""
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import os
+import sys
+import time
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ansible_diag.timeparse import parse_delta, parse_timestamp
+
+# a result's worth of strings
+START = '2016-03-27 00:58:07.323882'
+END = '2016-03-27 00:58:07.825651'
+DELTA = '0:00:00.501769'
+
+
+def strptime_path():
+    # what _handle_runner_callback did: two strptime calls, delta left as a string
+    s = datetime.strptime(START, "%Y-%m-%d %H:%M:%S.%f")
+    e = datetime.strptime(END, "%Y-%m-%d %H:%M:%S.%f")
+    return s, e
+
+
+def strptime_epoch_path():
+    # strptime, plus the work needed to get the same numbers fast_path produces
+    s = datetime.strptime(START, "%Y-%m-%d %H:%M:%S.%f")
+    e = datetime.strptime(END, "%Y-%m-%d %H:%M:%S.%f")
+    return (time.mktime(s.timetuple()) + s.microsecond / 1000000.0,
+            time.mktime(e.timetuple()) + e.microsecond / 1000000.0,
+            (e - s).total_seconds())
+
+
+def fast_path():
+    return parse_timestamp(START), parse_timestamp(END), parse_delta(DELTA)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=100000, help='results parsed per timing run')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timing runs (best is reported)')
+    args = parser.parse_args()
+
+    # sanity: both paths agree
+    assert abs(strptime_epoch_path()[0] - fast_path()[0]) < 1e-6
+
+    baseline = None
+    for name, func in (('strptime (start, end)', strptime_path),
+                       ('strptime + epoch/delta', strptime_epoch_path),
+                       ('timeparse (start, end, delta)', fast_path)):
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        per_result = best / args.number * 1e6
+        if baseline is None:
+            baseline = per_result
+        print("{0:<32} {1:>8.3f} us/result  {2:>6.1f}x".format(name, per_result, baseline / per_result))
+
+
+if __name__ == '__main__':
+    main()
@@ -35,17 +35,63 @@ description:
      ability to be used on 1.9.  In addition, even if the callback is not whitelisted
      or otherwise loaded, it merely existing in the callback directory will cause failure
      as the loader blindly loads all callbacks.
+   - set DEBUG_LOG_JSON_STREAM to a file path to stream each task record to it as one line
+     of JSON (NDJSON) as results arrive, instead of holding every record in memory until the end.
+     DEBUG_LOG_JSON_STREAM_FORMAT=binlog writes the compact binary format instead (fixed-width
+     rows, a string table and separate result payloads; see ansible_diag.binlog), which every
+     python -m ansible_diag report reads directly.  DEBUG_LOG_JSON_DEDUP=1 writes NDJSON with each
+     distinct large result field (stdout, msg, results, ...) once, as a PAYLOAD entry that records
+     refer to by sha1 (see ansible_diag.payloads).
+   - set DEBUG_LOG_JSON_SEGMENTS to a directory to stream the records into rotating, compressed
+     segments with a manifest instead (ANSIBLE_DIAG_SEGMENT_MB, ANSIBLE_DIAG_SEGMENT_SECONDS,
+     ANSIBLE_DIAG_COMPRESS=gzip|zlib|none).  python -m ansible_diag segments <dir> --play/--since
+     picks out the segments for a play or time range.
+   - set DEBUG_LOG_JSON_TREE to a file path to write the playbook \ host \ role-instance \ task
+     rollup tree as JSON at the end of the run.  Send the controller SIGUSR1 to write it mid-run.
+   - set ANSIBLE_DIAG_HISTORY to a sqlite database path to add this run's task records to the
+     multi-run history store (query it with: python -m ansible_diag history <db> ...).
+   - ANSIBLE_DIAG_SAMPLE_RATE (0-1, default 1) keeps full task records only for that fraction of
+     hosts (a stable hash of the host name, ANSIBLE_DIAG_SAMPLE_SALT to pick others) plus every
+     failed, unreachable or changed result.  The rest only feed the counters: the tree, history and
+     overhead reports stay exact, and a per task summary (counts, estimated duration quantiles) is
+     printed and written to NDJSON streams as a SAMPLE_SUMMARY entry.
 '''
 
+import atexit
+import os
+import signal
+import sys
 import pprint
 import json
-from collections import defaultdict
-from datetime import datetime, timedelta
 from ansible.plugins.callback import CallbackBase
 
+# ansible loads this file by path, so make the shared ansible_diag package (at the repo root) importable
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
 
+from ansible_diag.asyncjobs import AsyncTracker, task_async_settings
+from ansible_diag.binlog import BinlogWriter
+from ansible_diag.capture import CaptureMixin, core
+from ansible_diag.history import HistoryRecorder
+from ansible_diag.latency import LagMonitor
+from ansible_diag.ndjson import dumps_line, NdjsonWriter
+from ansible_diag.overhead import OverheadStats
+from ansible_diag.payloads import PayloadEncoder
+from ansible_diag.records import RecordStore, record_from_event, task_identity, task_label
+from ansible_diag.sampling import SampleSummary, SamplingPolicy
+from ansible_diag.segments import SegmentedWriter, options_from_env as segment_options
+from ansible_diag.timeparse import format_delta, format_timestamp, parse_timestamp
+from ansible_diag.tree import RollupTree
 
-class CallbackModule(CallbackBase):
+
+def _record_line(record):
+    # task records, plus the odd plain dict entry (SAMPLE_SUMMARY)
+    return dumps_line(record if isinstance(record, dict) else record.as_dict())
+
+
+
+class CallbackModule(CaptureMixin, CallbackBase):
     """
     This plugin generates diagnostics and analysis of playbook execution
 
@@ -72,6 +118,10 @@ class CallbackModule(CallbackBase):
 
     Formatted output for ansible-playbook runs (secondary) is also meant to be useful, but is switched off by default.
 
+    Streaming mode (DEBUG_LOG_JSON_STREAM=<path>) skips the in-memory tree entirely.  Each task record is handed to a
+    background writer thread as it arrives and written as one NDJSON line, so memory stays flat however big the
+    inventory is, and a killed run still leaves everything up to the last flush on disk.
+
     There are a few different data sets generated.  The trees use a dict named "children" for sub-nodes.  The trees
     also contain at node level (sibling to the "children" collection if existing) a few rollups containing the sums
     for all children of:
@@ -79,9 +129,17 @@ class CallbackModule(CallbackBase):
      - ok/skip/changed counts
      - timespan covered by all children
 
+    The tree (ansible_diag.tree.RollupTree) is maintained incrementally: each runner callback adds its result to the
+    playbook, host, role-instance and task nodes on its path, so the rollups are always current and the tree can be
+    written out mid-run (SIGUSR1) without a pass over every record.
+
     Reports Generated might include:
      - Flat CSV data (start, end, delta, runnercode, rolename, rolepath, taskname)
-     - Tree (json): playbook \ host \ role-instance \ task
+     - Tree (json): playbook \ host \ role-instance \ task  (DEBUG_LOG_JSON_TREE=<path>)
+     - Result payload dedup: how many large result fields were stored, how many distinct, and the ratio
+     - Controller overhead per task/host, and result delivery lag (warns live past DEBUG_LOG_JSON_LAG_WARN seconds)
+     - Async jobs per task: polls, poll cost, time wasted between a job finishing and the poll noticing, and a
+       suggested poll interval
      - Playbook summary, containing tasks, includes, roles, etc using indenting and rollups.  The idea is to provide
        a textual overview showing (via indentation) what occured.
     """
@@ -95,6 +153,65 @@ class CallbackModule(CallbackBase):
     def __init__(self):
         super(CallbackModule, self).__init__()
 
+        # every task record, all hosts, identical result payloads stored once.  Unused when streaming.
+        self._records = RecordStore()
+
+        self._stream = None
+        self._payloads = None
+        stream_path = os.getenv('DEBUG_LOG_JSON_STREAM')
+        segment_dir = os.getenv('DEBUG_LOG_JSON_SEGMENTS')
+        if segment_dir:
+            # rotating compressed segments plus a manifest, compressed on the writer thread (ansible_diag.segments)
+            self._stream = SegmentedWriter(segment_dir, format_item=_record_line, prefix='debug_log_json',
+                                           **segment_options())
+            atexit.register(self._stream.close)
+        elif stream_path:
+            if os.getenv('DEBUG_LOG_JSON_STREAM_FORMAT', 'ndjson') == 'binlog':
+                # fixed-width rows + string table + payload blobs (ansible_diag.binlog)
+                self._stream = BinlogWriter(stream_path)
+            elif os.getenv('DEBUG_LOG_JSON_DEDUP'):
+                # payload table + references; the encoder runs on the writer thread
+                encoder = PayloadEncoder()
+                self._payloads = encoder.table
+                self._stream = NdjsonWriter(stream_path, format_item=encoder)
+            else:
+                self._stream = NdjsonWriter(stream_path, format_item=_record_line)
+            # a run that dies before playbook_on_stats should still drain what's queued
+            atexit.register(self._stream.close)
+
+        # which results keep a full task record (ANSIBLE_DIAG_SAMPLE_RATE), and what's left of the others
+        self._sampling = SamplingPolicy.from_env()
+        self._sampled = SampleSummary()
+
+        self._playbook = None
+        self._play = None
+
+        # controller overhead per task/host; task start times come with each event (ansible_diag.capture)
+        self._overhead = OverheadStats()
+
+        # module end -> callback lag, with a live warning when results back up (DEBUG_LOG_JSON_LAG_WARN seconds)
+        self._lag = LagMonitor(threshold=float(os.getenv('DEBUG_LOG_JSON_LAG_WARN', '5')),
+                               warn=self._display.warning)
+
+        # async jobs by ansible_job_id, on the controller's wall clock
+        self._async = AsyncTracker()
+
+        self._history = None
+        history_path = os.getenv('ANSIBLE_DIAG_HISTORY')
+        if history_path:
+            self._history = HistoryRecorder(history_path)
+            atexit.register(self._history.close)
+
+        self._tree = None
+        self._tree_path = os.getenv('DEBUG_LOG_JSON_TREE')
+        self._tree_dump_requested = False
+        if self._tree_path:
+            self._tree = RollupTree()
+            # the handler only sets a flag; the dump happens between results so the rollups are consistent
+            signal.signal(signal.SIGUSR1, self._request_tree_dump)
+
+        core.add_sink(self.CALLBACK_NAME, self)
+
     #
     # Helper funcs for logging
     #
@@ -116,88 +233,209 @@ class CallbackModule(CallbackBase):
     def _to_json_s(self, thing):
         return json.dumps(thing, sort_keys=True, indent=2, separators=(',', ': '))
 
-    def _get_datetime(self, timestring):
-        # 2016-03-27 00:58:07.323882 (so very close to ISO 8601, but not.)
-        return datetime.strptime(timestring, "%Y-%m-%d %H:%M:%S.%f")
+    def _request_tree_dump(self, signum, frame):
+        self._tree_dump_requested = True
 
-    # BEGIN CLASS STATE
+    def _dump_tree(self):
+        self._tree_dump_requested = False
+        tmp_path = self._tree_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._tree.to_dict(), f, indent=2, separators=(',', ': '), default=str)
+        os.rename(tmp_path, self._tree_path)
 
-    # Used to hold current task
-    _cur_task = None
 
-    # hosts.  dict. key: hostname, value: tasklist (a list of tuples) 
-    _hosts = defaultdict(list)
-
-    # tasklist    = list of dicts ( tasktype, tasksubtype, name, result )
+    # task records (ansible_diag.records.TaskRecord):
 
     # [0] entrytype    = Task (T).  Future: Play (P), Metadata (M), Whoknowswhatnext (?)
     # [1] runnercode  = failed, ok, skipped, unreachable, no_hosts, async_poll, async_ok, async_failed
     # [2] rolename    = role name
     # [3] rolepath    = role path (actual file)
     # [4] taskname    = name of the task
-    # [5] result      = if ok, fail, unreachable: start/end/delta/stderr/stdout/etc.
+    # [5] host        = inventory hostname
+    # [6] start, end  = parsed from result as float epoch seconds (None if the module didn't report them)
+    # [7] duration    = parsed from result's delta as float seconds (end - start if there's no delta)
+    # [8] result      = if ok, fail, unreachable: start/end/delta/stderr/stdout/etc.
     #                   if skiped: item
+    # [9] play        = name of the play
+    # [10] taskid     = the task's uuid (tells apart task instances that share a name)
+    # [11] ctl_start, ctl_end, ctl_mono = controller clock: task start, result arrival (epoch), arrival (monotonic)
+    # [12] overhead   = controller elapsed (monotonic) - duration: everything that isn't the module running
     # TODO: map out the rest for doc string
-    def _handle_runner_callback(self, runnercode, host, result):
-        start = self._get_datetime(result['start'])
-        end =   self._get_datetime(result['end'])
-
-        # 0:00:00.501769
-        #delta =
+    def _handle_runner_callback(self, event):
+        # named after the event's own task (a handler's results are the handler's), with that task's start
+        new_task = record_from_event(event, self._play)
+        host = new_task.host
+        rolename = new_task.rolename
+        taskname = new_task.taskname
+        runnercode = new_task.runnercode
+        result = new_task.result
+        start, end, duration = new_task.start, new_task.end, new_task.duration
+        if end is not None:
+            self._lag.observe(host, end, event.wall)
+
+        changed = result.get('changed', False)
+
+        if not self._sampling.keep(host, runnercode, changed):
+            self._sampled.add(rolename, taskname, runnercode, duration)
+        else:
+            self._sampled.kept += 1
+            if self._stream:
+                self._stream.put(new_task)
+            else:
+                self._records.append(new_task)
+
+        if new_task.ctl_start is not None:
+            self._overhead.add(rolename, taskname, host, duration, new_task.overhead)
+
+        if self._history:
+            self._history.record(self._playbook, rolename, taskname, host, runnercode, start, end, duration, changed)
+
+        if self._tree:
+            self._tree.add(host, rolename, taskname, runnercode, changed,
+                           start, end, duration)
+            if self._tree_dump_requested:
+                self._dump_tree()
+
+        # async launches (poll: 0), async_status checks and the final result of a polled job all carry the job id
+        jobid = result.get('ansible_job_id')
+        if jobid:
+            if result.get('finished'):
+                self._handle_runner_async_callback(event, jobid)
+            elif result.get('started') and jobid not in self._async.active:
+                timeout, poll = task_async_settings(event.task)
+                self._async.launch(jobid, host, task_label(rolename, taskname), event.wall, timeout, poll)
+            else:
+                self._async_poll(event, jobid)
+
+    def _async_poll(self, event, jobid):
+        rolename, _, taskname, _ = task_identity(event.task)
+        timeout, poll = task_async_settings(event.task)
+        return self._async.poll(jobid, event.host, task_label(rolename, taskname), event.wall, event.started,
+                                timeout, poll)
+
+    def _handle_runner_async_callback(self, event, jobid):
+        # the final result of an async job.  Newer ansible sends both v2_runner_on_async_ok and v2_runner_on_ok for
+        # it, so this only tracks the job; the task record comes from _handle_runner_callback.
+        host = event.host
+        result = event.result
+        finished = None
+        if 'end' in result:
+            # module end is on the host's clock; the lag monitor's offset for the host moves it onto ours
+            finished = parse_timestamp(result['end']) - self._lag.offsets.get(host, 0.0)
+        rolename, _, taskname, _ = task_identity(event.task)
+        timeout, poll = task_async_settings(event.task)
+        status = 'failed' if event.status == 'failed' or result.get('failed') else 'ok'
+        self._async.complete(jobid, host, task_label(rolename, taskname), event.wall, status, finished,
+                             event.started, timeout, poll)
 
-        new_task = {'entrytype': 'TASK_RECORD',
-                    'runnercode': runnercode,
-                    'rolename':   self._cur_task._role._role_name,
-                    'rolepath':   self._cur_task._role._role_path,
-                    'taskname':   self._cur_task.name,
-                    'result':     result,
-                    'start':      start,
-                    'end':        end}
-
-        self._hosts[host].append(new_task)
-        self._cur_task = None
-
-    def _handle_runner_async_callback(self, runnercode, host, result, jobid):
-        # TODO: handle async tasks
-        return
+    #
+    # capture core sink (ansible_diag.capture).  The v2 hooks come from CaptureMixin, normalized once for all the
+    # diag plugins, with the controller clock already read; the v1 methods below only get what isn't routed.
+    #
+    def on_playbook_start(self, event):
+        # the v1 hook doesn't get the playbook, so pick up its name here
+        self._playbook = event.task_name
+        if self._tree:
+            self._tree.root.name = self._playbook
+        if self._history:
+            self._history.start_run(self._playbook)
+
+    def on_play_start(self, event):
+        self._dlog("playbook_on_play_start( %s )" % str(event.task_name))
+        self._play = event.task_name
+
+    # task and handler start times are kept per task by the capture core (event.started), so results of
+    # interleaved tasks (free strategy, handlers) each get their own
+    def on_task_start(self, event):
+        self._dlog("playbook_on_task_start( %s )" % str(event.task))
+
+    def on_handler_start(self, event):
+        self._dlog("playbook_on_handler_task_start( %s )" % str(event.task))
 
-    def playbook_on_stats(self, stats):
-        self._dlog("playbook_on_stats( %s )" % str(stats))
+    # TODO: do we need to do anything with ignore_errors?
+    def on_result(self, event):
+        self._dlog("runner_on_%s(self, host, res)" % event.status)
+        if event.status == 'skipped':
+            rolename, _, taskname, _ = task_identity(event.task)
+            if self._history:
+                self._history.record(self._playbook, rolename, taskname, event.host, 'skipped', None, None, None,
+                                     False)
+            if self._tree:
+                self._tree.add(event.host, rolename, taskname, 'skipped')
+            return
+        self._handle_runner_callback(event)
+
+    def on_async_poll(self, event):
+        self._dlog("runner_on_async_poll(self, host, res, jid, clock)")
+        self._async_poll(event, event.result.get('ansible_job_id'))
+
+    def on_async_result(self, event):
+        self._dlog("runner_on_async_%s(self, host, res, jid)" % event.status)
+        self._handle_runner_async_callback(event, event.result.get('ansible_job_id'))
+
+    def on_stats(self, event):
+        self._dlog("playbook_on_stats( %s )" % str(event.obj))
+
+        if self._overhead.tasks:
+            for line in self._overhead.report_lines():
+                self._log(line)
+        if self._lag.count:
+            for line in self._lag.report_lines():
+                self._log(line)
+        if self._async.tasks or self._async.active:
+            for line in self._async.report_lines():
+                self._log(line)
+        if self._sampling.enabled:
+            for line in self._sampled.report_lines(self._sampling):
+                self._log(line)
+            if self._stream and not isinstance(self._stream, BinlogWriter):
+                self._stream.put(self._sampled.to_dict(self._sampling))
+
+        if self._tree:
+            self._dump_tree()
+            self._log("debug_log_json: wrote rollup tree to {0}".format(self._tree_path))
+
+        if self._history:
+            self._history.close()
+            self._log("debug_log_json: recorded {0} task records in {1} (dropped: {2})".format(
+                self._history.written, self._history.path, self._history.dropped))
+
+        if self._stream:
+            self._stream.close()
+            self._log("debug_log_json: streamed {0} task records to {1} (dropped: {2}, errors: {3})".format(
+                self._stream.written, self._stream.path, self._stream.dropped, self._stream.errors))
+            if self._payloads is not None and self._payloads.refs:
+                for line in self._payloads.report_lines():
+                    self._log(line)
+            return
+
+        if self._records.payloads.refs:
+            for line in self._records.payloads.report_lines():
+                self._log(line)
 
         self._dlog("===================")
         self._dlog("FLAT DUMP (by host)")
         self._dlog("===================")
 
-        for host,tasks in self._hosts.items():
+        for host,tasks in self._records.by_host():
             self._dlog("Host: " + host)
 
-            # tasks is a list of task records (each one a dict).  The makes for easy json serialization, provided
-            # keys are always strings (only)
+            # tasks is an iterator of TaskRecords.  record.as_dict() makes for easy json serialization.
             for t in tasks:
-                #self._dlog(self._to_json_s(task))
+                #self._dlog(self._to_json_s(t.as_dict()))
 
-                # TODO: delta is still just the string from results object (vs. deserialized timespan)
-                r = t['result']
+                # records keep epoch floats; the dump shows them the way the result had them
+                delta = t.result.get('delta') if isinstance(t.result, dict) else None
+                if delta is None and t.duration is not None:
+                    delta = format_delta(t.duration)
                 msg = "{0}, {1}, {2}, {3}, {4}, {5}".format(
-                    t['start'], t['end'], r['delta'], t['runnercode'], t['rolename'], t['taskname'])
+                    format_timestamp(t.start) if t.start is not None else None,
+                    format_timestamp(t.end) if t.end is not None else None,
+                    delta, t.runnercode, t.rolename, t.taskname)
                 self._log(msg)
 
-        # note: all trees start with [playbook \ host].
-
-        # generate a list of tasks grouped by role invocation (instance of a role being called).
-#        root = { 'name': 'Hosts', 'children': defaultdict(list)}
-#        root_hosts_dict = root['children']
-#
-#        for host,tasks in self._hosts.items():
-#            cur_host =      root_hosts_dict[host] = { 'name': host, 'role-invocations': defaultdict(list)}
-#            cur_role_name = None
-
-            #for t in tasks:
-
-
-
-
-
+        # note: all trees start with [playbook \ host].  The role-invocation tree is built as results arrive (see
+        # _handle_runner_callback), so there's nothing left to do for it here.
 
     def set_play_context(self, play_context):
         self._dlog("set_play_context(self, play_context)")
@@ -208,36 +446,9 @@ class CallbackModule(CallbackBase):
 #        for arg in args:
 #            self._dlog("\t(arg):" + str(arg) + " TYPE: " + str(type(arg)))
 
-    # TODO: do we need to do anything with ignore_errors?
-    def runner_on_failed(self, host, res, ignore_errors=False):
-        self._dlog("runner_on_failed(self, host, res, ignore_errors=False)")
-        self._handle_runner_callback("failed", host, res)
-
-    def runner_on_ok(self, host, res):
-        self._dlog("runner_on_ok()")
-        self._handle_runner_callback("ok", host, res)
-
-    def runner_on_skipped(self, host, item=None):
-        self._dlog("runner_on_skipped(self, host, item=None)")
-
-    def runner_on_unreachable(self, host, res):
-        self._dlog("runner_on_unreachable(self, host, res)")
-        self._handle_runner_callback("unreachable", host, res)
-
     def runner_on_no_hosts(self):
         self._dlog("runner_on_no_hosts(self)")
 
-    def runner_on_async_poll(self, host, res, jid, clock):
-        self._dlog("runner_on_async_poll(self, host, res, jid, clock)")
-
-    def runner_on_async_ok(self, host, res, jid):
-        self._dlog("runner_on_async_ok(self, host, res, jid)")
-        self._handle_runner_async_callback("ok", host, res, jid)
-
-    def runner_on_async_failed(self, host, res, jid):
-        self._dlog("runner_on_async_failed(self, host, res, jid)")
-        self._handle_runner_async_callback("failed", host, res, jid)
-
     def playbook_on_start(self):
         self._dlog("playbook_on_start(self)")
 
@@ -250,11 +461,6 @@ class CallbackModule(CallbackBase):
     def playbook_on_no_hosts_remaining(self):
         self._dlog("playbook_on_no_hosts_remaining(self)")
 
-    # note: function sig in base class is a misnomer (name)
-    def playbook_on_task_start(self, task, is_conditional):
-        self._dlog("playbook_on_task_start( %s )" % str(task))
-        self._cur_task = task
-
     def playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None):
         self._dlog("playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None)")
 
@@ -267,9 +473,6 @@ class CallbackModule(CallbackBase):
     def playbook_on_not_import_for_host(self, host, missing_file):
         self._dlog("playbook_on_not_import_for_host(self, host, missing_file)")
 
-    def playbook_on_play_start(self, name):
-        self._dlog("playbook_on_play_start( %s )" % str(name))
-
     def on_file_diff(self, host, diff):
         self._dlog("on_file_diff(self, host, diff)")
 
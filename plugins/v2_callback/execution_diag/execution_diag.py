@@ -26,11 +26,113 @@ short_description: task profiling and timing callback plugin
 
 description:
    - generates a data file useful for diagnostics and analysis of playbook execution
+   - EXECUTION_DIAG_LEVEL picks how much is logged.  0 - nothing (the plugin can stay enabled),
+     1 - one line per hook (default), 2 - plus hosts/task names from the v1 dispatch,
+     3 - plus full arguments and results.
+   - at level 3 results are written as JSON after projecting them to EXECUTION_DIAG_FIELDS (comma
+     separated, e.g. rc,start,end,delta,changed; default all) and capping stdout/stderr/stdout_lines/...
+     to EXECUTION_DIAG_MAX_BYTES each (default 4096, 0 for no limit).  Formatting happens on the output
+     thread, only for lines that are actually written.
+   - output is buffered in a ring (EXECUTION_DIAG_BUFFER lines, default 10000) and written in batches
+     by a background thread.  If output can't keep up, the oldest lines are dropped; the number dropped
+     is printed at the end of the run.
+   - EXECUTION_DIAG_SEGMENTS=<dir> writes the output to rotating, compressed segments with a manifest
+     instead of the display (ANSIBLE_DIAG_SEGMENT_MB, default 64, ANSIBLE_DIAG_SEGMENT_SECONDS, default
+     600, ANSIBLE_DIAG_COMPRESS=gzip|zlib|none).  Each log entry counts as one record in the manifest,
+     and the compressed stream is flushed every 10 seconds, so a killed run loses at most that much.
+   - ANSIBLE_DIAG_SAMPLE_RATE (0-1, default 1) keeps level 3 results only for that fraction of hosts
+     (picked by a stable hash of the host name, the same hosts debug_log_json keeps), plus every
+     failed or changed result.  The rest are counted per task, with estimated duration quantiles,
+     in a summary at the end.
 '''
 
+import atexit
+import os
+import pprint
+import sys
+
+from ansible import constants as C
 from ansible.plugins.callback import CallbackBase
 
-class CallbackModule(CallbackBase):
+# ansible loads this file by path, so make the shared ansible_diag package (at the repo root) importable
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from ansible_diag.asyncjobs import AsyncTracker, task_async_settings
+from ansible_diag.capture import CaptureMixin, core
+from ansible_diag.loops import item_label
+from ansible_diag.sampling import SampleSummary, SamplingPolicy
+from ansible_diag.segments import SegmentedFile, options_from_env as segment_options
+from ansible_diag.serialize import ResultFormatter
+from ansible_diag.timeparse import parse_delta
+from ansible_diag.writer import RingBufferWriter
+
+# argument list logged for each capture event kind (on_event), as the v2 hook signatures have it
+_HOOK_ARGS = {
+    'playbook_start': 'playbook',
+    'play_start': 'play',
+    'task_start': 'task, is_conditional',
+    'handler_start': 'task',
+    'cleanup_start': 'task',
+    'result': 'result',
+    'item': 'result',
+    'async_poll': 'result',
+    'async_result': 'result',
+    'notify': 'result, handler',
+    'include': 'included_file',
+    'stats': 'stats',
+}
+
+# EXECUTION_DIAG_LEVEL values
+OFF = 0
+HOOKS = 1
+ARGS = 2
+FULL = 3
+
+# seconds between sync flushes of the segment stream; each one ends a compression block, so not every drain
+SEGMENT_SYNC = 10.0
+
+
+class _Deferred(object):
+    """
+    Stands in for an expensive string (pformat of the stats object, ...) until the drain thread formats the line.
+    """
+    __slots__ = ('_func', '_args')
+
+    def __init__(self, func, *args):
+        self._func = func
+        self._args = args
+
+    def __str__(self):
+        return self._func(*self._args)
+
+
+class _DisplayStream(object):
+    """
+    Minimal stream on top of Display, for the ring buffer writer.
+    """
+
+    def __init__(self, display):
+        self._display = display
+
+    def write(self, s):
+        self._display.display(s.rstrip('\n'))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _format_line(item):
+    fmt, args = item
+    return (fmt % args if args else fmt) + '\n'
+
+
+
+class CallbackModule(CaptureMixin, CallbackBase):
     """
     This plugin generates a data file useful for diagnostics and analysis of playbook execution
     """
@@ -42,10 +144,53 @@ class CallbackModule(CallbackBase):
     def __init__(self):
         super(CallbackModule, self).__init__()
 
-    def _log(self, msg):
-        # TODO: make this better, handle varargs
-        # note: display(self, msg, color=None, stderr=False, screen_only=False, log_only=False)
-        self._display.display(msg)
+        self._level = int(os.getenv('EXECUTION_DIAG_LEVEL', HOOKS))
+        self._out = None
+
+        # async job launch times, for the poll clock
+        self._async = AsyncTracker()
+
+        if self._level <= OFF:
+            # ansible skips disabled callbacks before dispatching; _log() still bails out first thing if it doesn't
+            self.disabled = True
+            return
+
+        fields = [f.strip() for f in os.getenv('EXECUTION_DIAG_FIELDS', '').split(',') if f.strip()]
+        self._formatter = ResultFormatter(fields, int(os.getenv('EXECUTION_DIAG_MAX_BYTES', 4096)))
+        # which full results are written (ANSIBLE_DIAG_SAMPLE_RATE), and what's left of the others
+        self._sampling = SamplingPolicy.from_env()
+        self._sampled = SampleSummary()
+
+        segment_dir = os.getenv('EXECUTION_DIAG_SEGMENTS')
+        if segment_dir:
+            # rotating compressed segments plus a manifest; compression runs on the ring's drain thread
+            # each log entry is one record in the manifest however many lines it spans, and the compressed stream
+            # is only sync-flushed every SEGMENT_SYNC seconds and at close
+            stream = SegmentedFile(segment_dir, 'execution_diag', **segment_options())
+            sync_interval = SEGMENT_SYNC
+            self._out_name = segment_dir
+        else:
+            stream = _DisplayStream(self._display)
+            sync_interval = None
+            self._out_name = 'the display'
+        self._out = RingBufferWriter(stream, _format_line,
+                                     maxlen=int(os.getenv('EXECUTION_DIAG_BUFFER', 10000)),
+                                     sync_interval=sync_interval, name='execution-diag-output')
+        atexit.register(self._out.close)
+
+        core.add_sink(self.CALLBACK_NAME, self)
+
+    def _log(self, level, fmt, *args):
+        """
+        Queue a line if level is enabled.  Formatting (fmt % args, and str() of whatever is in args) happens later
+        on the output thread, so callers pass objects, not strings built up front.
+        """
+        if level > self._level:
+            return
+        self._out.put((fmt, args))
+
+    def _to_vars_s(self, thing):
+        return pprint.pformat(vars(thing), indent=2)
 
 ####################################################################
 #
@@ -68,212 +213,171 @@ class CallbackModule(CallbackBase):
 
 
     def set_play_context(self, play_context):
-        self._log("set_play_context(self, play_context)")
-        self._log("\t" + str(play_context))
+        self._log(ARGS, "set_play_context(self, play_context)")
+        self._log(FULL, "\t%s", play_context)
 
     def on_any(self, *args, **kwargs):
-        self._log("on_any(self, *args, **kwargs)")
-        self._log("\ttype arg[0]: " + str(type(args[0])))
+        if self._level < FULL:
+            return
+        self._log(FULL, "on_any(self, *args, **kwargs)")
+        if args:
+            self._log(FULL, "\ttype arg[0]: %s", type(args[0]))
         for arg in args:
-            self._log("\t(arg):" + str(arg) + " TYPE: " + str(type(arg)))
-
-    def runner_on_failed(self, host, res, ignore_errors=False):
-        self._log("runner_on_failed(self, host, res, ignore_errors=False)")
-
-    def runner_on_ok(self, host, res):
-        self._log("runner_on_ok( " + str(host) + ", " + str(res) + "\n" + self._to_json_s(res) + "\n)")
-
-    def runner_on_skipped(self, host, item=None):
-        self._log("runner_on_skipped(self, host, item=None)")
-
-    def runner_on_unreachable(self, host, res):
-        self._log("runner_on_unreachable(self, host, res)")
+            self._log(FULL, "\t(arg):%s TYPE: %s", arg, type(arg))
 
     def runner_on_no_hosts(self):
-        self._log("runner_on_no_hosts(self)")
-
-    def runner_on_async_poll(self, host, res, jid, clock):
-        self._log("runner_on_async_poll(self, host, res, jid, clock)")
-
-    def runner_on_async_ok(self, host, res, jid):
-        self._log("runner_on_async_ok(self, host, res, jid)")
-
-    def runner_on_async_failed(self, host, res, jid):
-        self._log("runner_on_async_failed(self, host, res, jid)")
-
-    def playbook_on_start(self):
-        self._log("playbook_on_start(self)")
-
-    def playbook_on_notify(self, host, handler):
-        self._log("playbook_on_notify(self, host, handler)")
+        self._log(ARGS, "runner_on_no_hosts(self)")
 
     def playbook_on_no_hosts_matched(self):
-        self._log("playbook_on_no_hosts_matched(self)")
+        self._log(ARGS, "playbook_on_no_hosts_matched(self)")
 
     def playbook_on_no_hosts_remaining(self):
-        self._log("playbook_on_no_hosts_remaining(self)")
-
-    def playbook_on_task_start(self, name, is_conditional):
-        self._log("playbook_on_task_start( %s )" % str(name))
+        self._log(ARGS, "playbook_on_no_hosts_remaining(self)")
 
     def playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None):
-        self._log("playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None)")
+        self._log(ARGS, "playbook_on_vars_prompt( %s )", varname)
 
     def playbook_on_setup(self):
-        self._log("playbook_on_setup(self)")
+        self._log(ARGS, "playbook_on_setup(self)")
 
     def playbook_on_import_for_host(self, host, imported_file):
-        self._log("playbook_on_import_for_host(self, host, imported_file)")
+        self._log(ARGS, "playbook_on_import_for_host( %s, %s )", host, imported_file)
 
     def playbook_on_not_import_for_host(self, host, missing_file):
-        self._log("playbook_on_not_import_for_host(self, host, missing_file)")
+        self._log(ARGS, "playbook_on_not_import_for_host( %s, %s )", host, missing_file)
 
-    def playbook_on_play_start(self, name):
-        self._log("playbook_on_play_start( %s )" % str(name))
+    def on_file_diff(self, host, diff):
+        self._log(ARGS, "on_file_diff( %s )", host)
 
-    def playbook_on_stats(self, stats):
-        self._log("playbook_on_stats( %s )" % str(stats))
-        self._log(self._to_vars_s(stats))
+    ####### CAPTURE CORE SINK (ansible_diag.capture) ######
+    #
+    # The task/result/item/async/notify/play/stats hooks come from CaptureMixin.  The event arrives already
+    # normalized (host and task names looked up, clock read) and shared with the other diag plugins; on_event logs
+    # the hook line, the on_<kind> methods below add what the v1 dispatch used to log at ARGS and FULL.
+    #
+    def on_event(self, event):
+        self._log(HOOKS, "%s(self, %s)", event.hook, _HOOK_ARGS[event.kind])
 
-    def on_file_diff(self, host, diff):
-        self._log("on_file_diff(self, host, diff)")
+    def on_playbook_start(self, event):
+        self._log(ARGS, "playbook_on_start( %s )", event.task_name)
 
-    ####### V2 METHODS, by default they call v1 counterparts if possible ######
+    def on_play_start(self, event):
+        #
+        # TODO: play.roles contains the list of roles for this play, freshly loaded.  Cache here so we can use later
+        #       Play obj: ansible/playbook/play.py
+        #
+        self._log(FULL, "\tROLES: %s", getattr(event.obj, 'roles', None))
+        self._log(ARGS, "playbook_on_play_start( %s )", event.task_name)
+
+    def on_task_start(self, event):
+        self._log(ARGS, "playbook_on_task_start( %s )", event.task_name)
+
+    def on_handler_start(self, event):
+        self._log(ARGS, "handler_task_start( %s )", event.task_name)
+
+    def on_result(self, event):
+        status = event.status
+        if status == 'skipped' and not C.DISPLAY_SKIPPED_HOSTS:
+            return
+        if status == 'failed':
+            self._log(ARGS, "runner_on_failed( %s, ignore_errors=%s )", event.host, event.ignore_errors)
+        else:
+            self._log(ARGS, "runner_on_%s( %s )", status, event.host)
+        if status in ('ok', 'failed') and self._level >= FULL:
+            if self._sampling.keep(event.host, status, event.result.get('changed', False)):
+                self._sampled.kept += 1
+                self._log(FULL, "runner_on_%s( %s,\n%s\n)", status, event.host, self._formatter.lazy(event.result))
+            else:
+                delta = event.result.get('delta')
+                self._sampled.add(None, event.task_name, status, parse_delta(delta) if delta else None)
+
+    def on_item(self, event):
+        self._log(ARGS, "item %s( %s, item=%s, delta=%s )", event.status, event.host,
+                  _Deferred(item_label, event.result), event.result.get('delta'))
+
+    def on_async_poll(self, event):
+        if self._level < ARGS:
+            return
+        jid = event.result.get('ansible_job_id')
+        # v1 passed the seconds left before the async timeout, counted from the job's launch
+        timeout, poll = task_async_settings(event.task)
+        job = self._async.poll(jid, event.host, event.task_name, event.mono, event.started_mono, timeout, poll)
+        self._log(ARGS, "runner_on_async_poll( %s, jid=%s, clock=%s )", event.host, jid, job.remaining(event.mono))
+
+    def on_async_result(self, event):
+        jid = event.result.get('ansible_job_id')
+        self._async.complete(jid, event.host, event.task_name, event.mono, event.status)
+        self._log(ARGS, "runner_on_async_%s( %s, jid=%s )", event.status, event.host, jid)
+
+    def on_notify(self, event):
+        self._log(ARGS, "playbook_on_notify( %s, %s )", event.host, event.obj)
+
+    def on_stats(self, event):
+        self._log(ARGS, "playbook_on_stats( %s )", event.obj)
+        self._log(FULL, "%s", _Deferred(self._to_vars_s, event.obj))
+        if self._level >= FULL and self._sampling.enabled:
+            for line in self._sampled.report_lines(self._sampling):
+                self._log(FULL, "%s", line)
+
+        # last hook of the run: flush everything still in the ring
+        if self._out:
+            self._out.close()
+            # the ring is closed, so straight to the display
+            self._display.display("execution_diag: wrote {0} entries to {1} (dropped: {2}, errors: {3})".format(
+                self._out.written, self._out_name, self._out.dropped, self._out.errors))
+
+    ####### V2 METHODS not routed through the capture core, by default they call v1 counterparts if possible ######
+    #
+    # The v1 counterparts only log (at ARGS and up), so below ARGS the v2 hooks stop after their own line and skip
+    # the host lookups and the dispatch altogether.
+    #
     def v2_on_any(self, *args, **kwargs):
-        self._log("v2_on_any(self, *args, **kwargs)")
+        if self._level < FULL:
+            return
+        self._log(FULL, "v2_on_any(self, *args, **kwargs)")
         self.on_any(args, kwargs)
 
-    def v2_runner_on_failed(self, result, ignore_errors=False):
-        self._log("v2_runner_on_failed(self, result, ignore_errors=False)")
-        host = result._host.get_name()
-        self.runner_on_failed(host, result._result, ignore_errors)
-
-    def v2_runner_on_ok(self, result):
-        self._log("v2_runner_on_ok(self, result)")
-        host = result._host.get_name()
-        self.runner_on_ok(host, result._result)
-
-    def v2_runner_on_skipped(self, result):
-        self._log("v2_runner_on_skipped(self, result)")
-        # TODO: C is not a defined here
-        if C.DISPLAY_SKIPPED_HOSTS:
-            host = result._host.get_name()
-            self.runner_on_skipped(host, self._get_item(getattr(result._result,'results',{})))
-
-    def v2_runner_on_unreachable(self, result):
-        self._log("v2_runner_on_unreachable(self, result)")
-        host = result._host.get_name()
-        self.runner_on_unreachable(host, result._result)
-
     def v2_runner_on_no_hosts(self, task):
-        self._log("v2_runner_on_no_hosts(self, task)")
+        self._log(HOOKS, "v2_runner_on_no_hosts(self, task)")
         self.runner_on_no_hosts()
 
-    def v2_runner_on_async_poll(self, result):
-        self._log("v2_runner_on_async_poll(self, result)")
-        host = result._host.get_name()
-        jid = result._result.get('ansible_job_id')
-        #FIXME, get real clock
-        clock = 0
-        self.runner_on_async_poll(host, result._result, jid, clock)
-
-    def v2_runner_on_async_ok(self, result):
-        self._log("v2_runner_on_async_ok(self, result)")
-        host = result._host.get_name()
-        jid = result._result.get('ansible_job_id')
-        self.runner_on_async_ok(host, result._result, jid)
-
-    def v2_runner_on_async_failed(self, result):
-        self._log("v2_runner_on_async_failed(self, result)")
-        host = result._host.get_name()
-        jid = result._result.get('ansible_job_id')
-        self.runner_on_async_failed(host, result._result, jid)
-
     #no v1 correspondance
     def v2_runner_on_file_diff(self, result, diff):
-        self._log("v2_runner_on_file_diff(self, result, diff)")
-
-    def v2_playbook_on_start(self, playbook):
-        self._log("v2_playbook_on_start(self, playbook)")
-        self.playbook_on_start()
-
-    def v2_playbook_on_notify(self, result, handler):
-        self._log("v2_playbook_on_notify(self, result, handler)")
-        host = result._host.get_name()
-        self.playbook_on_notify(host, handler)
+        self._log(HOOKS, "v2_runner_on_file_diff(self, result, diff)")
 
     def v2_playbook_on_no_hosts_matched(self):
-        self._log("v2_playbook_on_no_hosts_matched(self)")
+        self._log(HOOKS, "v2_playbook_on_no_hosts_matched(self)")
         self.playbook_on_no_hosts_matched()
 
     def v2_playbook_on_no_hosts_remaining(self):
-        self._log("v2_playbook_on_no_hosts_remaining(self)")
+        self._log(HOOKS, "v2_playbook_on_no_hosts_remaining(self)")
         self.playbook_on_no_hosts_remaining()
 
-    def v2_playbook_on_task_start(self, task, is_conditional):
-        self._log("v2_playbook_on_task_start(self, task, is_conditional)")
-        self.playbook_on_task_start(task, is_conditional)
-
-    #no v1 correspondance
-    def v2_playbook_on_cleanup_task_start(self, task):
-        self._log("v2_playbook_on_cleanup_task_start(self, task)")
-
-    #no v1 correspondance
-    def v2_playbook_on_handler_task_start(self, task):
-        self._log("v2_playbook_on_handler_task_start(self, task)")
-
-
     def v2_playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None):
-        self._log("v2_playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None)")
+        self._log(HOOKS, "v2_playbook_on_vars_prompt(self, varname, private=True, prompt=None, encrypt=None, confirm=False, salt_size=None, salt=None, default=None)")
         self.playbook_on_vars_prompt(varname, private, prompt, encrypt, confirm, salt_size, salt, default)
 
     def v2_playbook_on_setup(self):
-        self._log("v2_playbook_on_setup(self)")
+        self._log(HOOKS, "v2_playbook_on_setup(self)")
         self.playbook_on_setup()
 
     def v2_playbook_on_import_for_host(self, result, imported_file):
-        self._log("v2_playbook_on_import_for_host(self, result, imported_file)")
-        host = result._host.get_name()
-        self.playbook_on_import_for_host(host, imported_file)
+        self._log(HOOKS, "v2_playbook_on_import_for_host(self, result, imported_file)")
+        if self._level >= ARGS:
+            host = result._host.get_name()
+            self.playbook_on_import_for_host(host, imported_file)
 
     def v2_playbook_on_not_import_for_host(self, result, missing_file):
-        self._log("v2_playbook_on_not_import_for_host(self, result, missing_file)")
-        host = result._host.get_name()
-        self.playbook_on_not_import_for_host(host, missing_file)
-
-    def v2_playbook_on_play_start(self, play):
-        self._log("v2_playbook_on_play_start(self, play)")
-
-        #
-        # TODO: play.roles contains the list of roles for this play, freshly loaded.  Cache here so we can use later
-        #       Play obj: ansible/playbook/play.py
-        #
-        self._log("\tROLES: " + str(play.roles))
-        self.playbook_on_play_start(play.name)
-
-    def v2_playbook_on_stats(self, stats):
-        self._log("v2_playbook_on_stats(self, stats)")
-        self.playbook_on_stats(stats)
+        self._log(HOOKS, "v2_playbook_on_not_import_for_host(self, result, missing_file)")
+        if self._level >= ARGS:
+            host = result._host.get_name()
+            self.playbook_on_not_import_for_host(host, missing_file)
 
     def v2_on_file_diff(self, result):
-        self._log("v2_on_file_diff(self, result)")
-        if 'diff' in result._result:
+        self._log(HOOKS, "v2_on_file_diff(self, result)")
+        if self._level >= ARGS and 'diff' in result._result:
             host = result._host.get_name()
             self.on_file_diff(host, result._result['diff'])
 
-    #no v1 correspondance
-    def v2_playbook_on_include(self, included_file):
-        self._log("v2_playbook_on_include(self, included_file)")
-
-    def v2_playbook_item_on_ok(self, result):
-        self._log("v2_playbook_item_on_ok(self, result)")
-
-    def v2_playbook_item_on_failed(self, result):
-        self._log("v2_playbook_item_on_failed(self, result)")
-
-    def v2_playbook_item_on_skipped(self, result):
-        self._log("v2_playbook_item_on_skipped(self, result)")
-
     def v2_playbook_retry(self, result):
-        self._log("v2_playbook_retry(self, result)")
-
+        self._log(HOOKS, "v2_playbook_retry(self, result)")
@@ -18,8 +18,8 @@
 # See <http://www.gnu.org/licenses/> for a copy of the
 # GNU General Public License
 
-# Provides per-task timing, ongoing playbook elapsed time and
-# ordered list of top 15 longest running tasks at end
+# Provides per-task timing (per host, per task instance), ongoing playbook elapsed time and
+# ordered list of top N (default 15) longest running tasks at end
 
 # Make coding more python3-ish
 from __future__ import (absolute_import, division, print_function)
@@ -33,13 +33,37 @@ short_description: task profiling and timing callback plugin
 
 description:
    - Provides per-task timing, ongoing playbook elapsed time, time line with all tasks sequentially
-     and top 15 longest running tasks
+     and the top N longest running tasks (PROFILE_TIMELINE_TOP_N, default 15)
+   - tasks are tracked per task instance (uuid), not by name, with a span per host from the task
+     start to that host's result.  The report shows per-host min/avg/max next to the task's wall
+     time, and the parallelism (SUM(host time) / wall time) forks actually achieved.
+   - per-host durations go into a mergeable quantile sketch per task, so the report shows p50/p90/p99/max
+     across hosts (and for the whole run) in bounded memory.  PROFILE_TIMELINE_TOP_N sets how many of the
+     longest tasks are listed at the end (default 15).
+   - loop items are timed individually and rolled up per loop: item count, p50/p90/p99/max item time, the
+     slowest items, and whether the loop looks worth batching into a single module call.
+   - handlers get per host spans like tasks, linked to the tasks that notified them: notify fan-out, handler
+     time per host, and how many notifications came from results that didn't really change anything.
 '''
 
+import os
+import sys
 import time
 
 from ansible.plugins.callback import CallbackBase
 
+# ansible loads this file by path, so make the shared ansible_diag package (at the repo root) importable
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..'))
+if _REPO_ROOT not in sys.path:
+    sys.path.insert(0, _REPO_ROOT)
+
+from ansible_diag.capture import CaptureMixin, core
+from ansible_diag.handlers import HandlerTracker, handler_name, spurious_change
+from ansible_diag.loops import Loops
+from ansible_diag.sketch import QuantileSketch, TopN
+from ansible_diag.timeline import Timeline
+from ansible_diag.timeparse import parse_delta
+
 # define start time
 t0 = tn = time.time()
 
@@ -61,10 +85,6 @@ def seconds_to_hms(seconds_delta, show_subsec=False):
     return msg
 
 
-def timestamp(self):
-    if self.current is not None:
-        self.stats[self.current][1] = time.time() - self.stats[self.current][0]
-
 def tasktime():
     global tn
     time_current = time.strftime('%A %d %B %Y  %H:%M:%S %z')
@@ -74,15 +94,40 @@ def tasktime():
     msg = '%s (%s)%s%s ' % (time_current, time_elapsed, ' ' * 7, time_total_elapsed)
     return filled(msg)
 
-def seconds_to_hms(seconds):
-    m, s = divmod(seconds, 60)
-    h, m = divmod(m, 60)
-    return "%d:%02d:%02d" % (h, m, s)
-
-class CallbackModule(CallbackBase):
+def format_quantiles(sketch):
+    if not sketch.count:
+        return "-"
+    return "{0:.1f}/{1:.1f}/{2:.1f}/{3:.1f}".format(
+        sketch.quantile(0.5), sketch.quantile(0.9), sketch.quantile(0.99), sketch.max)
+
+
+def format_span(span):
+    return "{0}, {1}, {2:>6}, {3:>5} hosts, {4:>23}, {5:>5.1f}x, {6:<70}".format(
+        time.strftime('%H:%M:%S', time.localtime(span.start)),
+        seconds_to_hms(span.wall),
+        '{0:.01f}'.format(span.wall),
+        span.hosts,
+        format_quantiles(span.durations),
+        span.parallelism(),
+        span.name,
+    )
+
+
+def format_loop(loop):
+    saving = loop.batch_saving()
+    return "{0:>6} items, {1:>5} hosts, {2:>23}, {3:>8.1f}s, {4:>18}, {5:<60}".format(
+        loop.items,
+        loop.hosts,
+        format_quantiles(loop.durations),
+        loop.durations.sum,
+        ('batch: ~{0:.0f}s/host'.format(saving[1]) if loop.should_batch() else '') if saving else '',
+        loop.name + (' ({0} items arrived together, not timed)'.format(loop.batched) if loop.batched else ''),
+    )
+
+class CallbackModule(CaptureMixin, CallbackBase):
     """
     This callback module provides per-task timing, ongoing playbook elapsed time
-    and ordered list of top 15 longest running tasks at end.
+    and ordered list of top N (default 15) longest running tasks at end.
     """
     CALLBACK_VERSION = 2.0
     CALLBACK_TYPE = 'aggregate'
@@ -90,82 +135,107 @@ class CallbackModule(CallbackBase):
     CALLBACK_NEEDS_WHITELIST = True
 
     def __init__(self):
-        self.stats = {}
-        self.current = None
+        self.timeline = Timeline()
+        self.top_n = int(os.getenv('PROFILE_TIMELINE_TOP_N', 15))
+        self.loops = Loops(self.top_n)
+        self.handlers = HandlerTracker()
 
         super(CallbackModule, self).__init__()
-
-    def _timestamp(self):
-        if self.current is not None:
-            self.stats[self.current][1] = time.time() - self.stats[self.current][0]
+        core.add_sink(self.CALLBACK_NAME, self)
 
     def _log(self, msg):
         # TODO: make this better, handle varargs
         # note: display(self, msg, color=None, stderr=False, screen_only=False, log_only=False)
         self._display.display(msg)
 
-    def _record_task(self, name):
+    def _record_task(self, event, name):
         """
         Logs the start of each task
         """
         self._log(tasktime())
-        self._timestamp()
-
-        # Record the start time of the current task
-        # note: self.stats[taskname] = [ start_time, elapsed_time ]
-        self.current = name
-        self.stats[self.current] = [time.time(), None]
+        self.timeline.task_start(event.task_uuid, name, event.wall)
+        self.loops.task_start(event.task_uuid, name, getattr(event.task, 'action', None), event.wall)
+
+    #
+    # capture core sink (ansible_diag.capture): the v2 hooks come from CaptureMixin, already normalized
+    #
+    def on_task_start(self, event):
+        self.handlers.task_start()
+        self._record_task(event, event.task_name)
+
+    def on_handler_start(self, event):
+        self._record_task(event, 'HANDLER: ' + event.task_name)
+        self.handlers.handler_start(event.task_name, event.wall)
+
+    def on_notify(self, event):
+        # later ansible versions send notify before the notifying result, so there may be no result to look at
+        spurious = spurious_change(event.task, event.result or {})
+        self.handlers.notify(handler_name(event.obj), event.host, event.task_name or '(unknown task)', spurious)
+
+    def on_result(self, event):
+        """
+        Closes the span for the host the result came from
+        """
+        delta = event.result.get('delta')
+        self.timeline.host_done(event.task_uuid, event.host, event.wall, event.status,
+                                parse_delta(delta) if delta else None)
+        self.handlers.host_done(event.host, event.wall, event.status)
+        # looping tasks end with all their items in 'results'; counted here unless they came in one by one
+        self.loops.task_done(event.task_uuid, event.host, event.result, event.wall)
 
-    def playbook_on_task_start(self, name, is_conditional):
-        self._record_task(name)
+    def on_item(self, event):
+        self.loops.item_done(event.task_uuid, event.host, event.result, event.wall)
 
-    def v2_playbook_on_handler_task_start(self, task):
-        self._record_task('HANDLER: ' + task.name)
+    def on_stats(self, event):
+        self._report(event.wall)
 
-    def playbook_on_setup(self):
+    def v2_playbook_on_setup(self):
         self._log(tasktime())
 
-    def playbook_on_stats(self, stats):
+    def _report(self, now):
         self._log(tasktime())
         self._log(filled("", "="))
 
-        self._timestamp()
-
-        # sort tasks by start time
-        timeline = sorted(
-            self.stats.items(),
-            key=lambda value: value[1][0]
-        )
-
-        # Print  all timings
-        for name, times in timeline:
-            self._log(
-                "{0}, {1}, {2:>6}, {3:<70}".format(
-                    time.strftime('%H:%M:%S', time.localtime(times[0])),
-                    seconds_to_hms(times[1]),
-                    '{0:.01f}'.format(times[1]),
-                    name,
-                )
-            )
-
-        # Sort the tasks by their running time
-        results = sorted(
-            self.stats.items(),
-            key=lambda value: value[1][1],
-            reverse=True,
-        )
-
-        # Just keep the top 15
-        results = results[:15]
-
-        self._log(filled("-------- Top 15 Tasks (by elapsed time)", fchar="-"))
-
-        for name, times in results:
-            self._log(
-                "{0}, {1}, {2:>6}, {3:<70}".format(
-                    time.strftime('%H:%M:%S', time.localtime(times[0])),
-                    seconds_to_hms(times[1]),
-                    '{0:.01f}'.format(times[1]),
-                    name,
-                )
-            )
+        self.timeline.finish(now)
+
+        # one pass: print the timeline, keep the longest tasks and roll the per task sketches up to the run
+        top = TopN(self.top_n)
+        overall = QuantileSketch()
+
+        # start, wall time (h:mm:ss and seconds), hosts, per host p50/p90/p99/max seconds, parallelism, name
+        # (spans are kept in start order)
+        for span in self.timeline:
+            self._log(format_span(span))
+            top.push(span.wall, span)
+            overall.merge(span.durations)
+
+        self._log(filled("-------- Per host task time, all tasks (p50/p90/p99/max): " + format_quantiles(overall) + " ",
+                         fchar="-"))
+
+        self._log(filled("-------- Top {0} Tasks (by elapsed time)".format(self.top_n), fchar="-"))
+
+        for _, span in top.items():
+            self._log(format_span(span))
+
+        self.loops.finish()
+        slowest = TopN(self.top_n)
+        header = False
+        # items, hosts, per item p50/p90/p99/max seconds, total item time, batching estimate, name
+        for loop in self.loops:
+            if not header:
+                self._log(filled("-------- Loops (item time p50/p90/p99/max)", fchar="-"))
+                header = True
+            self._log(format_loop(loop))
+            for seconds, (label, host) in loop.slowest.items():
+                slowest.push(seconds, (label, host, loop.name))
+
+        if header:
+            self._log(filled("-------- Top {0} Loop Items (by item time)".format(self.top_n), fchar="-"))
+            for seconds, (label, host, name) in slowest.items():
+                self._log("{0:>8.2f}s, {1:<30}, {2:<40}, {3}".format(seconds, host, label, name))
+
+        handler_lines = self.handlers.report_lines(self.top_n)
+        if handler_lines:
+            self._log(filled("-------- Handlers", fchar="-"))
+            for line in handler_lines:
+                self._log(line)
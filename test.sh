@@ -1,6 +1,13 @@
 #!/bin/bash
 
 set -x
+
+# ./test.sh bench [options]: replay synthetic runs into the plugins instead (bench/bench_callbacks.py --help)
+if [ "$1" = "bench" ]; then
+    shift
+    exec python bench/bench_callbacks.py "$@"
+fi
+
 BASE_DIR=$(pwd)/plugins/v2_callback
 export ANSIBLE_CALLBACK_PLUGINS=$BASE_DIR/debug_log_json:$BASE_DIR/profile_timeline
 
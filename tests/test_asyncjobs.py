@@ -0,0 +1,92 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.asyncjobs import DEFAULT_POLL_COST, AsyncJob, AsyncTracker, task_async_settings
+
+
+class _Task(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class AsyncTrackerTest(unittest.TestCase):
+
+    def test_polled_job(self):
+        tracker = AsyncTracker()
+        tracker.launch('j1', 'web1', 'backup', 0.0, timeout=600, poll_interval=10)
+        for now in (10.5, 21.0, 31.5):
+            tracker.poll('j1', 'web1', 'backup', now)
+        job = tracker.complete('j1', 'web1', 'backup', 31.5, 'ok', finished=25.0)
+        self.assertEqual((3, 25.0, 31.5), (job.polls, job.finished, job.noticed))
+        self.assertEqual({}, tracker.active)
+
+        s = tracker.tasks['backup']
+        self.assertEqual((1, 0, 3, False), (s['jobs'], s['failed'], s['polls'], s['estimated']))
+        self.assertEqual(25.0, s['duration'].mean)
+        self.assertEqual(6.5, s['wasted'].mean)
+        # polls every 10.5s for a 10s interval: 0.5s per poll; sqrt(2 * 0.5 * 25) = 5
+        self.assertEqual((0.5, 5.0), tracker.advice('backup'))
+
+    def test_completed_twice(self):
+        tracker = AsyncTracker()
+        tracker.launch('j1', 'web1', 'backup', 0.0)
+        self.assertIsNotNone(tracker.complete('j1', 'web1', 'backup', 5.0, 'ok'))
+        self.assertIsNone(tracker.complete('j1', 'web1', 'backup', 6.0, 'ok'))
+        self.assertEqual(1, tracker.tasks['backup']['jobs'])
+
+    def test_polls_inferred(self):
+        # versions that poll in the worker: no poll callbacks, the count comes from run time / poll interval
+        tracker = AsyncTracker()
+        job = tracker.complete('j1', 'web1', 'backup', 25.0, 'failed', launched=0.0, poll_interval=10)
+        self.assertEqual(0, job.polls)
+        s = tracker.tasks['backup']
+        self.assertEqual((3, True, 1), (s['polls'], s['estimated'], s['failed']))
+        self.assertEqual(DEFAULT_POLL_COST, tracker.advice('backup')[0])
+        self.assertTrue(tracker.report_lines()[2].startswith('      1     25.0s       3~'))
+
+    def test_unknown_job(self):
+        tracker = AsyncTracker()
+        self.assertIsNone(tracker.complete('j9', 'web1', 'backup', 5.0, 'ok'))
+        # a job first seen at a poll counts from the task start
+        job = tracker.poll('j2', 'web1', 'backup', 12.0, launched=2.0)
+        self.assertEqual((2.0, 1), (job.launched, job.polls))
+
+    def test_finish_clamped(self):
+        tracker = AsyncTracker()
+        tracker.launch('j1', 'web1', 'a', 10.0)
+        tracker.launch('j2', 'web1', 'a', 10.0)
+        self.assertEqual(10.0, tracker.complete('j1', 'web1', 'a', 20.0, 'ok', finished=5.0).finished)
+        self.assertEqual(20.0, tracker.complete('j2', 'web1', 'a', 20.0, 'ok', finished=30.0).finished)
+
+    def test_remaining(self):
+        self.assertEqual(40, AsyncJob('j1', 'web1', 'a', 0.0, timeout=60).remaining(20.4))
+        self.assertEqual(0, AsyncJob('j1', 'web1', 'a', 0.0, timeout=60).remaining(90.0))
+        self.assertIsNone(AsyncJob('j1', 'web1', 'a', 0.0).remaining(1.0))
+
+    def test_task_settings(self):
+        self.assertEqual((300, 5), task_async_settings(_Task(async_val=300, poll=5)))
+        self.assertEqual((300, 0), task_async_settings(_Task(**{'async': 300, 'poll': 0})))
+        self.assertEqual((None, None), task_async_settings(_Task(async_val=0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
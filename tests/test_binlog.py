@@ -0,0 +1,139 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import struct
+import tempfile
+import time
+import unittest
+
+from ansible_diag.binlog import ROW, ROW_SIZE, BinlogReader, BinlogWriter, is_binlog
+from ansible_diag.records import TaskRecord
+
+
+def _record(i, result=None):
+    return TaskRecord('ok' if i % 2 else 'failed', 'role{0}'.format(i % 2), '/roles/role{0}'.format(i % 2),
+                      'task {0}'.format(i), 'host{0}'.format(i), 100.0 + i, 101.5 + i, 1.5, result, 'site',
+                      'uuid-{0}'.format(i), 100.25 + i, 101.75 + i, None, 0.25)
+
+
+class BinlogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.binlog')
+        self.records = [_record(i, {'rc': i, 'stdout': 'x' * i} if i % 3 else None) for i in range(7)]
+        # small batches, so the file has several STRS/BLOB/RECS groups
+        writer = BinlogWriter(self.path, batch_size=2)
+        for rec in self.records:
+            writer.put(rec)
+        writer.close()
+        self.assertEqual(7, writer.written)
+        self.assertEqual(0, writer.errors)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        self.assertTrue(is_binlog(self.path))
+        with BinlogReader(self.path) as reader:
+            self.assertEqual(7, len(reader))
+            self.assertGreater(len(reader.blocks), 1)
+            got = list(reader.records(payloads=True))
+        for rec, back in zip(self.records, got):
+            expected = rec.as_dict()
+            self.assertEqual(expected, back)
+        self.assertIsNone(got[0]['ctl_mono'])
+        self.assertIsNone(got[0]['result'])
+
+    def test_records_without_payloads(self):
+        with BinlogReader(self.path) as reader:
+            self.assertNotIn('result', next(iter(reader)))
+
+    def test_columns(self):
+        with BinlogReader(self.path) as reader:
+            self.assertEqual([100.0 + i for i in range(7)], list(reader.column('start')))
+            self.assertEqual([101.75 + i for i in range(7)], list(reader.column('ctl_end')))
+            self.assertEqual(['host{0}'.format(i) for i in range(7)],
+                             [reader.strings[sid] for sid in reader.column('host')])
+            self.assertEqual(['uuid-{0}'.format(i) for i in range(7)],
+                             [reader.strings[sid] for sid in reader.column('taskid')])
+            # every column agrees with the row it came from
+            rows = list(reader.rows())
+            self.assertEqual([row[7] for row in rows], list(reader.column('payload_offset')))
+            self.assertEqual([row[8] for row in rows], list(reader.column('payload_length')))
+            self.assertEqual([row[13] for row in rows], list(reader.column('host')))
+
+    def test_payload_offsets(self):
+        with BinlogReader(self.path) as reader:
+            offsets = reader.column('payload_offset')
+            lengths = reader.column('payload_length')
+            for rec, offset, length in zip(self.records, offsets, lengths):
+                self.assertEqual(rec.result, reader.payload(offset, length))
+                raw = reader.raw_payload(offset, length)
+                if rec.result is None:
+                    self.assertIsNone(raw)
+                else:
+                    self.assertEqual(b'{', raw[:1].tobytes())
+                    # views into the map must go before it's closed
+                    del raw
+
+    def test_truncated_file(self):
+        # a run killed mid-write: everything up to the last complete block still reads
+        size = os.path.getsize(self.path)
+        with open(self.path, 'rb+') as f:
+            f.truncate(size - ROW_SIZE // 2)
+        with BinlogReader(self.path) as reader:
+            rows = len(reader)
+        self.assertGreater(rows, 0)
+        self.assertLess(rows, 7)
+
+    def test_failed_batch_strings(self):
+        # a batch whose every record fails after interning its names must still write those strings
+        path = os.path.join(self.dir, 'failed.binlog')
+        writer = BinlogWriter(path, flush_interval=0.01)
+        bad = _record(0, {'rc': 0})
+        bad.start = 'not a time'
+        writer.put(bad)
+        deadline = time.time() + 5
+        while not writer.errors and time.time() < deadline:
+            time.sleep(0.01)
+        writer.put(_record(0, {'rc': 0}))
+        writer.close()
+        self.assertEqual((1, 1), (writer.errors, writer.written))
+        with BinlogReader(path) as reader:
+            self.assertEqual([_record(0, {'rc': 0}).as_dict()], list(reader.records(payloads=True)))
+
+    def test_row_layout(self):
+        self.assertEqual(96, ROW_SIZE)
+        self.assertEqual(ROW_SIZE, struct.calcsize('<7dq8i'))
+        self.assertEqual(ROW_SIZE, ROW.size)
+
+    def test_not_a_binlog(self):
+        path = os.path.join(self.dir, 'run.ndjson')
+        with open(path, 'w') as f:
+            f.write('{"a":1}\n')
+        self.assertFalse(is_binlog(path))
+        self.assertRaises(ValueError, BinlogReader, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
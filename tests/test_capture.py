@@ -0,0 +1,224 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag import capture
+from ansible_diag.capture import CaptureCore, CaptureMixin
+
+
+class _Host(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class _Task(object):
+    def __init__(self, name, uuid):
+        self.name = name
+        self._uuid = uuid
+
+    def get_name(self):
+        return self.name
+
+
+class _Result(object):
+    def __init__(self, host, task, result):
+        self._host = _Host(host) if not isinstance(host, _Host) else host
+        self._task = task
+        self._result = result
+
+    def clean_copy(self):
+        # what ansible 2.4+ hands each callback plugin: same host and task, its own result dict
+        return _Result(self._host, self._task, dict(self._result))
+
+
+class _Plugin(CaptureMixin):
+    # a callback plugin without CallbackBase: the mixin is all the capture path needs
+    def __init__(self):
+        self.events = []
+        capture.core.add_sink(self.name, self)
+
+    def on_event(self, event):
+        self.events.append(event)
+
+
+# every plugin is its own CallbackModule class
+_PLUGINS = dict((name, type(str(name), (_Plugin,), {'name': name}))
+                for name in ('execution_diag', 'debug_log_json', 'profile_timeline'))
+
+
+class _Summary(object):
+    # a sink that isn't a plugin, and only wants results
+    def __init__(self):
+        self.results = []
+
+    def on_result(self, event):
+        self.results.append((event.host, event.status))
+
+
+class CaptureCoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self._core = capture.core
+        capture.core = CaptureCore()
+        self.plugins = [_PLUGINS[name]() for name in ('execution_diag', 'debug_log_json', 'profile_timeline')]
+
+    def tearDown(self):
+        capture.core = self._core
+
+    def _all(self, hook, *args):
+        # ansible calls every enabled callback plugin in turn with the same arguments
+        for plugin in self.plugins:
+            getattr(plugin, hook)(*args)
+
+    def _all_copied(self, hook, result, *args):
+        # ... or, from 2.4, each with its own copy of the result
+        for plugin in self.plugins:
+            getattr(plugin, hook)(result.clean_copy(), *args)
+
+    def assertEvents(self, expected):
+        for plugin in self.plugins:
+            self.assertEqual(expected, [(e.kind, e.task_name, e.host) for e in plugin.events], plugin.name)
+
+    def test_one_event_per_hook_call(self):
+        task = _Task('install', 'u1')
+        self._all('v2_playbook_on_task_start', task, False)
+        for host in ('web1', 'web2'):
+            self._all('v2_runner_on_ok', _Result(host, task, {'changed': True}))
+        self.assertEqual(3, capture.core.events)
+        self.assertEvents([('task_start', 'install', None), ('result', 'install', 'web1'),
+                           ('result', 'install', 'web2')])
+        # every sink gets the same object
+        for i in range(3):
+            self.assertEqual(1, len(set(id(p.events[i]) for p in self.plugins)))
+        event = self.plugins[0].events[1]
+        self.assertEqual(('ok', 'u1', {'changed': True}), (event.status, event.task_uuid, event.result))
+
+    def test_copied_results(self):
+        task = _Task('install', 'u1')
+        self._all('v2_playbook_on_task_start', task, False)
+        hosts = ['web{0}'.format(i) for i in range(10)]
+        for host in hosts:
+            self._all_copied('v2_runner_on_ok', _Result(host, task, {'changed': True}))
+            self._all_copied('v2_runner_item_on_ok', _Result(host, task, {'item': 1}))
+        self.assertEqual(21, capture.core.events)
+        for plugin in self.plugins:
+            results = [e.host for e in plugin.events if e.kind == 'result']
+            self.assertEqual(hosts, results, plugin.name)
+            self.assertEqual(10, len([e for e in plugin.events if e.kind == 'item']))
+
+    def test_handler_reflush_same_task(self):
+        # a handler notified again later runs with the same task object, and the same host; both runs are events
+        handler = _Task('restart nginx', 'h1')
+        for _ in range(2):
+            self._all('v2_playbook_on_handler_task_start', handler)
+            self._all('v2_runner_on_ok', _Result('web1', handler, {'changed': True}))
+        self.assertEqual(4, capture.core.events)
+        self.assertEvents([('handler_start', 'restart nginx', None), ('result', 'restart nginx', 'web1')] * 2)
+        starts = [e for e in self.plugins[0].events if e.kind == 'handler_start']
+        self.assertEqual(['h1', 'h1'], [e.task_uuid for e in starts])
+        self.assertIsNot(starts[0], starts[1])
+
+    def test_same_args_back_to_back_from_one_plugin(self):
+        # with a single plugin enabled there's nobody to dedupe against: each call is its own event
+        self.plugins = self.plugins[:1]
+        handler = _Task('restart nginx', 'h1')
+        self._all('v2_playbook_on_handler_task_start', handler)
+        self._all('v2_playbook_on_handler_task_start', handler)
+        self.assertEqual(2, capture.core.events)
+
+    def test_first_caller_leads(self):
+        task = _Task('install', 'u1')
+        result = _Result('web1', task, {})
+        self.plugins[2].v2_playbook_on_task_start(task, False)
+        self.plugins[0].v2_playbook_on_task_start(task, False)
+        self.plugins[1].v2_runner_on_failed(result, True)
+        self.plugins[2].v2_runner_on_failed(result, True)
+        self.plugins[0].v2_runner_on_failed(result, True)
+        self.assertEqual(2, capture.core.events)
+        self.assertEqual(['task_start', 'result'], [e.kind for e in self.plugins[0].events])
+        self.assertTrue(self.plugins[0].events[1].ignore_errors)
+
+    def test_extra_sink(self):
+        summary = _Summary()
+        capture.core.add_sink('summary', summary)
+        task = _Task('install', 'u1')
+        self._all('v2_playbook_on_task_start', task, False)
+        self._all('v2_runner_on_unreachable', _Result('db1', task, {}))
+        self.assertEqual([('db1', 'unreachable')], summary.results)
+
+    def test_sink_replaced(self):
+        # a plugin instantiated again replaces its sink instead of getting every event twice, and still leads
+        old = self.plugins[0]
+        self._all('v2_playbook_on_task_start', _Task('install', 'u1'), False)
+        self.plugins[0] = type(old)()
+        self._all('v2_playbook_on_task_start', _Task('install', 'u2'), False)
+        self.assertEqual(1, len(old.events))
+        self.assertEqual(1, len(self.plugins[0].events))
+        self.assertEqual(2, len(self.plugins[1].events))
+
+    def test_leader_removed(self):
+        # replay drops its plugins between runs; the next plugin to call takes over
+        self._all('v2_playbook_on_task_start', _Task('install', 'u1'), False)
+        capture.core.remove_sink(self.plugins[0].name)
+        del self.plugins[0]
+        self._all('v2_playbook_on_task_start', _Task('install', 'u2'), False)
+        self.assertEqual(2, capture.core.events)
+        self.assertEqual(['u1', 'u2'], [e.task_uuid for e in self.plugins[0].events])
+
+
+    def test_task_start_times(self):
+        # handler results and interleaved (free strategy) results each carry their own task's start
+        install = _Task('install', 'u1')
+        configure = _Task('configure', 'u2')
+        handler = _Task('restart nginx', 'h1')
+        self._all('v2_playbook_on_task_start', install, False)
+        self._all('v2_playbook_on_task_start', configure, False)
+        self._all('v2_runner_on_ok', _Result('web1', install, {}))
+        self._all('v2_runner_on_ok', _Result('web2', configure, {}))
+        self._all('v2_playbook_on_handler_task_start', handler)
+        self._all('v2_runner_on_ok', _Result('web1', handler, {}))
+        self._all('v2_runner_on_ok', _Result('web3', install, {}))
+
+        events = self.plugins[0].events
+        starts = dict((e.task_uuid, e) for e in events if e.kind in ('task_start', 'handler_start'))
+        results = [e for e in events if e.kind == 'result']
+        self.assertEqual(['u1', 'u2', 'h1', 'u1'], [e.task_uuid for e in results])
+        for e in results:
+            start = starts[e.task_uuid]
+            self.assertEqual((start.wall, start.mono), (e.started, e.started_mono))
+            self.assertLessEqual(e.started_mono, e.mono)
+        self.assertIs(handler, results[2].task)
+
+    def test_task_start_unknown(self):
+        task = _Task('install', 'u1')
+        self._all('v2_playbook_on_task_start', task, False)
+        self._all('v2_playbook_on_play_start', object())
+        self._all('v2_runner_on_ok', _Result('web1', task, {}))
+        self._all('v2_runner_on_ok', _Result('web1', _Task('other', 'u9'), {}))
+        results = [e for e in self.plugins[0].events if e.kind == 'result']
+        self.assertEqual([(None, None)] * 2, [(e.started, e.started_mono) for e in results])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.concurrency import ConcurrencyReport
+
+
+def _rec(host, taskid, start, end):
+    return {'host': host, 'taskid': taskid, 'taskname': taskid, 'start': start, 'end': end}
+
+
+class ConcurrencyReportTest(unittest.TestCase):
+
+    def _report(self, forks=2):
+        report = ConcurrencyReport(forks)
+        # t1 overlaps three hosts (peak 3); t2 starts the instant t1's last host ends
+        for rec in (_rec('h1', 't1', 0.0, 10.0), _rec('h2', 't1', 2.0, 5.0), _rec('h3', 't1', 4.0, 8.0),
+                    _rec('h1', 't2', 10.0, 12.0), {'host': 'h2', 'taskid': 't3'}):
+            report.add(rec)
+        return report.compute()
+
+    def test_sweep(self):
+        report = self._report()
+        self.assertEqual((0.0, 12.0, 12.0), (report.first, report.last, report.wall))
+        self.assertEqual(3, report.peak)
+        self.assertEqual(19.0, report.busy_slot_seconds)
+        self.assertAlmostEqual(19.0 / 12, report.average)
+        # levels above forks are folded into forks: 1 host for 2+2+2s, 2 or more for 2+1+3s
+        self.assertEqual({1: 6.0, 2: 6.0}, report.time_at_level)
+
+    def test_back_to_back_not_concurrent(self):
+        report = ConcurrencyReport(5)
+        report.add(_rec('h1', 'a', 0.0, 1.0))
+        report.add(_rec('h1', 'b', 1.0, 2.0))
+        report.compute()
+        self.assertEqual(1, report.peak)
+        self.assertEqual({1: 2.0}, report.time_at_level)
+
+    def test_barriers(self):
+        report = self._report()
+        # t1: 2 slots over 10s wall, 17 host seconds busy; t2: one host, nothing to wait on
+        self.assertEqual(3.0, report.barrier_idle)
+        self.assertEqual([(3.0, 3, 10.0, 't1'), (0.0, 1, 2.0, 't2')], report.worst_barriers())
+        # with a fork per host t1 could have used 3 slots
+        self.assertEqual(13.0, self._report(forks=3).barrier_idle)
+
+    def test_empty(self):
+        report = ConcurrencyReport(5).compute()
+        self.assertEqual((None, 0, 0.0, 0.0), (report.first, report.peak, report.wall, report.average))
+
+
+if __name__ == '__main__':
+    unittest.main()
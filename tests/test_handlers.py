@@ -0,0 +1,105 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.handlers import HandlerTracker, handler_name, spurious_change
+
+
+class _Task(object):
+    def __init__(self, action, changed_when=None, name=None):
+        self.action = action
+        self.changed_when = changed_when
+        self._name = name
+
+    def get_name(self):
+        return self._name
+
+
+class SpuriousChangeTest(unittest.TestCase):
+
+    def test_always_changed_modules(self):
+        self.assertTrue(spurious_change(_Task('shell'), {'changed': True}))
+        self.assertFalse(spurious_change(_Task('shell', changed_when='rc == 2'), {'changed': True}))
+        self.assertFalse(spurious_change(_Task('template'), {'changed': True}))
+
+    def test_empty_diff(self):
+        self.assertTrue(spurious_change(_Task('template'), {'diff': {'before': 'a', 'after': 'a'}}))
+        self.assertTrue(spurious_change(_Task('template'), {'diff': [{'before': 'a', 'after': 'a'}] * 2}))
+        self.assertFalse(spurious_change(_Task('template'), {'diff': [{'before': 'a', 'after': 'a'},
+                                                                      {'before': 'a', 'after': 'b'}]}))
+        self.assertFalse(spurious_change(_Task('template'), {'diff': []}))
+        self.assertFalse(spurious_change(_Task('template'), {'diff': {'prepared': '...'}}))
+
+    def test_handler_name(self):
+        self.assertEqual('restart nginx', handler_name(_Task('service', name='restart nginx')))
+        self.assertEqual('plain', handler_name('plain'))
+
+
+class HandlerTrackerTest(unittest.TestCase):
+
+    def _tracker(self):
+        tracker = HandlerTracker()
+        tracker.notify('restart nginx', 'web1', 'nginx config')
+        tracker.notify('restart nginx', 'web2', 'nginx config')
+        tracker.notify('restart nginx', 'web1', 'reload script', spurious=True)
+        tracker.notify('reload app', 'web1', 'nginx config')
+        return tracker
+
+    def test_notifications(self):
+        tracker = self._tracker()
+        h = tracker.handlers['restart nginx']
+        self.assertEqual((3, 1), (h.notifications, h.spurious))
+        self.assertEqual({'nginx config': 2, 'reload script': 1}, dict(h.notifiers))
+        self.assertEqual(3, tracker.fanout['nginx config'][0])
+        self.assertEqual(set(['restart nginx', 'reload app']), tracker.fanout['nginx config'][1])
+
+    def test_handler_spans(self):
+        tracker = self._tracker()
+        self.assertFalse(tracker.host_done('web1', 1.0, 'ok'))
+        tracker.handler_start('restart nginx', 10.0)
+        self.assertTrue(tracker.host_done('web1', 12.0, 'ok'))
+        self.assertTrue(tracker.host_done('web2', 13.0, 'changed'))
+        # flushed again later in the play: a second run timed from its own start
+        tracker.handler_start('restart nginx', 50.0)
+        tracker.host_done('web1', 51.0, 'ok')
+        tracker.task_start()
+        self.assertFalse(tracker.host_done('web1', 60.0, 'ok'))
+
+        h = tracker.handlers['restart nginx']
+        self.assertEqual((2, 3, 6.0), (h.runs, h.durations.count, h.durations.sum))
+        self.assertEqual({'ok': 2, 'changed': 1}, h.statuses)
+        self.assertEqual((50.0, 51.0), (h.start, h.end))
+        self.assertEqual({'web1': 3.0, 'web2': 3.0}, tracker.host_time)
+
+    def test_report_lines(self):
+        self.assertEqual([], HandlerTracker().report_lines())
+        tracker = self._tracker()
+        tracker.handler_start('restart nginx', 0.0)
+        tracker.host_done('web1', 2.0, 'ok')
+        lines = tracker.report_lines()
+        self.assertTrue(lines[1].endswith('restart nginx'))
+        self.assertEqual('         notified by: nginx config (2), reload script (1)', lines[2])
+        self.assertIn('notify fan-out by task: notifications, handlers', lines)
+        self.assertEqual('       2.0s  web1', lines[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ansible_diag import history
+from ansible_diag.loaders import iter_history_run
+
+HOSTS = ['web{0}'.format(i) for i in range(10)]
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'history.db')
+        # three runs a day apart; install gets slower each run, web3 fails the second
+        for n in range(3):
+            recorder = history.HistoryRecorder(self.path)
+            started = 1000000.0 + n * 86400
+            recorder.start_run('site.yml', started)
+            for i, host in enumerate(HOSTS):
+                duration = (n + 1) * (i + 1)
+                status = 'failed' if n == 1 and host == 'web3' else 'ok'
+                recorder.record('site.yml', 'web', 'install', host, status, started, started + duration, duration,
+                                i % 2 == 0)
+                recorder.record('site.yml', None, 'ping', host, 'ok', started, started + 0.5, 0.5, False)
+            recorder.close()
+            self.assertEqual(20, recorder.written)
+            self.assertEqual(0, recorder.errors)
+        self.conn = history.connect(self.path)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.dir)
+
+    def test_runs(self):
+        runs = self.conn.execute('SELECT id, playbook, started, finished FROM runs ORDER BY id').fetchall()
+        self.assertEqual([1, 2, 3], [r[0] for r in runs])
+        self.assertTrue(all(r[3] is not None for r in runs))
+        self.assertEqual(60, self.conn.execute('SELECT COUNT(*) FROM records').fetchone()[0])
+
+    def test_list_tasks(self):
+        self.assertEqual([('site.yml', '', 'ping', 3), ('site.yml', 'web', 'install', 3)],
+                         history.list_tasks(self.conn))
+        self.assertEqual([], history.list_tasks(self.conn, 'other.yml'))
+
+    def test_task_trend(self):
+        trend = history.task_trend(self.conn, 'site.yml', 'web', 'install')
+        self.assertEqual([1, 2, 3], [row[0] for row in trend])
+        run, started, hosts, mn, p50, p90, p99, mx = trend[1]
+        # durations 2, 4, ... 20; nearest rank percentiles
+        self.assertEqual((1000000.0 + 86400, 10, 2.0, 12.0, 20.0, 20.0, 20.0), (started, hosts, mn, p50, p90, p99, mx))
+        # tasks outside a role are stored under ''
+        self.assertEqual(3, len(history.task_trend(self.conn, 'site.yml', None, 'ping')))
+        self.assertEqual([3], [row[0] for row in history.task_trend(self.conn, 'site.yml', 'web', 'install',
+                                                                    since=1000000.0 + 2 * 86400)])
+
+    def test_host_trend(self):
+        trend = history.host_trend(self.conn, 'site.yml', 'web', 'install', 'web3')
+        self.assertEqual([(1, 1000000.0, 'ok', 4.0, 0), (2, 1000000.0 + 86400, 'failed', 8.0, 0),
+                          (3, 1000000.0 + 2 * 86400, 'ok', 12.0, 0)], trend)
+        self.assertEqual([1, 1, 1], [row[4] for row in history.host_trend(self.conn, 'site.yml', 'web', 'install',
+                                                                           'web0')])
+        self.assertEqual([], history.host_trend(self.conn, 'site.yml', 'web', 'install', 'db1'))
+
+    def test_task_durations(self):
+        values = history.task_durations(self.conn, 'site.yml', 'web', 'install')
+        self.assertEqual(30, len(values))
+        self.assertEqual(sorted(values), values)
+        self.assertEqual([1.0, 2.0, 3.0], history.task_durations(self.conn, 'site.yml', 'web', 'install', 'web0'))
+        self.assertEqual([10.0, 20.0, 30.0], history.task_durations(self.conn, 'site.yml', 'web', 'install', 'web9'))
+        self.assertEqual([30.0], history.task_durations(self.conn, 'site.yml', 'web', 'install', 'web9',
+                                                        since=1000000.0 + 2 * 86400))
+
+    def test_iter_history_run(self):
+        records = list(iter_history_run(self.conn, 2))
+        self.assertEqual(20, len(records))
+        failed = [r for r in records if r['runnercode'] == 'failed']
+        self.assertEqual(['web3'], [r['host'] for r in failed])
+        self.assertEqual(('web', 'install', 8.0, False),
+                         (failed[0]['rolename'], failed[0]['taskname'], failed[0]['duration'], failed[0]['changed']))
+        self.assertTrue(all(r['rolename'] is None for r in records if r['taskname'] == 'ping'))
+
+    def test_two_runs_one_recorder(self):
+        recorder = history.HistoryRecorder(self.path)
+        for started in (2000000.0, 2000100.0):
+            recorder.start_run('other.yml', started)
+            recorder.record('other.yml', None, 'ping', 'web0', 'ok', started, started + 1, 1.0, False)
+        recorder.close()
+        self.assertEqual([(4, 1), (5, 1)], [row[:1] + row[2:3] for row in history.task_trend(self.conn, 'other.yml',
+                                                                                             None, 'ping')])
+
+    def test_percentile(self):
+        values = [float(v) for v in range(1, 101)]
+        self.assertEqual(51.0, history.percentile(values, 0.5))
+        self.assertEqual(100.0, history.percentile(values, 0.99))
+        self.assertEqual(100.0, history.percentile(values, 1.0))
+        self.assertIsNone(history.percentile([], 0.5))
+
+    def test_parse_since(self):
+        now = time.time()
+        self.assertAlmostEqual(now - 7 * 86400, history.parse_since('7d'), delta=5)
+        self.assertAlmostEqual(now - 1800, history.parse_since('30m'), delta=5)
+        self.assertEqual(1234.5, history.parse_since('1234.5'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.latency import LagMonitor
+
+
+class LagMonitorTest(unittest.TestCase):
+
+    def test_host_offset_bound(self):
+        # web1's clock runs 100s ahead; its fastest delivery sets the bound, lag is measured beyond it
+        lag = LagMonitor(warn=None)
+        self.assertEqual(0.0, lag.observe('web1', 1100.0, 1000.3))
+        self.assertEqual(0.0, lag.observe('web1', 1200.0, 1100.1))
+        self.assertAlmostEqual(99.9, lag.offsets['web1'])
+        self.assertAlmostEqual(2.8, lag.observe('web1', 1300.0, 1202.9))
+        # hosts have their own bounds
+        self.assertEqual(0.0, lag.observe('web2', 50.0, 1210.0))
+        self.assertEqual((4, 2.8), (lag.count, round(lag.max_lag, 6)))
+
+    def test_rolling_window(self):
+        lag = LagMonitor(window=3, warn=None)
+        self.assertEqual(0.0, lag.rolling_quantile(0.5))
+        lag.observe('h', 100.0, 100.0)
+        for received in (101.0, 102.0, 103.0):
+            lag.observe('h', 100.0, received)
+        # the first (0s) result has left the window of 3: lags 1, 2, 3
+        self.assertEqual(3, sum(lag.rolling))
+        self.assertEqual(4, sum(lag.total))
+        self.assertEqual(2.0, lag.rolling_quantile(0.5))
+        self.assertEqual(5.0, lag.rolling_quantile(0.9))
+        lag.observe('h', 100.0, 300.0)
+        self.assertEqual(float('inf'), lag.rolling_quantile(0.9))
+
+    def test_backlog_warning(self):
+        warnings = []
+        lag = LagMonitor(threshold=1.0, window=10, min_samples=3, warn=warnings.append, warn_interval=3600)
+        lag.observe('h', 100.0, 100.0)
+        lag.observe('h', 100.0, 100.5)
+        self.assertEqual([], warnings)
+        lag.observe('h', 100.0, 103.0)
+        self.assertEqual([], warnings)
+        # median over the threshold: one warning, then quiet for warn_interval
+        lag.observe('h', 100.0, 104.0)
+        lag.observe('h', 100.0, 104.0)
+        self.assertEqual(1, len(warnings))
+        self.assertIn('not keeping up', warnings[0])
+        self.assertEqual(1, lag.warnings)
+
+    def test_report_lines(self):
+        lag = LagMonitor(warn=None)
+        self.assertEqual(['result delivery lag: 0 results, max 0.00s, 0 backlog warnings'], lag.report_lines())
+        lag.observe('web1', 1100.0, 1000.0)
+        lines = lag.report_lines()
+        self.assertEqual(3, len(lines))
+        self.assertIn('web1 +100.00s', lines[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.loops import LoopSpan, Loops, item_label, item_remote, item_status
+
+
+class ItemTest(unittest.TestCase):
+
+    def test_label(self):
+        self.assertEqual('nginx', item_label({'item': 'nginx'}))
+        self.assertEqual('web', item_label({'item': {'name': 'web', 'port': 80}, '_ansible_item_label': 'web'}))
+        self.assertEqual("{'port': 80}", item_label({'item': {'port': 80}}))
+        label = item_label({'item': 'x' * 200})
+        self.assertEqual((80, 'xxx...'), (len(label), label[-6:]))
+
+    def test_status(self):
+        self.assertEqual(['failed', 'skipped', 'unreachable', 'ok'],
+                         [item_status(r) for r in ({'failed': True}, {'skipped': True}, {'unreachable': True}, {})])
+
+    def test_remote(self):
+        self.assertEqual(1.5, item_remote({'delta': '0:00:01.500000'}))
+        self.assertAlmostEqual(2.25, item_remote({'start': '2016-03-27 00:58:07.000000',
+                                                  'end': '2016-03-27 00:58:09.250000'}))
+        self.assertIsNone(item_remote({'changed': True}))
+
+
+class LoopsTest(unittest.TestCase):
+
+    def test_live_items_timed_by_gap(self):
+        loops = Loops()
+        loops.task_start('u1', 'users', 'user', 0.0)
+        for now, name in ((1.0, 'a'), (3.0, 'b'), (6.0, 'c')):
+            loops.item_done('u1', 'web1', {'item': name, 'changed': name == 'b'}, now)
+        # the final result repeats the items; they already came in live
+        loops.task_done('u1', 'web1', {'results': [{'item': n} for n in 'abc']}, 6.0)
+        loop, = list(loops)
+        self.assertEqual(('users', 'user', 1, 3, 1, 0), (loop.name, loop.action, loop.hosts, loop.items,
+                                                        loop.changed, loop.untimed))
+        self.assertEqual((3, 6.0), (loop.durations.count, loop.durations.sum))
+        self.assertEqual([(3.0, ('c', 'web1')), (2.0, ('b', 'web1')), (1.0, ('a', 'web1'))], loop.slowest.items())
+
+    def test_batched_delivery_untimed(self):
+        # all items handed over at once at the end: the first gap is the whole loop, so nothing is timed
+        loops = Loops()
+        loops.task_start('u1', 'users', 'user', 0.0)
+        for name in 'abc':
+            loops.item_done('u1', 'web1', {'item': name}, 5.0)
+        loops.task_done('u1', 'web1', {'results': []}, 5.0)
+        loop, = list(loops)
+        self.assertEqual((3, 3, 0), (loop.untimed, loop.batched, loop.durations.count))
+
+    def test_final_result_only(self):
+        # versions without per item callbacks: items come with the task result, timed only by their own delta
+        loops = Loops()
+        loops.task_start('u1', 'pkgs', 'apt', 0.0)
+        loops.task_done('u1', 'web1', {'results': [{'item': 'a', 'delta': '0:00:02.000000'},
+                                                   {'item': 'b', 'failed': True}, 'not a dict']}, 9.0)
+        loops.task_done('u2', 'web1', {'rc': 0}, 10.0)
+        loop, = list(loops)
+        self.assertEqual({'ok': 1, 'failed': 1}, loop.statuses)
+        self.assertEqual((1, 2.0, 1), (loop.durations.count, loop.durations.sum, loop.untimed))
+
+    def test_gaps_settled_at_next_task(self):
+        loops = Loops()
+        loops.task_start('u1', 'users', 'user', 0.0)
+        loops.item_done('u1', 'web1', {'item': 'a'}, 1.0)
+        loops.item_done('u1', 'web1', {'item': 'b'}, 2.0)
+        loops.task_start('u2', 'next', 'ping', 2.0)
+        self.assertEqual(2, loops.loops['u1'].durations.count)
+
+    def test_batch_advice(self):
+        loop = LoopSpan('u1', 'pkgs', 'apt', 0.0)
+        for host in ('web1', 'web2'):
+            for i in range(6):
+                loop.item_done(host, str(i), 0.0, 'ok', remote=0.5, live=False)
+        per_host, seconds = loop.batch_saving()
+        self.assertEqual(6, per_host)
+        # five of the six calls' fixed cost
+        self.assertAlmostEqual(2.5, seconds, delta=0.05)
+        self.assertTrue(loop.should_batch())
+
+        short = LoopSpan('u2', 'one', 'command', 0.0)
+        short.item_done('web1', 'a', 0.0, 'ok', remote=1.0, live=False)
+        self.assertIsNone(short.batch_saving())
+        self.assertFalse(short.should_batch())
+
+
+if __name__ == '__main__':
+    unittest.main()
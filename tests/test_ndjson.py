@@ -0,0 +1,69 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ansible_diag.ndjson import NdjsonWriter, dumps_line, iter_ndjson
+
+
+class _Record(object):
+    # stands in for TaskRecord: debug_log_json queues records and passes format_item to serialize them
+    def __init__(self, host):
+        self.host = host
+
+    def as_dict(self):
+        return {'entrytype': 'TASK_RECORD', 'host': self.host}
+
+
+class NdjsonWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'run.ndjson')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_dicts_by_default(self):
+        writer = NdjsonWriter(self.path)
+        for i in range(3):
+            writer.put({'n': i})
+        writer.close()
+        self.assertEqual([{'n': 0}, {'n': 1}, {'n': 2}], list(iter_ndjson(self.path)))
+        self.assertEqual(3, writer.written)
+
+    def test_custom_format_item(self):
+        # the way debug_log_json's DEBUG_LOG_JSON_STREAM mode builds it
+        writer = NdjsonWriter(self.path, format_item=lambda record: dumps_line(record.as_dict()))
+        writer.put(_Record('web1'))
+        writer.put(_Record('web2'))
+        writer.close()
+        self.assertEqual(['web1', 'web2'], [rec['host'] for rec in iter_ndjson(self.path)])
+        self.assertEqual(0, writer.errors)
+
+    def test_dumps_line(self):
+        self.assertEqual('{"a":1,"b":[2]}\n', dumps_line({'b': [2], 'a': 1}))
+
+
+if __name__ == '__main__':
+    unittest.main()
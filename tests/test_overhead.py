@@ -0,0 +1,81 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.overhead import OverheadStats
+from ansible_diag.spans import SpanClock
+
+
+class OverheadStatsTest(unittest.TestCase):
+
+    def test_totals(self):
+        stats = OverheadStats()
+        stats.add('web', 'install', 'h1', 10.0, 2.0)
+        stats.add('web', 'install', 'h2', 8.0, 4.0)
+        stats.add(None, 'ping', 'h1', 1.0, 0.5)
+        stats.add(None, 'facts', 'h1', None, None)
+        self.assertEqual((6.5, 19.0), (stats.total_overhead, stats.total_remote))
+        self.assertEqual([(6.0, 3.0, 4.0, 18.0, 2, ('web', 'install')), (0.5, 0.5, 0.5, 1.0, 1, (None, 'ping'))],
+                         stats.top_tasks())
+        self.assertEqual(['h2', 'h1'], [row[-1] for row in stats.top_hosts()])
+        # a result without a split is only counted
+        self.assertEqual(1, stats.tasks[(None, 'facts')][2])
+        self.assertEqual(0, stats.clock_skew)
+
+    def test_clock_skew_clamped(self):
+        stats = OverheadStats()
+        stats.add(None, 'sleep', 'h1', 5.0, -0.25)
+        stats.add(None, 'sleep', 'h2', 5.0, 1.0)
+        self.assertEqual(1, stats.clock_skew)
+        self.assertEqual(1.0, stats.total_overhead)
+        self.assertEqual(0.0, stats.hosts['h1'][0].min)
+        lines = stats.report_lines()
+        self.assertIn('clock skew: 1 results', lines[1])
+        self.assertNotIn('clock skew', '\n'.join(OverheadStats().report_lines()))
+
+
+class SpanClockTest(unittest.TestCase):
+
+    def test_controller_clock(self):
+        clock = SpanClock()
+        # ends at arrival, starts the module's duration earlier
+        self.assertEqual((105.0, 110.0), clock({'ctl_start': 100.0, 'ctl_end': 110.0, 'duration': 5.0,
+                                                 'start': 9000.0, 'end': 9005.0}))
+        # but never before the task started on the controller
+        self.assertEqual((100.0, 103.0), clock({'ctl_start': 100.0, 'ctl_end': 103.0, 'duration': 5.0}))
+        # no duration: the whole controller span
+        self.assertEqual((100.0, 103.0), clock({'ctl_start': 100.0, 'ctl_end': 103.0}))
+        # module times can't be mixed in once the controller clock is picked
+        self.assertIsNone(clock({'start': 50.0, 'end': 60.0}))
+        self.assertEqual((True, 1), (clock.controller, clock.skipped))
+
+    def test_module_clock(self):
+        clock = SpanClock()
+        self.assertIsNone(clock({'host': 'h1'}))
+        self.assertIsNone(clock.controller)
+        self.assertEqual((50.0, 60.0), clock({'start': 50.0, 'end': 60.0, 'ctl_end': None}))
+        self.assertEqual((70.0, 72.5), clock({'start': 70.0, 'duration': 2.5}))
+        self.assertIsNone(clock({'start': 80.0}))
+        self.assertEqual((False, 1), (clock.controller, clock.skipped))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import unittest
+
+from ansible_diag.payloads import MIN_BYTES, PayloadEncoder, PayloadResolver, PayloadTable, join, split
+
+STDOUT = 'line of output\n' * 20
+
+
+def _result(rc=0, stdout=STDOUT):
+    return {'rc': rc, 'changed': False, 'delta': '0:00:01.000000', 'msg': 'short', 'stdout': stdout,
+            'stdout_lines': stdout.splitlines(), 'results': None}
+
+
+class PayloadTableTest(unittest.TestCase):
+
+    def test_dedup(self):
+        table = PayloadTable()
+        first = table.add(STDOUT)
+        self.assertEqual(first, table.add(STDOUT))
+        other = table.add(STDOUT + 'x')
+        self.assertNotEqual(first, other)
+        self.assertEqual(2, len(table))
+        self.assertEqual(3, table.refs)
+        self.assertEqual(STDOUT, table.lookup(first))
+        self.assertGreater(table.raw_bytes, table.stored_bytes)
+        self.assertAlmostEqual(table.raw_bytes / table.stored_bytes, table.ratio)
+
+    def test_string_and_structure_kept_apart(self):
+        # a string and a structure that serializes to that same text aren't the same payload
+        table = PayloadTable()
+        value = ['a'] * 40
+        self.assertNotEqual(table.add(json.dumps(value, separators=(',', ':'))), table.add(value))
+
+    def test_empty(self):
+        table = PayloadTable()
+        self.assertEqual(0, len(table))
+        self.assertEqual(1.0, table.ratio)
+        self.assertIsNone(table.lookup(0))
+
+
+class SplitJoinTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        table = PayloadTable()
+        result = _result()
+        inline, refs = split(result, table)
+        self.assertEqual(set(['stdout', 'stdout_lines']), set(k for k, _ in refs))
+        self.assertEqual({'rc': 0, 'changed': False, 'delta': '0:00:01.000000', 'msg': 'short', 'results': None},
+                         inline)
+        self.assertEqual(result, join(inline, refs, table))
+
+    def test_hosts_share_payloads(self):
+        table = PayloadTable()
+        splits = [split(_result(rc=i), table) for i in range(100)]
+        self.assertEqual(2, len(table))
+        self.assertEqual(200, table.refs)
+        self.assertEqual(set([splits[0][1]]), set(refs for _, refs in splits))
+        self.assertEqual(_result(rc=42), join(splits[42][0], splits[42][1], table))
+
+    def test_min_bytes(self):
+        table = PayloadTable()
+        short = 'x' * (MIN_BYTES - 10)
+        inline, refs = split({'stdout': short}, table)
+        self.assertEqual(((), {'stdout': short}), (refs, inline))
+        inline, refs = split({'stdout': short}, table, min_bytes=8)
+        self.assertEqual(1, len(refs))
+
+    def test_not_a_dict(self):
+        table = PayloadTable()
+        self.assertEqual(('text', ()), split('text', table))
+        self.assertEqual('text', join('text', (), table))
+        self.assertEqual(0, len(table))
+
+
+class EncoderTest(unittest.TestCase):
+
+    def test_encode_resolve(self):
+        encoder = PayloadEncoder()
+        records = [{'entrytype': 'TASK_RECORD', 'host': 'host{0}'.format(i), 'result': _result(rc=i)}
+                   for i in range(3)]
+        summary = {'entrytype': 'SAMPLE_SUMMARY', 'kept': 3}
+        lines = ''.join(encoder(dict(rec, result=dict(rec['result']))) for rec in records) + encoder(summary)
+        entries = [json.loads(line) for line in lines.splitlines()]
+
+        # each distinct value goes out once, before the first record that needs it
+        payloads = [e for e in entries if e['entrytype'] == 'PAYLOAD']
+        self.assertEqual(2, len(payloads))
+        self.assertEqual(['PAYLOAD', 'PAYLOAD', 'TASK_RECORD', 'TASK_RECORD', 'TASK_RECORD', 'SAMPLE_SUMMARY'],
+                         [e['entrytype'] for e in entries])
+        self.assertNotIn('stdout', entries[2]['result'])
+
+        resolver = PayloadResolver()
+        back = [e for e in (resolver.feed(e) for e in entries) if e is not None]
+        self.assertEqual(records + [summary], back)
+
+
+if __name__ == '__main__':
+    unittest.main()
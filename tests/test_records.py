@@ -0,0 +1,169 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag import capture
+from ansible_diag.capture import CaptureCore, CaptureMixin
+from ansible_diag.records import RecordStore, TaskRecord, record_from_event, task_identity, task_label
+
+
+class _Host(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_name(self):
+        return self.name
+
+
+class _Role(object):
+    def __init__(self, name):
+        self._role_name = name
+        self._role_path = '/roles/' + name
+
+
+class _Task(object):
+    def __init__(self, name, uuid, role=None):
+        self.name = name
+        self._uuid = uuid
+        self._role = _Role(role) if role else None
+
+    def get_name(self):
+        return '{0} : {1}'.format(self._role._role_name, self.name) if self._role else self.name
+
+
+class _Result(object):
+    def __init__(self, host, task, result):
+        self._host = _Host(host)
+        self._task = task
+        self._result = result
+
+
+class _Recorder(CaptureMixin):
+    # debug_log_json's record path: one TaskRecord per result event
+    def __init__(self):
+        self.records = []
+        capture.core.add_sink('recorder', self)
+
+    def on_result(self, event):
+        self.records.append(record_from_event(event, 'site'))
+
+
+class RecordFromEventTest(unittest.TestCase):
+
+    def setUp(self):
+        self._core = capture.core
+        capture.core = CaptureCore()
+        self.recorder = _Recorder()
+
+    def tearDown(self):
+        capture.core = self._core
+
+    def test_times(self):
+        task = _Task('install', 'u1', role='web')
+        self.recorder.v2_playbook_on_task_start(task, False)
+        self.recorder.v2_runner_on_ok(_Result('web1', task, {'start': '2016-03-27 00:58:07.000000',
+                                                             'end': '2016-03-27 00:58:07.500000',
+                                                             'delta': '0:00:00.500000'}))
+        self.recorder.v2_runner_on_ok(_Result('web2', task, {'start': '2016-03-27 00:58:07.000000',
+                                                             'end': '2016-03-27 00:58:08.250000'}))
+        self.recorder.v2_runner_on_unreachable(_Result('web3', task, {'msg': 'unreachable'}))
+        first, second, third = self.recorder.records
+
+        self.assertEqual(('ok', 'web', '/roles/web', 'install', 'web1', 'site', 'u1'),
+                         (first.runnercode, first.rolename, first.rolepath, first.taskname, first.host, first.play,
+                          first.taskid))
+        self.assertAlmostEqual(0.5, first.end - first.start)
+        self.assertEqual(0.5, first.duration)
+        # no delta: end - start
+        self.assertAlmostEqual(1.25, second.duration)
+        self.assertEqual((None, None, None, None), (third.start, third.end, third.duration, third.overhead))
+        self.assertEqual('unreachable', third.runnercode)
+
+        for rec in self.recorder.records:
+            self.assertIsNotNone(rec.ctl_start)
+            self.assertLessEqual(rec.ctl_start, rec.ctl_end)
+        # overhead is the controller's elapsed time minus the module's (fake, so negative here)
+        self.assertAlmostEqual(first.ctl_end - first.ctl_start - 0.5, first.overhead, places=3)
+
+    def test_handler(self):
+        # a handler's results are the handler's, timed from the handler's start, not the last regular task's
+        install = _Task('install', 'u1', role='web')
+        handler = _Task('restart nginx', 'h1', role='web')
+        self.recorder.v2_playbook_on_task_start(install, False)
+        self.recorder.v2_runner_on_ok(_Result('web1', install, {'changed': True}))
+        self.recorder.v2_playbook_on_handler_task_start(handler)
+        self.recorder.v2_runner_on_ok(_Result('web1', handler, {'delta': '0:00:00.000000'}))
+        install_rec, handler_rec = self.recorder.records
+        self.assertEqual(('restart nginx', 'h1'), (handler_rec.taskname, handler_rec.taskid))
+        self.assertGreater(handler_rec.ctl_start, install_rec.ctl_start)
+        self.assertLessEqual(handler_rec.overhead, handler_rec.ctl_end - handler_rec.ctl_start + 1e-6)
+
+    def test_free_strategy(self):
+        # under free, hosts run different tasks at once and their results arrive interleaved
+        tasks = [_Task('task{0}'.format(i), 'u{0}'.format(i)) for i in range(3)]
+        for task in tasks:
+            self.recorder.v2_playbook_on_task_start(task, False)
+        for host, i in (('web1', 0), ('web2', 2), ('web3', 1), ('web1', 1), ('web2', 0)):
+            self.recorder.v2_runner_on_ok(_Result(host, tasks[i], {}))
+        self.assertEqual([('web1', 'task0', 'u0'), ('web2', 'task2', 'u2'), ('web3', 'task1', 'u1'),
+                          ('web1', 'task1', 'u1'), ('web2', 'task0', 'u0')],
+                         [(r.host, r.taskname, r.taskid) for r in self.recorder.records])
+        starts = dict((r.taskid, r.ctl_start) for r in self.recorder.records)
+        self.assertLess(starts['u0'], starts['u1'])
+        self.assertLess(starts['u1'], starts['u2'])
+
+    def test_unseen_start(self):
+        self.recorder.v2_runner_on_ok(_Result('web1', _Task('install', 'u1'), {'delta': '0:00:01.000000'}))
+        rec = self.recorder.records[0]
+        self.assertEqual((None, None), (rec.ctl_start, rec.overhead))
+        self.assertIsNotNone(rec.ctl_end)
+
+
+class TaskIdentityTest(unittest.TestCase):
+
+    def test_identity(self):
+        self.assertEqual(('web', '/roles/web', 'install', 'u1'), task_identity(_Task('install', 'u1', role='web')))
+        self.assertEqual((None, None, 'ping', None), task_identity(_Task('ping', None)))
+        self.assertEqual((None, None, None, None), task_identity(None))
+        self.assertEqual('web : install', task_label('web', 'install'))
+        self.assertEqual('ping', task_label(None, 'ping'))
+
+
+class RecordStoreTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        store = RecordStore()
+        stdout = 'output\n' * 50
+        records = [TaskRecord('ok', 'web', '/roles/web', 'install', 'web{0}'.format(i % 3), 1.0 + i, 2.0 + i, 1.0,
+                              {'rc': 0, 'stdout': stdout}, 'site', 'u1', None, 3.0 + i, 4.0 + i, None)
+                   for i in range(6)]
+        for rec in records:
+            store.append(rec)
+        self.assertEqual(6, len(store))
+        self.assertEqual([r.as_dict() for r in records], [r.as_dict() for r in store])
+        self.assertEqual(['web0', 'web1', 'web2'], store.hosts())
+        self.assertEqual([2.0, 5.0], [r.start for r in dict(store.by_host())['web1']])
+        # one copy of stdout for six results
+        self.assertEqual(1, len(store.payloads))
+
+
+if __name__ == '__main__':
+    unittest.main()
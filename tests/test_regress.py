@@ -0,0 +1,123 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import math
+import unittest
+
+from ansible_diag.regress import RunDurations, compare
+from ansible_diag.stats import mean_var, prediction_t, t_sf, welch_t
+
+# Welch's t-test example 1 from the Wikipedia article: t = -2.46, two sided p = 0.021
+SAMPLE_A = [27.5, 21.0, 19.0, 23.6, 17.0, 17.9, 16.9, 20.1, 21.9, 22.6, 23.1, 19.6, 19.0, 21.7, 21.4]
+SAMPLE_B = [27.1, 22.0, 20.8, 23.4, 23.4, 23.5, 25.8, 22.0, 24.8, 20.2, 21.9, 22.1, 22.9, 20.5, 24.4]
+
+
+class StatsTest(unittest.TestCase):
+
+    def test_mean_var(self):
+        self.assertEqual((4, 2.5, 5.0 / 3), mean_var([1.0, 2.0, 3.0, 4.0]))
+        self.assertEqual((1, 7.0, 0.0), mean_var([7.0]))
+
+    def test_t_sf_table(self):
+        # one sided critical values from a t table
+        for t, df, p in ((1.833, 9, 0.05), (2.262, 9, 0.025), (2.821, 9, 0.01), (2.228, 10, 0.025),
+                         (1.96, 10000, 0.025)):
+            self.assertAlmostEqual(p, t_sf(t, df), places=4)
+        self.assertAlmostEqual(0.95, t_sf(-1.833, 9), places=4)
+        self.assertEqual(0.5, t_sf(0.0, 5))
+        self.assertIsNone(t_sf(1.0, 0))
+
+    def test_t_sf_closed_forms(self):
+        for t in (0.1, 0.5, 1.0, 3.0, 20.0):
+            # df 1 is the Cauchy distribution; df 2 has a closed form too
+            self.assertAlmostEqual(0.5 - math.atan(t) / math.pi, t_sf(t, 1), places=9)
+            self.assertAlmostEqual(0.5 - t / (2 * math.sqrt(2 + t * t)), t_sf(t, 2), places=9)
+
+    def test_welch(self):
+        t, p = welch_t(*(mean_var(SAMPLE_A) + mean_var(SAMPLE_B)))
+        self.assertAlmostEqual(-2.46, t, places=2)
+        # one sided for A > B, so the two sided p is 2 * (1 - p)
+        self.assertAlmostEqual(0.021, 2 * (1 - p), places=3)
+        t, p = welch_t(*(mean_var(SAMPLE_B) + mean_var(SAMPLE_A)))
+        self.assertAlmostEqual(2.46, t, places=2)
+        self.assertAlmostEqual(0.0105, p, places=3)
+
+    def test_welch_degenerate(self):
+        self.assertEqual((None, None), welch_t(1, 5.0, 0.0, 10, 1.0, 1.0))
+        self.assertEqual((None, None), welch_t(5, 5.0, 0.0, 5, 1.0, 0.0))
+
+    def test_prediction(self):
+        # baseline n=10, mean 10, var 1: x at t(0.05, 9) standard errors of prediction above the mean gives p = 0.05
+        x = 10.0 + 1.833 * math.sqrt(1.0 * (1 + 1.0 / 10))
+        t, p = prediction_t(x, 10, 10.0, 1.0)
+        self.assertAlmostEqual(1.833, t, places=9)
+        self.assertAlmostEqual(0.05, p, places=4)
+        self.assertEqual((None, None), prediction_t(12.0, 1, 10.0, 0.0))
+        self.assertEqual((None, None), prediction_t(12.0, 5, 10.0, 0.0))
+
+
+class CompareTest(unittest.TestCase):
+
+    def _run(self, label, durations, task='install'):
+        run = RunDurations(label)
+        for i, d in enumerate(durations):
+            run.add('web', task, 'host{0}'.format(i), d)
+        return run
+
+    def test_regression(self):
+        baselines = [self._run('b1', SAMPLE_A), self._run('b2', [v + 0.1 for v in SAMPLE_A])]
+        candidate = self._run('c', [v * 2 for v in SAMPLE_A])
+        candidate.add('web', 'new task', 'host0', 1.0)
+        tasks, hosts, missing = compare(candidate, baselines)
+        self.assertEqual([('web', 'new task')], missing)
+        self.assertEqual(1, len(tasks))
+        self.assertTrue(tasks[0].regressed)
+        self.assertLess(tasks[0].p, 0.05)
+        self.assertEqual(len(SAMPLE_A), len(hosts))
+        self.assertTrue(all(r.regressed for r in hosts))
+
+    def test_no_regression(self):
+        tasks, hosts, _ = compare(self._run('c', SAMPLE_B), [self._run('b', SAMPLE_A)], per_host=False)
+        # slower on average, but not by the 20% threshold
+        self.assertFalse(tasks[0].regressed)
+        self.assertEqual([], hosts)
+
+    def test_single_baseline_insufficient(self):
+        # one baseline run: hosts vary within it, but that says nothing about run to run noise, so no p-value
+        tasks, hosts, _ = compare(self._run('c', [v * 2 for v in SAMPLE_A]), [self._run('b', SAMPLE_A)])
+        self.assertTrue(tasks[0].insufficient)
+        self.assertIsNone(tasks[0].p)
+        self.assertTrue(tasks[0].regressed)
+        self.assertTrue(all(r.insufficient and r.p is None for r in hosts))
+
+    def test_task_in_one_baseline_run(self):
+        # two baselines, but only one of them ran the task
+        baselines = [self._run('b1', SAMPLE_A), self._run('b2', SAMPLE_A, task='other')]
+        tasks, _, _ = compare(self._run('c', SAMPLE_B), baselines, per_host=False)
+        self.assertTrue(tasks[0].insufficient)
+        self.assertIsNone(tasks[0].p)
+        tasks, _, _ = compare(self._run('c', SAMPLE_B), [self._run('b1', SAMPLE_A), self._run('b2', SAMPLE_A)],
+                              per_host=False)
+        self.assertFalse(tasks[0].insufficient)
+        self.assertIsNotNone(tasks[0].p)
+
+
+if __name__ == '__main__':
+    unittest.main()
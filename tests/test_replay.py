@@ -0,0 +1,137 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+from collections import Counter
+
+from ansible_diag.replay import FakeStats, from_records, replay, synthetic
+from ansible_diag.timeparse import parse_delta
+
+
+class _Counting(object):
+    # a callback without ansible: counts the hooks it gets
+    CALLBACK_NAME = 'replay_counting'
+    disabled = False
+
+    def __init__(self):
+        self.hooks = Counter()
+        self.any = 0
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self.hooks['task_start'] += 1
+
+    def v2_runner_on_ok(self, result):
+        self.hooks['ok'] += 1
+        print('ok')
+
+    def v2_runner_on_failed(self, result):
+        self.hooks['failed'] += 1
+
+    def v2_on_any(self, *args):
+        self.any += 1
+
+
+class _Disabled(_Counting):
+    CALLBACK_NAME = 'replay_disabled'
+    disabled = True
+
+
+class SyntheticTest(unittest.TestCase):
+
+    def test_event_counts(self):
+        events = list(synthetic(hosts=7, tasks=3, payload=16))
+        hooks = Counter(hook for hook, _ in events)
+        # playbook start, play start, a start and 7 results per task, stats
+        self.assertEqual(2 + 3 * 8 + 1, len(events))
+        self.assertEqual(3, hooks['v2_playbook_on_task_start'])
+        self.assertEqual(21, hooks['v2_runner_on_ok'] + hooks['v2_runner_on_failed'])
+        self.assertEqual('v2_playbook_on_stats', events[-1][0])
+
+    def test_deterministic(self):
+        def statuses(seed):
+            return [hook for hook, _ in synthetic(hosts=50, tasks=4, failed=0.2, seed=seed)]
+        self.assertEqual(statuses(1), statuses(1))
+        self.assertNotEqual(statuses(1), statuses(2))
+
+    def test_payload(self):
+        _, (result,) = [e for e in synthetic(hosts=1, tasks=1, payload=100) if e[0] == 'v2_runner_on_ok'][0]
+        self.assertEqual(100, len(result._result['stdout']))
+        self.assertGreater(parse_delta(result._result['delta']), 0)
+
+
+class FromRecordsTest(unittest.TestCase):
+
+    def test_events(self):
+        records = [
+            {'host': 'web1', 'play': 'p1', 'rolename': 'common', 'taskname': 'ntp', 'runnercode': 'ok',
+             'start': 1000.0, 'duration': 1.5},
+            {'host': 'web2', 'play': 'p1', 'rolename': 'common', 'taskname': 'ntp', 'runnercode': 'failed',
+             'result': {'rc': 1, 'delta': '0:00:02.000000'}},
+            {'host': 'web1', 'play': 'p1', 'taskname': 'x', 'runnercode': 'SAMPLE_SUMMARY'},
+            {'host': 'web1', 'play': 'p2', 'taskname': 'ping', 'runnercode': 'skipped'},
+        ]
+        events = list(from_records(records))
+        self.assertEqual(['v2_playbook_on_start', 'v2_playbook_on_play_start', 'v2_playbook_on_task_start',
+                          'v2_runner_on_ok', 'v2_runner_on_failed', 'v2_playbook_on_play_start',
+                          'v2_playbook_on_task_start', 'v2_runner_on_skipped', 'v2_playbook_on_stats'],
+                         [hook for hook, _ in events])
+        ok = events[3][1][0]
+        self.assertEqual(('web1', 'ntp', 'common'), (ok._host.name, ok._task.name, ok._task._role._role_name))
+        # rebuilt from the record's times
+        self.assertEqual(1.5, parse_delta(ok._result['delta']))
+        self.assertEqual('0:00:02.000000', events[4][1][0]._result['delta'])
+        stats = events[-1][1][0]
+        self.assertEqual({'ok': 1, 'changed': 0, 'failures': 0, 'unreachable': 0, 'skipped': 1},
+                         stats.summarize('web1'))
+
+
+class ReplayTest(unittest.TestCase):
+
+    def test_dispatch(self):
+        events = list(synthetic(hosts=5, tasks=2, failed=0.0))
+        made = []
+
+        def factory():
+            made.append(_Counting())
+            return made[-1]
+        factory.CALLBACK_NAME = _Counting.CALLBACK_NAME
+
+        stats = replay([factory, _Disabled], events, name='counting')
+        callback, = made
+        self.assertEqual({'task_start': 2, 'ok': 10}, dict(callback.hooks))
+        # every event also goes to v2_on_any; none to the disabled callback
+        self.assertEqual(len(events), callback.any)
+        self.assertEqual(len(events), stats.events)
+        self.assertEqual(10, len(stats.by_hook['v2_runner_on_ok']))
+        self.assertEqual(10, stats.output_lines)
+        self.assertEqual('counting', stats.name)
+        self.assertEqual(3, len(stats.quantiles()))
+        self.assertEqual(len(stats.by_hook), len(stats.hook_lines()))
+
+    def test_fake_stats(self):
+        stats = FakeStats()
+        stats.add('web1', 'ok', changed=True)
+        stats.add('web1', 'unreachable')
+        self.assertEqual({'ok': 1, 'changed': 1, 'failures': 0, 'unreachable': 1, 'skipped': 0},
+                         stats.summarize('web1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import unittest
+import zlib
+
+from ansible_diag.sampling import SampleSummary, SamplingPolicy, always_kept
+
+HOSTS = ['host{0:05d}.example.com'.format(i) for i in range(10000)]
+
+
+class SamplingPolicyTest(unittest.TestCase):
+
+    def test_deterministic(self):
+        # crc32 of the host name: the same pick in every process and run
+        picked = [h for h in HOSTS if SamplingPolicy(0.1).host_sampled(h)]
+        self.assertEqual(picked, [h for h in HOSTS if SamplingPolicy(0.1).host_sampled(h)])
+        self.assertEqual(picked, [h for h in HOSTS if zlib.crc32(h.encode('utf-8')) & 0xffffffff <=
+                                  int(0.1 * 0xffffffff)])
+        salted = [h for h in HOSTS if SamplingPolicy(0.1, salt='other').host_sampled(h)]
+        self.assertNotEqual(picked, salted)
+
+    def test_rate(self):
+        for rate in (0.01, 0.1, 0.5):
+            policy = SamplingPolicy(rate)
+            for h in HOSTS:
+                policy.keep(h, 'ok')
+            self.assertEqual(len(HOSTS), policy.seen_hosts)
+            self.assertAlmostEqual(rate, policy.sampled_hosts / len(HOSTS), delta=0.01)
+        # a larger rate keeps a superset of the hosts
+        small = set(h for h in HOSTS if SamplingPolicy(0.1).host_sampled(h))
+        large = set(h for h in HOSTS if SamplingPolicy(0.5).host_sampled(h))
+        self.assertTrue(small < large)
+
+    def test_always_kept(self):
+        policy = SamplingPolicy(0.0)
+        host = HOSTS[0]
+        self.assertFalse(policy.keep(host, 'ok'))
+        self.assertTrue(policy.keep(host, 'ok', changed=True))
+        self.assertTrue(policy.keep(host, 'failed'))
+        self.assertTrue(policy.keep(host, 'unreachable'))
+        self.assertFalse(always_kept('skipped'))
+
+    def test_full_rate(self):
+        policy = SamplingPolicy(3.0)
+        self.assertEqual((1.0, False), (policy.rate, policy.enabled))
+        self.assertTrue(all(policy.keep(h, 'ok') for h in HOSTS[:100]))
+        # nothing to look up when everything is kept
+        self.assertEqual(0, policy.seen_hosts)
+
+    def test_from_env(self):
+        os.environ['ANSIBLE_DIAG_SAMPLE_RATE'] = '0.25'
+        os.environ['ANSIBLE_DIAG_SAMPLE_SALT'] = 'x'
+        try:
+            policy = SamplingPolicy.from_env()
+        finally:
+            del os.environ['ANSIBLE_DIAG_SAMPLE_RATE']
+            del os.environ['ANSIBLE_DIAG_SAMPLE_SALT']
+        self.assertEqual((0.25, 'x', True), (policy.rate, policy.salt, policy.enabled))
+
+
+class SampleSummaryTest(unittest.TestCase):
+
+    def test_summary(self):
+        policy = SamplingPolicy(0.5)
+        summary = SampleSummary()
+        summary.kept = 3
+        for i in range(10):
+            policy.keep(HOSTS[i], 'ok')
+            summary.add('web', 'install', 'ok', 2.0)
+        summary.add('web', 'install', 'skipped')
+        d = summary.to_dict(policy)
+        self.assertEqual(('SAMPLE_SUMMARY', 0.5, 10, 3, 11), (d['entrytype'], d['rate'], d['hosts'], d['kept'],
+                                                              d['summarized']))
+        task, = d['tasks']
+        self.assertEqual(({'ok': 10, 'skipped': 1}, 10, 20.0), (task['counts'], task['timed'], task['duration_sum']))
+        self.assertAlmostEqual(2.0, task['duration_estimated']['p50'], delta=0.02)
+        self.assertEqual(2, len(summary.report_lines(policy)) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
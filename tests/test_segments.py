@@ -0,0 +1,167 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from ansible_diag.records import TaskRecord
+from ansible_diag.segments import SegmentedFile, SegmentedWriter, iter_lines, open_segment, read_manifest, select
+from ansible_diag.writer import RingBufferWriter
+
+
+def _record(i, play):
+    return TaskRecord('ok', None, None, 'task {0}'.format(i), 'host{0}'.format(i), None, None, None,
+                      {'pad': 'x' * 100}, play, None, None, 1000.0 + i)
+
+
+class SegmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, n=200, max_bytes=4096, compress='gzip'):
+        writer = SegmentedWriter(self.dir, max_bytes=max_bytes, max_seconds=0, compress=compress,
+                                 format_item=lambda rec: json.dumps(rec.as_dict(), sort_keys=True) + '\n')
+        for i in range(n):
+            writer.put(_record(i, 'first' if i < n // 2 else 'second'))
+        writer.close()
+        return writer
+
+    def test_rotation_stays_under_cap(self):
+        writer = self._write()
+        self.assertEqual(200, writer.written)
+        entries = read_manifest(self.dir)
+        self.assertGreater(len(entries), 1)
+        self.assertEqual(list(range(len(entries))), [e['index'] for e in entries])
+        self.assertEqual(200, sum(e['records'] for e in entries))
+        for e in entries:
+            self.assertLessEqual(e['raw_bytes'], 4096)
+            self.assertEqual(e['stored_bytes'], os.path.getsize(e['path']))
+
+    def test_read_back(self):
+        for compress in ('gzip', 'zlib', 'none'):
+            self._write(compress=compress)
+            hosts = [json.loads(line)['host'] for line in iter_lines(self.dir)]
+            self.assertEqual(['host{0}'.format(i) for i in range(200)], hosts, compress)
+            shutil.rmtree(self.dir)
+            os.makedirs(self.dir)
+
+    def test_manifest_index(self):
+        self._write()
+        entries = read_manifest(self.dir)
+        self.assertEqual(1000.0, entries[0]['first'])
+        self.assertEqual(1199.0, entries[-1]['last'])
+        for e in entries:
+            self.assertTrue(set(e['plays']) <= set(['first', 'second']))
+
+        second = select(entries, play='second')
+        self.assertTrue(all('second' in e['plays'] for e in second))
+        self.assertEqual(['host{0}'.format(i) for i in range(100, 200)],
+                         [h for h in (json.loads(line)['host'] for line in iter_lines(self.dir, play='second'))
+                          if int(h[4:]) >= 100])
+        late = select(entries, since=1150.0)
+        self.assertTrue(all(e['last'] >= 1150.0 for e in late))
+        self.assertIn(entries[-1], late)
+        self.assertNotIn(entries[0], late)
+        self.assertEqual([entries[0]], select(entries, until=1000.0))
+
+    def test_second_run_appends(self):
+        self._write(n=50)
+        before = read_manifest(self.dir)
+        self._write(n=50)
+        after = read_manifest(self.dir)
+        self.assertEqual(before, after[:len(before)])
+        self.assertEqual(list(range(len(after))), [e['index'] for e in after])
+
+    def test_killed_run_segment_kept(self):
+        # a run that dies leaves its open segment out of the manifest; the next run mustn't overwrite it
+        f = SegmentedFile(self.dir, max_seconds=0, compress='none')
+        f.write('{"run":1}\n')
+        f.flush()
+        killed = f._path
+        f._manifest.close()
+
+        f = SegmentedFile(self.dir, max_seconds=0, compress='none')
+        f.write('{"run":2}\n')
+        f.close()
+        with open(killed) as left:
+            self.assertEqual('{"run":1}\n', left.read())
+        self.assertEqual([1], [e['index'] for e in read_manifest(self.dir)])
+
+    def test_killed_gzip_segment_readable(self):
+        # no gzip trailer on a segment a killed run left open: it still reads up to the last flush
+        f = SegmentedFile(self.dir, max_seconds=0, compress='gzip')
+        f.write('{"n":1}\n{"n":2}\n')
+        f.flush()
+        killed = f._path
+        f._manifest.close()
+        self.assertEqual(['{"n":1}\n', '{"n":2}\n'], list(open_segment(killed)))
+
+    def test_plain_write_splits_at_lines(self):
+        f = SegmentedFile(self.dir, max_bytes=64, max_seconds=0, compress='none')
+        f.write(''.join('{{"n":{0},"pad":"xxxxxxxxxxxx"}}\n'.format(i) for i in range(10)))
+        f.close()
+        entries = read_manifest(self.dir)
+        self.assertEqual(10, sum(e['records'] for e in entries))
+        self.assertTrue(all(e['raw_bytes'] <= 64 for e in entries))
+        self.assertEqual(list(range(10)), [json.loads(line)['n'] for line in iter_lines(self.dir)])
+
+    def test_ring_entries_are_records(self):
+        # a multi-line log entry through the ring writer is one record, and the stream isn't synced every drain
+        class _Counting(SegmentedFile):
+            flushes = 0
+
+            def flush(self):
+                self.flushes += 1
+                super(_Counting, self).flush()
+
+        f = _Counting(self.dir, max_bytes=256, max_seconds=0, compress='gzip')
+        ring = RingBufferWriter(f, lambda n: 'entry {0}\n  detail\n  more\n'.format(n), flush_interval=0.01,
+                                sync_interval=60)
+        for i in range(20):
+            ring.put(i)
+            time.sleep(0.002)
+        ring.close()
+        entries = read_manifest(self.dir)
+        self.assertEqual(20, ring.written)
+        self.assertEqual(20, sum(e['records'] for e in entries))
+        self.assertEqual(0, f.flushes)
+        self.assertEqual(['entry {0}\n'.format(i) for i in range(20)],
+                         [line for line in iter_lines(self.dir) if line.startswith('entry')])
+
+    def test_oversized_record(self):
+        # one record bigger than the cap still gets written, alone in its segment
+        f = SegmentedFile(self.dir, max_bytes=16, max_seconds=0, compress='none')
+        f.write_indexed('{"small":1}\n', 1)
+        f.write_indexed('{"big":"' + 'x' * 40 + '"}\n', 1)
+        f.write_indexed('{"small":2}\n', 1)
+        f.close()
+        self.assertEqual([1, 1, 1], [e['records'] for e in read_manifest(self.dir)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import hashlib
+import json
+import unittest
+
+from ansible_diag.serialize import LazyResult, ResultFormatter
+
+
+def _sha1(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()
+
+
+class ResultFormatterTest(unittest.TestCase):
+
+    def test_projection(self):
+        f = ResultFormatter(['rc', 'delta', 'missing'])
+        self.assertEqual({'rc': 0, 'delta': '0:00:01'},
+                         f.project({'rc': 0, 'delta': '0:00:01', 'stdout': 'x', 'invocation': {}}))
+
+    def test_string_cap(self):
+        f = ResultFormatter(max_bytes=10)
+        out = f.project({'stdout': 'x' * 25, 'rc': 1})
+        self.assertEqual({'truncated': True, 'head': 'x' * 10, 'bytes': 25, 'sha1': _sha1('x' * 25)}, out['stdout'])
+        self.assertEqual(1, out['rc'])
+        self.assertEqual('short', f.project({'stdout': 'short'})['stdout'])
+
+    def test_lines_cap(self):
+        f = ResultFormatter(max_bytes=10)
+        lines = ['abcd', 'efgh', 'ijkl']
+        self.assertEqual({'truncated': True, 'head': ['abcd', 'efgh'], 'lines': 3, 'bytes': 15,
+                          'sha1': _sha1('\n'.join(lines))},
+                         f.project({'stdout_lines': lines})['stdout_lines'])
+        self.assertEqual(['abcd', 'efgh'], f.project({'stdout_lines': ['abcd', 'efgh']})['stdout_lines'])
+
+    def test_mixed_lines_cap(self):
+        # bytes and non-string elements among the lines are digested, not joined
+        f = ResultFormatter(max_bytes=8)
+        out = f.project({'stdout_lines': ['abc', b'def', 42, {'k': 1}]})['stdout_lines']
+        self.assertEqual(['abc', b'def'], out['head'])
+        self.assertEqual(4, out['lines'])
+        self.assertEqual(hashlib.sha1(b'abc\ndef\n42\n{"k":1}').hexdigest(), out['sha1'])
+        self.assertEqual(out['sha1'], f.project({'stdout_lines': [b'abc', 'def', 42, {'k': 1}]})['stdout_lines']['sha1'])
+
+    def test_bytes_lines_cap(self):
+        f = ResultFormatter(max_bytes=4)
+        out = f.project({'stderr_lines': [b'one', b'two']})['stderr_lines']
+        self.assertEqual([b'one'], out['head'])
+        self.assertEqual(hashlib.sha1(b'one\ntwo').hexdigest(), out['sha1'])
+
+    def test_no_limit(self):
+        f = ResultFormatter(max_bytes=0)
+        self.assertEqual('x' * 10000, f.project({'stdout': 'x' * 10000})['stdout'])
+
+    def test_dumps(self):
+        f = ResultFormatter(indent=None)
+        self.assertEqual('{"changed":false,"rc":0}', f.dumps({'rc': 0, 'changed': False}))
+        self.assertEqual({'when': 'now'}, json.loads(ResultFormatter().dumps({'when': 'now'})))
+
+    def test_lazy(self):
+        # nothing is projected until str(); a result changed in between is formatted as it is then
+        f = ResultFormatter(['rc'], indent=None)
+        result = {'rc': 0}
+        lazy = f.lazy(result)
+        self.assertIsInstance(lazy, LazyResult)
+        result['rc'] = 2
+        self.assertEqual('{"rc":2}', str(lazy))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import unittest
+from array import array
+
+from ansible_diag.simulate import Workload, _int_list, simulate_free, simulate_linear
+
+
+def _workload():
+    # hosts A, B, C; task 0 takes 4/1/2 seconds on them, task 1 takes 1/3/1
+    return Workload(['A', 'B', 'C'], ['t0', 't1'], [array('d', [4.0, 1.0, 2.0]), array('d', [1.0, 3.0, 1.0])])
+
+
+class SimulateTest(unittest.TestCase):
+
+    def test_linear(self):
+        w = _workload()
+        # forks 2, t0: A [0,4], B [0,1], C [1,3] -> 4; t1: A [0,1], B [0,3], C [1,2] -> 3
+        self.assertEqual(7.0, simulate_linear(w, 2))
+        # a worker per host: each task is its slowest host
+        self.assertEqual(7.0, simulate_linear(w, 3))
+        self.assertEqual(12.0, simulate_linear(w, 1))
+        # 0.5s per host x task: t0 A [0,4.5], B [0,1.5], C [1.5,4]; t1 A [0,1.5], B [0,3.5], C [1.5,3]
+        self.assertEqual(8.0, simulate_linear(w, 2, overhead=0.5))
+
+    def test_linear_serial(self):
+        # batch A, B runs the play (4 + 3), then C alone (2 + 1)
+        self.assertEqual(10.0, simulate_linear(_workload(), 2, serial=2))
+        self.assertEqual(7.0, simulate_linear(_workload(), 2, serial=3))
+
+    def test_free(self):
+        w = _workload()
+        # forks 2: A t0 [0,4], B t0 [0,1], C t0 [1,3], B t1 [3,6], C t1 [4,5], A t1 [5,6]
+        self.assertEqual(6.0, simulate_free(w, 2))
+        # a worker per host: each host's own total, longest is A at 5
+        self.assertEqual(5.0, simulate_free(w, 3))
+        self.assertEqual(12.0, simulate_free(w, 1))
+        self.assertEqual(0.0, simulate_free(Workload([], [], []), 5))
+
+    def test_from_records(self):
+        w = Workload.from_records([
+            {'host': 'A', 'taskid': 'u1', 'duration': 2.0, 'start': 100.0, 'end': 102.0},
+            {'host': 'B', 'taskid': 'u1', 'start': 100.0, 'end': 101.5},
+            {'host': 'A', 'taskid': 'u2', 'duration': 1.0, 'start': 102.0, 'end': 103.0},
+            # a loop reports several results for one host and task
+            {'host': 'A', 'taskid': 'u2', 'duration': 0.5, 'start': 103.0, 'end': 103.5},
+            {'host': 'C', 'taskid': 'u1'},
+        ])
+        self.assertEqual((['A', 'B'], ['u1', 'u2']), (w.hosts, w.tasks))
+        self.assertEqual([[2.0, 1.5], [1.5, 0.0]], [list(row) for row in w.durations])
+        self.assertEqual(3.5, w.recorded_wall)
+
+    def test_synthetic(self):
+        w = Workload.synthetic(50, 4, mean=2.0)
+        self.assertEqual((50, 4), (len(w.hosts), len(w.tasks)))
+        self.assertEqual([list(row) for row in w.durations],
+                         [list(row) for row in Workload.synthetic(50, 4, mean=2.0).durations])
+        self.assertTrue(all(d > 0 for row in w.durations for d in row))
+
+    def test_int_list(self):
+        parse = _int_list(1)
+        self.assertEqual([5, 25, 50], parse('5,25,50'))
+        self.assertEqual([0], _int_list(0)('0'))
+        for bad in ('', 'a,b', '0,5'):
+            self.assertRaises(argparse.ArgumentTypeError, parse, bad)
+
+
+if __name__ == '__main__':
+    unittest.main()
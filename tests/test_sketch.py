@@ -0,0 +1,139 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import random
+import unittest
+
+from ansible_diag.sketch import QuantileSketch, TopN
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99)
+
+
+def _exact(ordered, q):
+    # the sample the sketch aims at: rank q * (n - 1), rounded down
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+class QuantileSketchTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(7)
+        # durations from 1ms to minutes, the range the plugins see
+        self.values = [rnd.lognormvariate(0.0, 2.0) for _ in range(20000)]
+
+    def assertWithin(self, expected, got, accuracy):
+        self.assertLessEqual(abs(got - expected), accuracy * expected + 1e-12,
+                             '{0} not within {1:.0%} of {2}'.format(got, accuracy, expected))
+
+    def test_error_bound(self):
+        for accuracy in (0.01, 0.05):
+            sketch = QuantileSketch(accuracy)
+            for v in self.values:
+                sketch.add(v)
+            ordered = sorted(self.values)
+            for q in QUANTILES:
+                self.assertWithin(_exact(ordered, q), sketch.quantile(q), accuracy)
+            self.assertEqual(ordered[0], sketch.quantile(0))
+            self.assertEqual(ordered[-1], sketch.quantile(1))
+
+    def test_merge(self):
+        parts = [QuantileSketch() for _ in range(4)]
+        whole = QuantileSketch()
+        for i, v in enumerate(self.values):
+            parts[i % 4].add(v)
+            whole.add(v)
+        merged = QuantileSketch()
+        for part in parts:
+            merged.merge(part)
+
+        # bucket counts add up, so a merge is the same as one sketch over everything
+        self.assertEqual(whole.buckets, merged.buckets)
+        self.assertEqual(whole.count, merged.count)
+        self.assertAlmostEqual(whole.sum, merged.sum)
+        self.assertEqual((whole.min, whole.max), (merged.min, merged.max))
+        ordered = sorted(self.values)
+        for q in QUANTILES:
+            self.assertEqual(whole.quantile(q), merged.quantile(q))
+            self.assertWithin(_exact(ordered, q), merged.quantile(q), 0.01)
+
+    def test_merge_empty_and_mismatched(self):
+        sketch = QuantileSketch()
+        sketch.add(1.0)
+        sketch.merge(QuantileSketch())
+        self.assertEqual(1, sketch.count)
+        empty = QuantileSketch().merge(sketch)
+        self.assertEqual((1, 1.0, 1.0), (empty.count, empty.min, empty.max))
+        self.assertRaises(ValueError, sketch.merge, QuantileSketch(0.05))
+
+    def test_zeros(self):
+        sketch = QuantileSketch()
+        for v in [0.0] * 10 + [2.0] * 10:
+            sketch.add(v)
+        self.assertEqual(0.0, sketch.quantile(0.25))
+        self.assertWithin(2.0, sketch.quantile(0.9), 0.01)
+        self.assertEqual(10, sketch.zero_count)
+
+    def test_bucket_cap(self):
+        full = QuantileSketch()
+        for v in self.values:
+            full.add(v)
+        cap = len(full.buckets) - 100
+        sketch = QuantileSketch(max_buckets=cap)
+        for v in self.values:
+            sketch.add(v)
+        self.assertEqual(cap, len(sketch.buckets))
+        self.assertEqual(len(self.values), sketch.count)
+        # folding only touches the low end
+        ordered = sorted(self.values)
+        for q in (0.5, 0.9, 0.99):
+            self.assertWithin(_exact(ordered, q), sketch.quantile(q), 0.01)
+
+    def test_empty(self):
+        sketch = QuantileSketch()
+        self.assertIsNone(sketch.quantile(0.5))
+        self.assertIsNone(sketch.mean)
+
+
+class TopNTest(unittest.TestCase):
+
+    def test_keeps_largest(self):
+        rnd = random.Random(3)
+        keys = [rnd.random() for _ in range(1000)]
+        top = TopN(5)
+        for i, k in enumerate(keys):
+            top.push(k, 'item{0}'.format(i))
+        self.assertEqual(5, len(top))
+        expected = sorted(((k, 'item{0}'.format(i)) for i, k in enumerate(keys)), reverse=True)[:5]
+        self.assertEqual(expected, top.items())
+
+    def test_ties_and_uncomparable_items(self):
+        top = TopN(2)
+        for item in ({'a': 1}, {'b': 2}, {'c': 3}):
+            top.push(1.0, item)
+        self.assertEqual([1.0, 1.0], [k for k, _ in top.items()])
+
+    def test_zero(self):
+        top = TopN(0)
+        top.push(1.0, 'x')
+        self.assertEqual([], top.items())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.stragglers import StragglerReport
+
+HOSTS = ('a', 'b', 'c', 'd', 'e')
+
+
+def _task(report, taskid, durations, start=0.0):
+    for host, duration in zip(HOSTS, durations):
+        report.add({'host': host, 'taskid': taskid, 'taskname': taskid, 'duration': duration,
+                    'start': start, 'end': start + duration})
+
+
+class StragglerReportTest(unittest.TestCase):
+
+    def _report(self):
+        report = StragglerReport(factor=1.5, min_delta=1.0)
+        _task(report, 't1', [2.0, 2.0, 3.0, 2.0, 10.0])
+        _task(report, 't2', [1.2, 1.0, 1.0, 1.0, 1.0], start=10.0)
+        _task(report, 't3', [1.0, 1.0, 1.0, 1.0, 5.0], start=20.0)
+        return report.compute()
+
+    def test_barriers(self):
+        t1, t2, t3 = self._report().barriers
+        # median 2, cutoff max(2 * 1.5, 2 + 1) = 3: only e straggles, and without it t1 ends with c at 3s
+        self.assertEqual(('t1', 5, 2.0, 10.0), (t1.name, t1.hosts, t1.median, t1.slowest))
+        self.assertEqual([('e', 10.0)], t1.stragglers)
+        self.assertEqual(7.0, t1.lost)
+        self.assertEqual(8.0 + 8.0 + 7.0 + 8.0, t1.wait)
+        # 1.2s is slowest but within the cutoff (2.0)
+        self.assertEqual(([], 0.0), (t2.stragglers, t2.lost))
+        self.assertAlmostEqual(0.8, t2.wait)
+        self.assertEqual(([('e', 5.0)], 4.0), (t3.stragglers, t3.lost))
+
+    def test_totals(self):
+        report = self._report()
+        self.assertEqual(11.0, report.lost)
+        self.assertAlmostEqual(31.0 + 0.8 + 16.0, report.wait)
+
+    def test_ranked_hosts(self):
+        rows = self._report().ranked_hosts()
+        host, mean, _, tasks, straggler, slowest = rows[0]
+        self.assertEqual(('e', 3, 2, 2), (host, tasks, straggler, slowest))
+        self.assertAlmostEqual(11.0 / 3, mean)
+        self.assertEqual(set(HOSTS), set(r[0] for r in rows))
+        self.assertEqual([], self._report().ranked_hosts(min_tasks=4))
+
+    def test_durations_only(self):
+        # no times: hosts are taken to start together, so a host's end is its duration
+        report = StragglerReport()
+        for host, duration in (('a', 1.0), ('b', 1.0), ('c', 4.0)):
+            report.add({'host': host, 'taskname': 'x', 'duration': duration})
+        report.add({'host': 'd', 'taskname': 'x'})
+        barrier, = report.compute().barriers
+        self.assertEqual((3, 6.0, 3.0), (barrier.hosts, barrier.wait, barrier.lost))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.timeline import Timeline
+
+
+class TimelineTest(unittest.TestCase):
+
+    def test_host_spans(self):
+        timeline = Timeline()
+        timeline.task_start('u1', 'install', 100.0)
+        timeline.host_done('u1', 'web1', 102.0, 'ok', remote=1.5)
+        timeline.host_done('u1', 'web2', 104.0, 'changed', remote=3.0)
+        timeline.host_done('u1', 'web3', 101.0, 'ok')
+        span = timeline.tasks['u1']
+        self.assertEqual((3, 4.0), (span.hosts, span.wall))
+        self.assertEqual((1.0, 4.0, 7.0), (span.durations.min, span.durations.max, span.durations.sum))
+        self.assertEqual({'ok': 2, 'changed': 1}, span.statuses)
+        self.assertEqual(4.5, span.remote)
+        # 7 host seconds over 4 wall seconds
+        self.assertEqual(1.75, span.parallelism())
+
+    def test_same_name_kept_apart(self):
+        # a role used twice: same task name, different task objects
+        timeline = Timeline()
+        timeline.task_start('u1', 'common : ntp', 0.0)
+        timeline.task_start('u2', 'common : ntp', 5.0)
+        timeline.host_done('u1', 'web1', 6.0, 'ok')
+        timeline.host_done('u2', 'web1', 7.0, 'ok')
+        first, second = list(timeline)
+        self.assertEqual((6.0, 2.0), (first.durations.max, second.durations.max))
+
+    def test_task_without_results(self):
+        # ends when the next task starts, or at finish
+        timeline = Timeline()
+        timeline.task_start('u1', 'skipped everywhere', 0.0)
+        timeline.task_start('u2', 'last', 3.0)
+        timeline.finish(10.0)
+        self.assertEqual([3.0, 7.0], [span.wall for span in timeline])
+        self.assertEqual(0.0, timeline.tasks['u1'].parallelism())
+
+    def test_restarted_uuid(self):
+        # a handler flushed twice: the second flush is its own span, timed from its own start
+        timeline = Timeline()
+        timeline.task_start('h1', 'restart', 0.0)
+        timeline.host_done('h1', 'web1', 2.0, 'ok')
+        timeline.task_start('t2', 'deploy', 2.0)
+        timeline.task_start('h1', 'restart', 10.0)
+        timeline.host_done('h1', 'web1', 11.0, 'ok')
+        spans = list(timeline)
+        self.assertEqual(3, len(spans))
+        self.assertEqual([2.0, 1.0], [spans[0].durations.max, spans[2].durations.max])
+        self.assertIs(spans[2], timeline.tasks['h1'])
+
+    def test_unknown_uuid_goes_to_current(self):
+        timeline = Timeline()
+        timeline.host_done('u0', 'web1', 1.0, 'ok')
+        timeline.task_start('u1', 'ping', 0.0)
+        timeline.host_done(None, 'web1', 1.0, 'ok')
+        self.assertEqual(1, timeline.tasks['u1'].hosts)
+
+
+if __name__ == '__main__':
+    unittest.main()
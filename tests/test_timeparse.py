@@ -0,0 +1,120 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import random
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from ansible_diag import timeparse
+from ansible_diag.timeparse import format_delta, format_timestamp, parse_delta, parse_timestamp
+
+
+def _strptime(s):
+    # what the plugins did before timeparse
+    dt = datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f')
+    return time.mktime(dt.timetuple()) + dt.microsecond / 1000000.0
+
+
+class ParseTimestampTest(unittest.TestCase):
+
+    def test_matches_strptime(self):
+        rnd = random.Random(11)
+        base = datetime(2016, 1, 1)
+        for _ in range(2000):
+            dt = base + timedelta(seconds=rnd.uniform(0, 3 * 365 * 86400))
+            s = str(dt) if dt.microsecond else str(dt) + '.000000'
+            self.assertAlmostEqual(_strptime(s), parse_timestamp(s), places=6, msg=s)
+
+    def test_microseconds(self):
+        s = '2016-03-27 00:58:07.323882'
+        self.assertAlmostEqual(0.323882, parse_timestamp(s) - parse_timestamp('2016-03-27 00:58:07.000000'), places=6)
+        self.assertAlmostEqual(0.000001, parse_timestamp('2016-03-27 00:58:07.000001') -
+                               parse_timestamp('2016-03-27 00:58:07.000000'), places=6)
+        self.assertAlmostEqual(_strptime(s), parse_timestamp(s), places=6)
+
+    def test_without_microseconds(self):
+        # str(datetime) leaves the fraction off when it is zero
+        self.assertAlmostEqual(_strptime('2016-03-27 00:58:07.000000'), parse_timestamp('2016-03-27 00:58:07'),
+                               places=6)
+
+    def test_garbage(self):
+        for s in ('', 'yesterday', '2016-03-27', '2016-03-27 xx:58:07.1', '2016-13-27 00:58:07.1',
+                  '2016-02-30 00:58:07.1', '2016-03-27 24:58:07.1', '2016-03-27 00:61:07.1', '2016-03-27 00:58:99.1'):
+            self.assertRaises(ValueError, parse_timestamp, s)
+
+    def test_garbage_after_cached_hour(self):
+        parse_timestamp('2016-03-27 00:58:07.1')
+        self.assertRaises(ValueError, parse_timestamp, '2016-03-27 00:75:07.1')
+
+    def test_format_round_trip(self):
+        s = '2016-03-27 00:58:07.323882'
+        self.assertEqual(s, format_timestamp(parse_timestamp(s)))
+
+    @unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+    def test_dst(self):
+        # hours on both sides of the US spring forward and fall back, where a per day cache would go wrong
+        old = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        timeparse._hour_cache.clear()
+        try:
+            for day, hours in (('2016-03-13', (0, 1, 3, 4)), ('2016-11-06', (0, 2, 3))):
+                for hour in hours:
+                    s = '{0} {1:02d}:30:15.250000'.format(day, hour)
+                    self.assertAlmostEqual(_strptime(s), parse_timestamp(s), places=6, msg=s)
+        finally:
+            if old is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old
+            time.tzset()
+            timeparse._hour_cache.clear()
+
+
+class ParseDeltaTest(unittest.TestCase):
+
+    def test_matches_timedelta(self):
+        for seconds in (0.0, 0.501769, 59.999999, 61.5, 3600.000001, 86399.25, 86400.0, 90061.125, 3 * 86400 + 7.5):
+            s = str(timedelta(seconds=seconds))
+            self.assertAlmostEqual(seconds, parse_delta(s), places=6, msg=s)
+
+    def test_microseconds(self):
+        self.assertAlmostEqual(0.501769, parse_delta('0:00:00.501769'), places=9)
+        self.assertAlmostEqual(0.000001, parse_delta('0:00:00.000001'), places=9)
+        self.assertEqual(1.0, parse_delta('0:00:01'))
+
+    def test_negative(self):
+        # clock steps on the host give negative deltas, which str(timedelta) writes as "-1 day, 23:59:58.500000"
+        for seconds in (-1.5, -0.000001, -3600.25, -86400.0, -90000.5):
+            s = str(timedelta(seconds=seconds))
+            self.assertAlmostEqual(seconds, parse_delta(s), places=6, msg=s)
+        self.assertAlmostEqual(-1.5, parse_delta('-1 day, 23:59:58.500000'), places=9)
+
+    def test_format_round_trip(self):
+        for seconds in (0.0, 0.501769, 2.0, 90061.125, -1.5):
+            self.assertAlmostEqual(seconds, parse_delta(format_delta(seconds)), places=6)
+        self.assertEqual('0:00:02.000000', format_delta(2.0))
+        self.assertEqual('1 day, 1:01:01.125000', format_delta(90061.125))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import json
+import unittest
+
+from ansible_diag.trace import export
+
+
+def _rec(host, play, role, task, start, end):
+    return {'host': host, 'play': play, 'rolename': role, 'taskname': task, 'runnercode': 'ok',
+            'start': start, 'end': end, 'duration': end - start}
+
+
+class _File(object):
+    # the export writes native str, which io.StringIO won't take on python 2
+    def __init__(self):
+        self.parts = []
+
+    def write(self, s):
+        self.parts.append(s)
+
+
+class TraceExportTest(unittest.TestCase):
+
+    def _export(self, records):
+        f = _File()
+        n = export(records, f, 'site.yml')
+        trace = json.loads(''.join(f.parts))
+        self.assertEqual(n, len(trace['traceEvents']))
+        return trace['traceEvents']
+
+    def test_nesting(self):
+        events = self._export([
+            _rec('web1', 'deploy', 'common', 'ntp', 10.0, 11.0),
+            _rec('web1', 'deploy', 'common', 'users', 11.0, 11.5),
+            _rec('web1', 'deploy', 'app', 'install', 12.0, 15.0),
+            _rec('web1', 'verify', 'app', 'check', 16.0, 16.25),
+            _rec('web2', 'deploy', None, None, 10.5, 12.0),
+        ])
+        meta = [e for e in events if e['ph'] == 'M']
+        self.assertEqual({'name': 'site.yml'}, meta[0]['args'])
+        self.assertEqual(['web1', 'web2'], [e['args']['name'] for e in meta if e['name'] == 'thread_name'])
+
+        spans = [(e['tid'], e['cat'], e['name'], e['ts'], e['dur']) for e in events if e['ph'] == 'X']
+        tasks = [s for s in spans if s[1] == 'task']
+        self.assertEqual([(1, 'task', 'ntp', 10000000, 1000000), (1, 'task', 'users', 11000000, 500000),
+                          (1, 'task', 'install', 12000000, 3000000), (1, 'task', 'check', 16000000, 250000),
+                          (2, 'task', '(unnamed task)', 10500000, 1500000)], tasks)
+        # consecutive tasks of a role on a host make one role span; a new play starts a new role span even for the
+        # same role
+        self.assertEqual([(1, 'role', 'common', 10000000, 1500000), (1, 'role', 'app', 12000000, 3000000),
+                          (1, 'role', 'app', 16000000, 250000), (2, 'role', '(no role)', 10500000, 1500000)],
+                         sorted((s for s in spans if s[1] == 'role'), key=lambda s: (s[0], s[3])))
+        self.assertEqual([(1, 'play', 'deploy', 10000000, 5000000), (1, 'play', 'verify', 16000000, 250000),
+                          (2, 'play', 'deploy', 10500000, 1500000)],
+                         sorted((s for s in spans if s[1] == 'play'), key=lambda s: (s[0], s[3])))
+
+    def test_controller_clock(self):
+        # with controller times the spans are on the controller's clock, not the hosts'
+        rec = _rec('web1', 'p', None, 'sleep', 9000.0, 9002.0)
+        rec.update({'ctl_start': 100.0, 'ctl_end': 103.0})
+        task = [e for e in self._export([rec]) if e.get('cat') == 'task'][0]
+        self.assertEqual((101000000, 2000000), (task['ts'], task['dur']))
+        self.assertEqual({'status': 'ok', 'role': None, 'duration': 2.0}, task['args'])
+
+    def test_records_without_times(self):
+        events = self._export([{'host': 'web1', 'taskname': 'facts'}])
+        self.assertEqual(1, len(events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import unittest
+
+from ansible_diag.tree import RollupTree
+
+
+class RollupTreeTest(unittest.TestCase):
+
+    def _tree(self):
+        tree = RollupTree('site.yml')
+        tree.add('web1', 'common', 'ntp', 'ok', changed=True, start=10.0, end=12.0, duration=2.0)
+        tree.add('web1', 'common', 'users', 'ok', start=12.0, end=13.0, duration=1.0)
+        tree.add('web1', None, 'pause', 'skipped')
+        tree.add('web1', 'common', 'ntp', 'failed', start=20.0, end=24.0, duration=4.0)
+        tree.add('web2', 'common', 'ntp', 'ok', start=11.0, end=14.0, duration=3.0)
+        return tree.to_dict()
+
+    def test_role_instances(self):
+        # a role run again after something else is a new instance; each host counts its own
+        d = self._tree()
+        self.assertEqual(['web1', 'web2'], list(d['children']))
+        self.assertEqual(['common [1]', '(no role) [1]', 'common [2]'], list(d['children']['web1']['children']))
+        self.assertEqual(['common [1]'], list(d['children']['web2']['children']))
+        self.assertEqual(['ntp', 'users'], list(d['children']['web1']['children']['common [1]']['children']))
+
+    def test_rollups(self):
+        d = self._tree()
+        self.assertEqual('site.yml', d['name'])
+        self.assertEqual(10.0, d['runtime'])
+        self.assertEqual({'ok': 3, 'failed': 1, 'skipped': 1, 'changed': 1}, d['counts'])
+        self.assertEqual({'start': 10.0, 'end': 24.0, 'seconds': 14.0}, d['timespan'])
+
+        web1 = d['children']['web1']
+        self.assertEqual(7.0, web1['runtime'])
+        first = web1['children']['common [1]']
+        self.assertEqual(3.0, first['runtime'])
+        self.assertEqual({'ok': 2, 'changed': 1}, first['counts'])
+        self.assertEqual({'start': 10.0, 'end': 13.0, 'seconds': 3.0}, first['timespan'])
+
+        # no times at all: no span, and no children key on a leaf
+        pause = web1['children']['(no role) [1]']['children']['pause']
+        self.assertEqual({'start': None, 'end': None, 'seconds': None}, pause['timespan'])
+        self.assertNotIn('children', pause)
+
+    def test_current_mid_run(self):
+        # rollups are kept as results arrive, so the tree can be read at any point
+        tree = RollupTree()
+        tree.add('web1', None, None, 'ok', duration=1.5)
+        self.assertEqual(1.5, tree.to_dict()['runtime'])
+        self.assertIn('(unnamed task)', tree.to_dict()['children']['web1']['children']['(no role) [1]']['children'])
+        tree.add('web1', None, 'next', 'ok', duration=0.5)
+        self.assertEqual(2.0, tree.to_dict()['runtime'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+#
+# (C) 2016  Matt Young <halcyondude@gmail.com>
+#
+# This file is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# File is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# See <http://www.gnu.org/licenses/> for a copy of the
+# GNU General Public License
+
+# Make coding more python3-ish
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import threading
+import time
+import unittest
+
+from ansible_diag import writer as writer_module
+from ansible_diag.writer import BackgroundWriter, RingBufferWriter
+
+
+class _Stream(object):
+    # collects writes; the first write can be held back (gate) or made to fail (broken)
+    def __init__(self, gate=None, broken=False):
+        self.chunks = []
+        self.flushes = 0
+        self.closed = False
+        self._gate = gate
+        self._broken = broken
+
+    def write(self, s):
+        if self._gate is not None:
+            self._gate.wait()
+        if self._broken:
+            raise IOError('disk full')
+        self.chunks.append(s)
+
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
+
+
+class BackgroundWriterTest(unittest.TestCase):
+
+    def test_writes_in_order(self):
+        stream = _Stream()
+        writer = BackgroundWriter(stream, format_item=lambda n: '{0}\n'.format(n), batch_size=3)
+        for i in range(10):
+            writer.put(i)
+        writer.close()
+        writer.close()
+        self.assertEqual(''.join('{0}\n'.format(i) for i in range(10)), ''.join(stream.chunks))
+        self.assertEqual((10, 0, 0), (writer.written, writer.dropped, writer.errors))
+        self.assertTrue(stream.closed)
+
+    def test_full_queue_drops(self):
+        gate = threading.Event()
+        writer = BackgroundWriter(_Stream(gate), maxsize=5, batch_size=1)
+        for i in range(20):
+            writer.put(i)
+        gate.set()
+        writer.close()
+        self.assertEqual(20, writer.written + writer.dropped)
+        self.assertGreater(writer.dropped, 0)
+
+    def test_format_errors_counted(self):
+        stream = _Stream()
+        writer = BackgroundWriter(stream, format_item=lambda n: '{0}\n'.format(10 // n))
+        for n in (1, 0, 2):
+            writer.put(n)
+        writer.close()
+        self.assertEqual('10\n5\n', ''.join(stream.chunks))
+        self.assertEqual((2, 1), (writer.written, writer.errors))
+
+    def test_stop_inside_batch(self):
+        # the stop marker isn't always the last thing a batch picks up
+        gate = threading.Event()
+        stream = _Stream(gate)
+        writer = BackgroundWriter(stream, batch_size=10)
+        writer.put('a')
+        time.sleep(0.05)
+        writer._queue.put(writer_module._STOP)
+        writer._queue.put('b')
+        gate.set()
+        writer._thread.join(5)
+        self.assertFalse(writer._thread.is_alive())
+        self.assertEqual('ab', ''.join(stream.chunks))
+        self.assertTrue(stream.closed)
+
+    def test_close_after_thread_died(self):
+        # a stream that raises kills the writer thread; close() mustn't wait forever on the full queue
+        writer = BackgroundWriter(_Stream(broken=True), maxsize=2, batch_size=1)
+        writer.put('x')
+        writer._thread.join(5)
+        writer.put('y')
+        writer.put('z')
+        started = time.time()
+        writer.close()
+        self.assertLess(time.time() - started, 2)
+
+
+class RingBufferWriterTest(unittest.TestCase):
+
+    def test_overwrites_oldest(self):
+        gate = threading.Event()
+        stream = _Stream(gate)
+        writer = RingBufferWriter(stream, maxlen=3, flush_interval=60)
+        for i in range(5):
+            writer.put(i)
+        gate.set()
+        writer.close()
+        self.assertEqual('234', ''.join(stream.chunks))
+        self.assertEqual((3, 2), (writer.written, writer.dropped))
+
+    def test_sync_interval(self):
+        stream = _Stream()
+        writer = RingBufferWriter(stream, flush_interval=0.01, sync_interval=60)
+        writer.put('a')
+        time.sleep(0.05)
+        writer.close()
+        self.assertEqual(('a', 0), (''.join(stream.chunks), stream.flushes))
+
+        stream = _Stream()
+        writer = RingBufferWriter(stream, flush_interval=0.01)
+        writer.put('a')
+        time.sleep(0.1)
+        writer.close()
+        self.assertEqual(1, stream.flushes)
+
+
+if __name__ == '__main__':
+    unittest.main()